@@ -50,6 +50,7 @@ OPENAI_COMPAT_PORT = 8010
 # ==================== Protobuf主服务 (server.py) ====================
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 8000
+SERVER_UDS = None  # 设置为套接字路径（如 "/tmp/warp_bridge.sock"）时改为监听 Unix domain socket，可被环境变量 WARP_BRIDGE_UDS 覆盖
 
 # ==================== 日志配置 ====================
 LOG_LEVEL = "INFO"
@@ -113,7 +113,12 @@ SERVICES = {
 def start_all_services():
     """启动所有服务"""
     processes = []
+    embedded = os.getenv("WARP_BRIDGE_MODE", "http").strip().lower() == "embedded"
     for name, target_func in SERVICES.items():
+        if name == "server" and embedded:
+            # embedded 模式下 OpenAI 兼容服务在进程内直接调用 Warp，不再需要独立的 bridge 进程
+            logger.info("WARP_BRIDGE_MODE=embedded，跳过 'server' 服务。")
+            continue
         process = multiprocessing.Process(target=target_func, name=f"Process-{name}")
         processes.append(process)
         process.start()
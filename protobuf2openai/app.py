@@ -2,11 +2,14 @@ from __future__ import annotations
 
 import asyncio
 
-import httpx
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
-from .bridge import initialize_once
-from .config import BRIDGE_BASE_URL, WARMUP_INIT_RETRIES, WARMUP_INIT_DELAY_S
+from warp2protobuf.core.metrics import METRICS_CONTENT_TYPE, render_metrics
+
+from .bridge import close_http_client, get_http_client, initialize_once
+from .config import BRIDGE_BASE_URL, BRIDGE_MODE, EMBEDDED_BRIDGE, WARMUP_INIT_RETRIES, WARMUP_INIT_DELAY_S
+from .ingest import log_json_backend
 from .logging import logger
 from .router import router
 
@@ -14,21 +17,18 @@ app = FastAPI(title="OpenAI Chat Completions - Streaming")
 app.include_router(router)
 
 
-@app.on_event("startup")
-async def _on_startup():
-    try:
-        logger.info("[OpenAI Compat] Server starting. BRIDGE_BASE_URL=%s", BRIDGE_BASE_URL)
-        logger.info("[OpenAI Compat] Endpoints: GET /healthz, GET /v1/models, POST /v1/chat/completions")
-    except Exception:
-        pass
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 
+async def _wait_for_bridge() -> None:
     url = f"{BRIDGE_BASE_URL}/healthz"
     retries = WARMUP_INIT_RETRIES
     delay_s = WARMUP_INIT_DELAY_S
     for attempt in range(1, retries + 1):
         try:
-            async with httpx.AsyncClient(timeout=5.0, trust_env=True) as client:
-                resp = await client.get(url)
+            resp = await get_http_client().get(url, timeout=5.0)
             if resp.status_code == 200:
                 logger.info("[OpenAI Compat] Bridge server is ready at %s", url)
                 break
@@ -40,6 +40,25 @@ async def _on_startup():
     else:
         logger.error("[OpenAI Compat] Bridge server not ready at %s", url)
 
+
+@app.on_event("startup")
+async def _on_startup():
+    try:
+        logger.info("[OpenAI Compat] Server starting. BRIDGE_MODE=%s, BRIDGE_BASE_URL=%s", BRIDGE_MODE, BRIDGE_BASE_URL)
+        logger.info("[OpenAI Compat] Endpoints: GET /healthz, GET /v1/models, POST /v1/chat/completions, GET /metrics")
+        log_json_backend()
+    except Exception:
+        pass
+
+    if EMBEDDED_BRIDGE:
+        try:
+            from .embedded import embedded_startup
+            embedded_startup()
+        except Exception as e:
+            logger.error("[OpenAI Compat] Embedded bridge initialization failed: %s", e)
+    else:
+        await _wait_for_bridge()
+
     try:
         await initialize_once()
     except Exception as e:
@@ -51,9 +70,9 @@ async def _on_shutdown():
     """清理全局资源"""
     try:
         # 关闭全局 HTTP 客户端
-        from .bridge import _http_client
-        if _http_client is not None:
-            await _http_client.aclose()
-            logger.info("[OpenAI Compat] Global HTTP client closed")
+        await close_http_client()
+        if EMBEDDED_BRIDGE:
+            from .embedded import embedded_shutdown
+            await embedded_shutdown()
     except Exception as e:
         logger.warning(f"[OpenAI Compat] Error during shutdown: {e}")
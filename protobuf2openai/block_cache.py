@@ -0,0 +1,69 @@
+"""
+请求中重复出现的大块内容的编码缓存
+
+Agent 客户端每一轮都发送相同的 tools 列表。按内容哈希缓存其 schema 清洗并编码后的
+MCPContext protobuf 字节，命中时跳过 sanitize_mcp_input_schema_in_packet 与 Struct 填充。
+按条目数做 LRU 淘汰，命中/未命中计入 openai_block_cache_requests_total。
+"""
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Generic, List, Optional, TypeVar
+
+from .config import BLOCK_CACHE_SIZE
+from .helpers import model_json
+from .metrics import BLOCK_CACHE
+from .models import OpenAITool
+
+T = TypeVar("T")
+
+
+class BlockCache(Generic[T]):
+    """内容寻址的 LRU（按条目数）"""
+
+    def __init__(self, block: str, capacity: int):
+        self.block = block
+        self.capacity = capacity
+        self._entries: "OrderedDict[bytes, T]" = OrderedDict()
+        self._lock = Lock()
+        self._hits = BLOCK_CACHE.labels(block=block, result="hit")
+        self._misses = BLOCK_CACHE.labels(block=block, result="miss")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_build(self, key: bytes, build: Callable[[], T]) -> T:
+        if self.capacity <= 0:
+            return build()
+        with self._lock:
+            value: Optional[T] = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is not None:
+            self._hits.inc()
+            return value
+        self._misses.inc()
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+MCP_CONTEXT_CACHE: BlockCache[bytes] = BlockCache("mcp_context", BLOCK_CACHE_SIZE)
+
+
+def tools_key(tools: List[OpenAITool]) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for tool in tools:
+        h.update(model_json(tool).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.digest()
@@ -0,0 +1,172 @@
+"""
+Chat completion 响应缓存
+
+- 键：原始请求体（快速摄取模式）或规范化请求 JSON 的 blake2b 摘要，每个请求只计算一次
+- 过期：WARP_CACHE_TTL 秒（0 表示关闭）；容量：按条目字节总数（WARP_CACHE_MAX_BYTES）做 LRU 淘汰
+- 非流式请求缓存最终的 chat.completion 字典；流式请求记录输出的 SSE 字节序列，命中时原样回放
+  （回放内容与首次响应完全相同，包括 id / created）
+- 请求头 Cache-Control: no-cache 跳过读取但刷新缓存，no-store 既不读也不写，也不与并发的相同请求合并
+  （不参与 single-flight，总是单独访问上游）；响应头 X-Cache 给出结果
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional
+
+from .chunks import DONE_BYTES
+from .config import CACHE_MAX_BYTES, CACHE_TTL_S
+from .helpers import model_json
+from .metrics import CACHE_BYTES, CACHE_ENTRIES, CACHE_REQUESTS
+from .models import ChatCompletionsRequest
+
+CACHE_STATUS_HEADER = "X-Cache"
+
+MODE_USE = "use"
+MODE_REFRESH = "refresh"
+MODE_BYPASS = "bypass"
+
+_FINISH_MARK = b'"finish_reason": '
+_ERROR_FINISH = b'"finish_reason": "error"'
+
+
+class CacheEntry:
+    __slots__ = ("expires_at", "size", "final", "chunks")
+
+    def __init__(self, expires_at: float, size: int, final: Optional[Dict[str, Any]], chunks: Optional[List[bytes]]):
+        self.expires_at = expires_at
+        self.size = size
+        self.final = final
+        self.chunks = chunks
+
+
+class ResponseCache:
+    """线程安全的 TTL + 字节上限 LRU"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self._publish()
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put_final(self, key: str, final: Dict[str, Any], size: int) -> None:
+        self._put(key, CacheEntry(0.0, size, final, None))
+
+    def put_chunks(self, key: str, chunks: List[bytes]) -> None:
+        self._put(key, CacheEntry(0.0, sum(len(c) for c in chunks), None, chunks))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._publish()
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        if not self.enabled or entry.size > self.max_bytes:
+            return
+        entry.expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            self._publish()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _publish(self) -> None:
+        CACHE_ENTRIES.set(len(self._entries))
+        CACHE_BYTES.set(self._bytes)
+
+
+RESPONSE_CACHE = ResponseCache(CACHE_MAX_BYTES, CACHE_TTL_S)
+
+
+def request_cache_key(req: ChatCompletionsRequest) -> str:
+    """请求的规范化摘要（模型、消息、工具、stream 等全部字段）"""
+    return hashlib.blake2b(model_json(req).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def body_cache_key(body: bytes) -> str:
+    """原始请求体的摘要（快速摄取模式使用，省去重新序列化；空白或键顺序不同的请求视为不同请求）"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def cache_mode(headers: Mapping[str, str]) -> str:
+    directives = (headers.get("cache-control") or "").lower()
+    if "no-store" in directives:
+        return MODE_BYPASS
+    if "no-cache" in directives:
+        return MODE_REFRESH
+    return MODE_USE
+
+
+def count_lookup(result: str) -> None:
+    CACHE_REQUESTS.labels(result=result).inc()
+
+
+class StreamRecorder:
+    """记录流式输出；只有以 finish_reason（非 error）+ [DONE] 正常结束的流才写入缓存"""
+
+    __slots__ = ("key", "chunks", "size", "overflow")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.overflow = False
+
+    def add(self, chunk: bytes) -> None:
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > RESPONSE_CACHE.max_bytes:
+            self.overflow = True
+            self.chunks = []
+            return
+        self.chunks.append(chunk)
+
+    def complete(self) -> bool:
+        chunks = self.chunks
+        return (not self.overflow and len(chunks) >= 2 and chunks[-1] == DONE_BYTES
+                and _FINISH_MARK in chunks[-2] and _ERROR_FINISH not in chunks[-2])
+
+    def commit(self) -> None:
+        if self.complete():
+            RESPONSE_CACHE.put_chunks(self.key, self.chunks)
+
+
+async def replay_chunks(chunks: List[bytes]):
+    for chunk in chunks:
+        yield chunk
@@ -0,0 +1,90 @@
+"""
+OpenAI chat.completion.chunk 的 SSE 字节渲染
+
+每个补全的 id / created / model 固定不变，ChunkEmitter 预先渲染 "data: {...\"delta\": " 前缀和各种结尾，
+每个文本增量只需转义一次文本。输出与 json.dumps(chunk, ensure_ascii=False) 逐字节一致。
+"""
+from __future__ import annotations
+
+import json
+import logging
+from json.encoder import encode_basestring
+from typing import Any, Dict, Optional
+
+from .logging import logger
+
+DONE_BYTES = b"data: [DONE]\n\n"
+
+_END = b"}]}\n\n"
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class ChunkEmitter:
+    """为单个补全渲染 SSE 数据行（bytes）"""
+
+    __slots__ = ("completion_id", "created_ts", "model_id", "_prefix", "_role", "_finish")
+
+    def __init__(self, completion_id: str, created_ts: int, model_id: str):
+        self.completion_id = completion_id
+        self.created_ts = created_ts
+        self.model_id = model_id
+        head = (f'data: {{"id": {_dumps(completion_id)}, "object": "chat.completion.chunk", '
+                f'"created": {_dumps(created_ts)}, "model": {_dumps(model_id)}, '
+                f'"choices": [{{"index": 0, "delta": ')
+        self._prefix = head.encode("utf-8")
+        self._role = self._prefix + b'{"role": "assistant"}' + _END
+        self._finish: Dict[str, bytes] = {}
+
+    def chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+        """完整的 chunk 字典（用于需要附加字段的少见情况）"""
+        choice: Dict[str, Any] = {"index": 0, "delta": delta}
+        if finish_reason is not None:
+            choice["finish_reason"] = finish_reason
+        return {
+            "id": self.completion_id,
+            "object": "chat.completion.chunk",
+            "created": self.created_ts,
+            "model": self.model_id,
+            "choices": [choice],
+        }
+
+    def role(self) -> bytes:
+        return self._log(self._role, "emit")
+
+    def content(self, text: str) -> bytes:
+        line = b"".join((self._prefix, b'{"content": ', encode_basestring(text).encode("utf-8"), b"}", _END))
+        return self._log(line, "emit")
+
+    def tool_call(self, call_id: str, name: Any, arguments: str) -> bytes:
+        delta = {
+            "tool_calls": [{
+                "index": 0,
+                "id": call_id,
+                "type": "function",
+                "function": {"name": name, "arguments": arguments},
+            }]
+        }
+        line = self._prefix + _dumps(delta).encode("utf-8") + _END
+        return self._log(line, "emit tool_calls")
+
+    def finish(self, finish_reason: str) -> bytes:
+        line = self._finish.get(finish_reason)
+        if line is None:
+            line = self._finish[finish_reason] = (
+                self._prefix + b'{}, "finish_reason": ' + _dumps(finish_reason).encode("utf-8") + _END)
+        return self._log(line, "emit done")
+
+    def error(self, message: str) -> bytes:
+        chunk = self.chunk({}, "error")
+        chunk["error"] = {"message": message}
+        return self._log(f"data: {_dumps(chunk)}\n\n".encode("utf-8"), "emit error")
+
+    @staticmethod
+    def _log(line: bytes, label: str) -> bytes:
+        # 打印转换后的 OpenAI SSE 事件（仅 DEBUG 级别时才解码）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[OpenAI Compat] 转换后的 SSE(%s): %s", label, line[6:-2].decode("utf-8"))
+        return line
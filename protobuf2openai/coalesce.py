@@ -0,0 +1,137 @@
+"""
+流式文本增量合并
+
+上游经常每个 append_to_message_content 事件只带一两个字符。该阶段位于事件解码与 SSE 输出之间，
+把连续的纯文本事件合并为一个，在以下任一条件满足时输出：
+- 第一个缓冲增量等待超过时间窗口（WARP_COALESCE_WINDOW_MS）
+- 缓冲文本超过字节阈值（WARP_COALESCE_MAX_BYTES）
+- 收到工具调用、结束、带 ID 的事件或其它非纯文本事件（先输出缓冲文本再原样转发该事件）
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional
+
+from warp2protobuf.core.event_record import EVENT_CLIENT_ACTIONS, PART_TEXT, ResponseEventRecord
+
+from .logging import logger
+
+
+class CoalesceStats:
+    """进程累计的合并统计"""
+
+    __slots__ = ("streams", "deltas_in", "chunks_out", "bytes")
+
+    def __init__(self):
+        self.streams = 0
+        self.deltas_in = 0
+        self.chunks_out = 0
+        self.bytes = 0
+
+    def snapshot(self) -> dict:
+        return {"streams": self.streams, "deltas_in": self.deltas_in,
+                "chunks_out": self.chunks_out, "bytes": self.bytes}
+
+
+COALESCE_STATS = CoalesceStats()
+
+
+def _is_text_only(record: ResponseEventRecord) -> bool:
+    """只含文本增量、且不携带任何 ID（如同一事件中的 create_task）的事件才参与合并"""
+    if record.kind != EVENT_CLIENT_ACTIONS or not record.parts:
+        return False
+    if record.task_id is not None or record.conversation_id is not None or record.request_id is not None:
+        return False
+    for part_kind, _ in record.parts:
+        if part_kind != PART_TEXT:
+            return False
+    return True
+
+
+def _text_record(texts: List[str]) -> ResponseEventRecord:
+    record = ResponseEventRecord(EVENT_CLIENT_ACTIONS)
+    record.parts.append((PART_TEXT, "".join(texts)))
+    return record
+
+
+async def coalesce_records(source: AsyncIterator[ResponseEventRecord], window_ms: float,
+                           max_bytes: int) -> AsyncIterator[ResponseEventRecord]:
+    """合并 source 中连续的纯文本事件；其余事件保持顺序原样产出"""
+    window = window_ms / 1000.0
+    texts: List[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+    deltas_in = chunks_out = total_bytes = 0
+    pending: Optional[asyncio.Future] = None
+
+    def flush() -> ResponseEventRecord:
+        nonlocal buffered_bytes, chunks_out
+        record = _text_record(texts)
+        texts.clear()
+        buffered_bytes = 0
+        chunks_out += 1
+        return record
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            if texts:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    yield flush()
+                    continue
+                done, _ = await asyncio.wait((pending,), timeout=timeout)
+                if not done:
+                    # 时间窗口到期：先输出已缓冲的文本，继续等待同一个事件
+                    yield flush()
+                    continue
+            else:
+                await asyncio.wait((pending,))
+
+            task, pending = pending, None
+            try:
+                record = task.result()
+            except StopAsyncIteration:
+                break
+            except BaseException:
+                if texts:
+                    yield flush()
+                raise
+
+            if _is_text_only(record):
+                if not texts:
+                    deadline = time.monotonic() + window
+                for _, text in record.parts:
+                    texts.append(text)
+                    size = len(text.encode("utf-8"))
+                    buffered_bytes += size
+                    total_bytes += size
+                    deltas_in += 1
+                if buffered_bytes >= max_bytes:
+                    yield flush()
+                continue
+
+            if texts:
+                yield flush()
+            yield record
+
+        if texts:
+            yield flush()
+    finally:
+        if pending is not None:
+            # 下游提前结束（如客户端断开）：取消正在等待的事件并关闭上游生成器
+            pending.cancel()
+            await asyncio.wait((pending,))
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+        COALESCE_STATS.streams += 1
+        COALESCE_STATS.deltas_in += deltas_in
+        COALESCE_STATS.chunks_out += chunks_out
+        COALESCE_STATS.bytes += total_bytes
+        logger.debug("[OpenAI Compat] 文本增量合并: %d 个增量 -> %d 个块", deltas_in, chunks_out)
@@ -0,0 +1,72 @@
+"""
+翻译路径内部使用的紧凑消息表示
+
+请求校验通过后，每条 ChatMessage 只转换一次：内容分段与拼接后的文本只规范化一次，工具调用 id 预先提取。
+合并、重排、用户提示改写、system 提取以及两种打包方式都读取这些字段，
+不再反复调用 normalize_content_to_list / segments_to_text，也不再创建或拷贝 pydantic 对象。
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .helpers import normalize_content_to_list, segments_to_text
+from .models import ChatMessage
+
+
+def _tool_call_ids(tool_calls: Optional[List[Dict[str, Any]]]) -> Tuple[str, ...]:
+    ids: List[str] = []
+    for tc in tool_calls or ():
+        _id = tc.get("id") if isinstance(tc, dict) else None
+        if isinstance(_id, str) and _id:
+            ids.append(_id)
+    return tuple(ids)
+
+
+class CompactMessage:
+    """
+    segments: 规范化后的内容分段；text: 其中文本段的拼接
+    tool_call_ids: tool_calls 中非空的字符串 id（按顺序）
+    实例视为不可变：需要改写内容时用 with_text() 生成新实例
+    """
+
+    __slots__ = ("role", "segments", "text", "tool_calls", "tool_call_ids", "tool_call_id", "name")
+
+    def __init__(self, role: str, segments: List[Dict[str, Any]],
+                 tool_calls: Optional[List[Dict[str, Any]]] = None,
+                 tool_call_id: Optional[str] = None, name: Optional[str] = None, text: Optional[str] = None):
+        self.role = role
+        self.segments = segments
+        self.text = segments_to_text(segments) if text is None else text
+        self.tool_calls = tool_calls
+        self.tool_call_ids = _tool_call_ids(tool_calls)
+        self.tool_call_id = tool_call_id
+        self.name = name
+
+    @classmethod
+    def from_content(cls, role: str, content: Any, tool_calls: Optional[List[Dict[str, Any]]] = None,
+                     tool_call_id: Optional[str] = None, name: Optional[str] = None) -> "CompactMessage":
+        """content 为 ChatMessage.content 的任一形式（字符串 / 分段列表 / None）"""
+        if isinstance(content, str):
+            return cls(role, [{"type": "text", "text": content}], tool_calls, tool_call_id, name, content)
+        return cls(role, normalize_content_to_list(content), tool_calls, tool_call_id, name)
+
+    @classmethod
+    def from_chat_message(cls, m: ChatMessage) -> "CompactMessage":
+        return cls.from_content(m.role, m.content, m.tool_calls, m.tool_call_id, m.name)
+
+    @classmethod
+    def from_text(cls, role: str, text: str) -> "CompactMessage":
+        return cls(role, [{"type": "text", "text": text}], text=text)
+
+    def with_text(self, text: str) -> "CompactMessage":
+        """内容替换为单个文本段，其余字段不变"""
+        return CompactMessage(self.role, [{"type": "text", "text": text}], self.tool_calls, self.tool_call_id, self.name,
+                              text)
+
+    def __repr__(self) -> str:
+        return (f"CompactMessage(role={self.role!r}, text={self.text[:40]!r}, "
+                f"tool_call_ids={self.tool_call_ids!r}, tool_call_id={self.tool_call_id!r})")
+
+
+def compact_messages(messages: Iterable[ChatMessage]) -> List[CompactMessage]:
+    return [CompactMessage.from_chat_message(m) for m in messages]
@@ -2,12 +2,44 @@ from __future__ import annotations
 
 import os
 
+# 运行模式: "http"（默认，经 HTTP 调用独立的 bridge 服务）或 "embedded"（进程内直接调用 warp2protobuf）
+BRIDGE_MODE = os.getenv("WARP_BRIDGE_MODE", "http").strip().lower()
+EMBEDDED_BRIDGE = BRIDGE_MODE == "embedded"
+# http 模式下 bridge 事件流格式: "sse"（JSON 文本）或 "frames"（长度前缀的原始 protobuf 帧）
+BRIDGE_STREAM_FORMAT = os.getenv("WARP_BRIDGE_STREAM_FORMAT", "sse").strip().lower()
+# embedded / frames 通道下直接构建 protobuf 请求字节（设为 0 则回退到 dict 数据包）
+PROTO_BUILDER_ENABLED = os.getenv("WARP_PROTO_BUILDER", "1").strip().lower() not in ("0", "false", "no")
+
+# /v1/chat/completions 请求体字节上限（0 表示不限制），以及快速摄取模式（orjson 解码、跳过 pydantic 消息模型）
+REQUEST_MAX_BYTES = int(os.getenv("WARP_REQUEST_MAX_BYTES", str(32 * 1024 * 1024)))
+FAST_INGEST_ENABLED = os.getenv("WARP_FAST_INGEST", "1").strip().lower() not in ("0", "false", "no")
+
+# 流式文本增量合并：时间窗口（毫秒，0 表示关闭）与字节阈值
+COALESCE_WINDOW_MS = float(os.getenv("WARP_COALESCE_WINDOW_MS", "0"))
+COALESCE_MAX_BYTES = int(os.getenv("WARP_COALESCE_MAX_BYTES", "1024"))
+
+# 响应缓存：过期秒数（0 表示关闭）与所有条目的字节总上限
+CACHE_TTL_S = float(os.getenv("WARP_CACHE_TTL", "5"))
+CACHE_MAX_BYTES = int(os.getenv("WARP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 历史消息增量编码缓存的字节上限（0 表示关闭，每次完整编码历史）
+HISTORY_ENCODE_CACHE_BYTES = int(os.getenv("WARP_HISTORY_ENCODE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# tools 编码结果（清洗后的 MCPContext 字节）的缓存条目数（0 表示关闭）
+BLOCK_CACHE_SIZE = int(os.getenv("WARP_BLOCK_CACHE_SIZE", "256"))
+# 相同请求的 single-flight 合并，以及晚到订阅者可回放的事件缓冲上限（个）
+SINGLE_FLIGHT_ENABLED = os.getenv("WARP_SINGLE_FLIGHT", "1").strip().lower() not in ("0", "false", "no")
+SINGLE_FLIGHT_BUFFER = int(os.getenv("WARP_SINGLE_FLIGHT_BUFFER", "4096"))
+
 BRIDGE_BASE_URL = os.getenv("WARP_BRIDGE_URL", "http://127.0.0.1:8000")
 FALLBACK_BRIDGE_URLS = [
     BRIDGE_BASE_URL,
     "http://127.0.0.1:8000",
 ]
 
+# 与 bridge 同机部署时可通过 Unix domain socket 通信（bridge 需以相同路径监听），此时 URL 中的主机端口被忽略
+BRIDGE_UDS = os.getenv("WARP_BRIDGE_UDS", "").strip() or None
+BRIDGE_MAX_CONNECTIONS = int(os.getenv("WARP_BRIDGE_MAX_CONNECTIONS", "400"))
+BRIDGE_MAX_KEEPALIVE = int(os.getenv("WARP_BRIDGE_MAX_KEEPALIVE", "200"))
+
 WARMUP_INIT_RETRIES = int(os.getenv("WARP_COMPAT_INIT_RETRIES", "10"))
 WARMUP_INIT_DELAY_S = float(os.getenv("WARP_COMPAT_INIT_DELAY", "0.5"))
 WARMUP_REQUEST_RETRIES = int(os.getenv("WARP_COMPAT_WARMUP_RETRIES", "3"))
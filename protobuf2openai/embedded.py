@@ -0,0 +1,46 @@
+"""
+进程内 bridge（WARP_BRIDGE_MODE=embedded）
+
+直接调用 warp2protobuf 的编码与上游客户端，省去 OpenAI 层与 bridge 服务之间的
+HTTP 往返以及每个事件的 JSON 序列化/反序列化。
+"""
+from __future__ import annotations
+
+from typing import Any, AsyncGenerator, Dict, Union
+
+from warp2protobuf.core.auth import refresh_jwt_if_needed
+from warp2protobuf.core.event_record import ResponseEventRecord
+from warp2protobuf.core.protobuf import ensure_proto_runtime
+from warp2protobuf.core.protobuf_utils import encode_request_packet
+from warp2protobuf.warp.api_client import stream_warp_event_records
+from warp2protobuf.warp.upstream import close_upstream_clients
+
+from .logging import logger
+
+
+def embedded_startup() -> None:
+    """预先编译 proto 描述符，避免首个请求承担该开销"""
+    ensure_proto_runtime()
+    logger.info("[OpenAI Compat] Embedded bridge ready (protobuf runtime loaded in-process)")
+
+
+async def embedded_shutdown() -> None:
+    await close_upstream_clients()
+
+
+def _to_request_bytes(packet: Union[Dict[str, Any], bytes]) -> bytes:
+    """dict 数据包按 bridge 路由的方式编码；proto_builder 产出的字节直接使用"""
+    if isinstance(packet, (bytes, bytearray)):
+        return bytes(packet)
+    return encode_request_packet(packet)
+
+
+async def embedded_event_stream(packet: Union[Dict[str, Any], bytes]) -> AsyncGenerator[ResponseEventRecord, None]:
+    """与 /api/warp/send_stream_frames 等价：逐个产出 ResponseEventRecord"""
+    protobuf_bytes = _to_request_bytes(packet)
+    async for record in stream_warp_event_records(protobuf_bytes):
+        yield record
+
+
+async def embedded_refresh_auth() -> bool:
+    return await refresh_jwt_if_needed()
@@ -0,0 +1,147 @@
+"""
+历史消息的增量 protobuf 编码缓存
+
+长对话每一轮只新增最后一两条消息。protobuf 的 repeated 字段可以由各元素的序列化字节直接拼接而成，
+因此按消息前缀的滚动哈希缓存每条消息编码出的 Task.messages 元素（不含 task_id），
+新请求只编码缓存之外的后缀，task_id（Message 字段 11）在拼接时追加到每个元素末尾：
+task_id 随响应变化时缓存仍然有效，且字段顺序与完整序列化一致。
+
+缓存的消息沿用首次编码时生成的消息 id（与逐条生成随机 uuid 同样合法）。
+"""
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .config import HISTORY_ENCODE_CACHE_BYTES
+from .metrics import HISTORY_ENCODE_MESSAGES
+from .compact import CompactMessage
+
+# Task.messages = 5，Message.task_id = 11（均为 length-delimited）
+_TASK_MESSAGES_FIELD = 5
+_MESSAGE_TASK_ID_FIELD = 11
+
+_EMPTY_PREFIX = b"\x00" * 16
+_MESSAGES_TAG = bytes([(_TASK_MESSAGES_FIELD << 3) | 2])
+
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def length_delimited(field_number: int, payload: bytes) -> bytes:
+    """字段 tag（wire type 2）+ 长度 + 负载"""
+    return varint((field_number << 3) | 2) + varint(len(payload)) + payload
+
+
+def prefix_key(previous: bytes, message: CompactMessage) -> bytes:
+    """滚动哈希：前缀摘要 + 当前消息的各字段（多分段内容取 repr，相同 JSON 输入得到相同结果）"""
+    segments = message.segments
+    material = "\x1f".join((
+        message.role,
+        message.text if len(segments) <= 1 else repr(segments),
+        message.tool_call_id or "",
+        message.name or "",
+        repr(message.tool_calls) if message.tool_calls else "",
+    ))
+    return hashlib.blake2b(previous + material.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class EncodedMessage:
+    """一条消息的编码结果：不含 task_id 的 Message 字节，以及最近一次 task_id 下的完整字段字节"""
+
+    __slots__ = ("bodies", "size", "framed")
+
+    def __init__(self, bodies: Tuple[bytes, ...]):
+        self.bodies = bodies
+        self.size = sum(len(b) for b in bodies)
+        self.framed: Optional[Tuple[str, bytes]] = None
+
+    def frame(self, task_id: str, task_suffix: bytes) -> bytes:
+        framed = self.framed
+        if framed is not None and framed[0] == task_id:
+            return framed[1]
+        data = b"".join(_MESSAGES_TAG + varint(len(body) + len(task_suffix)) + body + task_suffix
+                        for body in self.bodies)
+        self.framed = (task_id, data)
+        return data
+
+
+class HistoryEncodeCache:
+    """前缀哈希 -> EncodedMessage；按字节总数（Message 字节的两倍，含拼接好的副本）做 LRU 淘汰"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, EncodedMessage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[EncodedMessage]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: bytes, entry: EncodedMessage) -> None:
+        size = 2 * entry.size + len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= 2 * old.size + len(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                k, v = self._entries.popitem(last=False)
+                self._bytes -= 2 * v.size + len(k)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+HISTORY_ENCODE_CACHE = HistoryEncodeCache(HISTORY_ENCODE_CACHE_BYTES)
+
+
+def encode_history_messages(history: Sequence[CompactMessage], task_id: str,
+                            encode_message: Callable[[CompactMessage], List[bytes]],
+                            cache: HistoryEncodeCache = HISTORY_ENCODE_CACHE) -> bytes:
+    """
+    返回 history 对应的 Task.messages 字段字节（可直接拼接到序列化的 Task 之后）。
+    encode_message(m) 返回 m 对应的 Message 序列化字节列表（不设置 task_id）。
+    """
+    task_suffix = length_delimited(_MESSAGE_TASK_ID_FIELD, task_id.encode("utf-8")) if task_id else b""
+    out: List[bytes] = []
+    key = _EMPTY_PREFIX
+    reused = 0
+    for m in history:
+        key = prefix_key(key, m)
+        entry = cache.get(key)
+        if entry is None:
+            entry = EncodedMessage(tuple(encode_message(m)))
+            cache.put(key, entry)
+        else:
+            reused += 1
+        out.append(entry.frame(task_id, task_suffix))
+    if reused:
+        HISTORY_ENCODE_MESSAGES.labels(result="reused").inc(reused)
+    if len(history) > reused:
+        HISTORY_ENCODE_MESSAGES.labels(result="encoded").inc(len(history) - reused)
+    return b"".join(out)
@@ -10,6 +10,18 @@ def _get(d: Dict[str, Any], *names: str) -> Any:
     return None
 
 
+def model_json(model: Any) -> str:
+    """pydantic v2 / v1 兼容的 JSON 序列化"""
+    dump = getattr(model, "model_dump_json", None) or model.json
+    return dump()
+
+
+def model_parse(cls: Any, data: Any) -> Any:
+    """pydantic v2 / v1 兼容的 dict 校验"""
+    validate = getattr(cls, "model_validate", None) or cls.parse_obj
+    return validate(data)
+
+
 def normalize_content_to_list(content: Any) -> List[Dict[str, Any]]:
     segments: List[Dict[str, Any]] = []
     try:
@@ -0,0 +1,163 @@
+"""
+/v1/chat/completions 请求体摄取
+
+- 大小上限：先看 Content-Length，再边读边计数，超过 WARP_REQUEST_MAX_BYTES 即返回 413，超大请求体不会被整体读入内存
+- 快速模式（WARP_FAST_INGEST=1，默认）：orjson（已安装时，否则标准库 json）解码原始字节，消息逐条做类型检查后
+  直接构造 CompactMessage，不经过 pydantic 的 ChatMessage；缓存 / single-flight 键取原始字节的摘要，
+  不再把请求重新序列化一次。类型不符合预期的请求交给 pydantic 完整校验（宽松转换与错误信息与原来一致）
+- 兼容模式（WARP_FAST_INGEST=0）：pydantic 校验整个 ChatCompletionsRequest，键为规范化 JSON 的摘要
+校验失败时与 FastAPI 自动校验一样返回 422。
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from .cache import body_cache_key, request_cache_key
+from .compact import CompactMessage, compact_messages
+from .config import FAST_INGEST_ENABLED, REQUEST_MAX_BYTES
+from .helpers import model_parse
+from .logging import logger
+from .models import ChatCompletionsRequest, OpenAITool
+
+try:
+    import orjson
+except ImportError:  # requirements.txt 已包含 orjson；缺失时回退到标准库 json（启动时记录一次）
+    orjson = None
+
+
+def log_json_backend() -> None:
+    """启动时调用一次：快速摄取模式下没有 orjson 时给出提示，避免静默地走较慢的标准库 json"""
+    if FAST_INGEST_ENABLED and orjson is None:
+        logger.warning("[OpenAI Compat] orjson 未安装，快速摄取回退到标准库 json 解码（pip install orjson）")
+
+
+class IngestedRequest:
+    """路由使用的请求视图：消息已是 CompactMessage；key 在需要时才计算"""
+
+    __slots__ = ("model", "messages", "stream", "tools", "tool_choice", "size", "_body", "_parsed", "_key")
+
+    def __init__(self, model: Optional[str], messages: List[CompactMessage], stream: Optional[bool],
+                 tools: Optional[List[OpenAITool]], tool_choice: Any, size: int,
+                 body: Optional[bytes] = None, parsed: Optional[ChatCompletionsRequest] = None):
+        self.model = model
+        self.messages = messages
+        self.stream = stream
+        self.tools = tools
+        self.tool_choice = tool_choice
+        self.size = size
+        self._body = body
+        self._parsed = parsed
+        self._key: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """响应缓存与 single-flight 共用的请求摘要"""
+        if self._key is None:
+            self._key = body_cache_key(self._body) if self._body is not None else request_cache_key(self._parsed)
+        return self._key
+
+
+async def read_request_body(request: Request, max_bytes: int = REQUEST_MAX_BYTES) -> bytes:
+    """读取请求体；超过 max_bytes（0 表示不限制）时返回 413"""
+    if max_bytes > 0:
+        try:
+            declared = int(request.headers.get("content-length") or 0)
+        except ValueError:
+            declared = 0
+        if declared > max_bytes:
+            raise HTTPException(413, f"请求体过大: {declared} 字节，上限 {max_bytes} 字节")
+
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if 0 < max_bytes < size:
+            raise HTTPException(413, f"请求体过大: 超过上限 {max_bytes} 字节")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _loads(body: bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            pass  # 超过 64 位的整数、NaN 等 orjson 不接受的输入交给标准库处理
+    return json.loads(body)
+
+
+def parse_chat_request(body: bytes, fast: bool = FAST_INGEST_ENABLED) -> IngestedRequest:
+    try:
+        data = _loads(body) if fast else json.loads(body)
+    except ValueError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body", 0), "msg": "JSON decode error",
+                                       "input": {}, "ctx": {"error": str(e)}}])
+    if fast:
+        ingested = _parse_fast(data, body)
+        if ingested is not None:
+            return ingested
+    try:
+        req = model_parse(ChatCompletionsRequest, data)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body",) + tuple(err["loc"])} for err in e.errors()])
+    return IngestedRequest(req.model, compact_messages(req.messages), req.stream, req.tools, req.tool_choice,
+                           len(body), body=body if fast else None, parsed=req)
+
+
+def _optional_str(value: Any) -> bool:
+    return value is None or isinstance(value, str)
+
+
+def _dict_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+
+def _compact_message(item: Any) -> Optional[CompactMessage]:
+    """类型完全符合 ChatMessage 时直接构造 CompactMessage，否则返回 None"""
+    if not isinstance(item, dict):
+        return None
+    role = item.get("role")
+    content = item.get("content", "")
+    tool_calls = item.get("tool_calls")
+    tool_call_id = item.get("tool_call_id")
+    name = item.get("name")
+    if not isinstance(role, str) or not (_optional_str(content) or _dict_list(content)):
+        return None
+    if not (tool_calls is None or _dict_list(tool_calls)) or not _optional_str(tool_call_id) or not _optional_str(name):
+        return None
+    return CompactMessage.from_content(role, content, tool_calls, tool_call_id, name)
+
+
+def _parse_fast(data: Any, body: bytes) -> Optional[IngestedRequest]:
+    """常见的类型规整请求走这里；返回 None 表示需要 pydantic 完整校验"""
+    if not isinstance(data, dict):
+        return None
+    raw_messages = data.get("messages")
+    model = data.get("model")
+    stream = data.get("stream", False)
+    raw_tools = data.get("tools")
+    if not isinstance(raw_messages, list) or not _optional_str(model) or not (stream is None or isinstance(stream, bool)):
+        return None
+    if not (raw_tools is None or isinstance(raw_tools, list)):
+        return None
+
+    messages: List[CompactMessage] = []
+    for item in raw_messages:
+        m = _compact_message(item)
+        if m is None:
+            return None
+        messages.append(m)
+
+    tools: Optional[List[OpenAITool]] = None
+    if raw_tools is not None:
+        try:
+            tools = [model_parse(OpenAITool, t) for t in raw_tools]
+        except ValidationError:
+            return None
+    return IngestedRequest(model, messages, stream, tools, data.get("tool_choice"), len(body), body=body)
+
@@ -1,32 +1,51 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Local logging for protobuf2openai package to avoid cross-package dependencies.
+Logging for the protobuf2openai package (its own logger and log file).
+
+Level and payload limits come from warp2protobuf.config.settings; payload() is
+shared with the bridge logger (warp2protobuf.core.log_payload).
+
+Records go through a QueueHandler to a QueueListener thread, so file and console
+writes never block the event loop. Each line carries the current request id
+(see warp2protobuf.core.tracing).
 """
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+from warp2protobuf.config.settings import LOG_LEVEL
+from warp2protobuf.core.log_payload import LazyPayload, payload  # noqa: F401
+from warp2protobuf.core.tracing import RequestIdFilter
+
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
 _logger = logging.getLogger("protobuf2openai")
-_logger.setLevel(logging.INFO)
+_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 
 # Remove existing handlers to prevent duplication
 for h in _logger.handlers[:]:
     _logger.removeHandler(h)
 
 file_handler = RotatingFileHandler(LOG_DIR / "openai_compat.log", maxBytes=5*1024*1024, backupCount=3, encoding="utf-8")
-file_handler.setLevel(logging.INFO)
+file_handler.setLevel(logging.DEBUG)
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 
-fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
+fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(funcName)s:%(lineno)d - %(message)s')
 file_handler.setFormatter(fmt)
 console_handler.setFormatter(fmt)
 
-_logger.addHandler(file_handler)
-_logger.addHandler(console_handler)
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener = QueueListener(_queue, file_handler, console_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+_queue_handler = QueueHandler(_queue)
+_queue_handler.addFilter(RequestIdFilter())
+_logger.addHandler(_queue_handler)
 
-logger = _logger 
\ No newline at end of file
+logger = _logger
@@ -0,0 +1,40 @@
+"""
+OpenAI 兼容层指标（注册到 warp2protobuf.core.metrics.REGISTRY，由 /metrics 输出）
+"""
+from __future__ import annotations
+
+from warp2protobuf.core.metrics import FAST_BUCKETS, RATE_BUCKETS, SIZE_BUCKETS, counter, gauge, histogram
+
+REQUESTS = counter(
+    "openai_requests_total", "Chat completion requests", ("model", "stream"))
+INFLIGHT = gauge(
+    "openai_inflight_requests", "Chat completion requests in flight", ("model",))
+REQUEST_BYTES = histogram(
+    "openai_request_bytes", "Chat completion request body size", ("model",), SIZE_BUCKETS)
+RESPONSE_BYTES = histogram(
+    "openai_response_bytes", "Chat completion response size (SSE bytes for streams)", ("model",), SIZE_BUCKETS)
+TIME_TO_FIRST_DELTA_SECONDS = histogram(
+    "openai_time_to_first_delta_seconds", "Time from stream start to the first text or tool call delta", ("model",))
+CHARS_PER_SECOND = histogram(
+    "openai_stream_chars_per_second", "Streamed text characters per second after the first delta", ("model",),
+    RATE_BUCKETS)
+STREAM_RETRIES = counter(
+    "openai_stream_retries_total", "Stream retries in the OpenAI layer by cause", ("cause",))
+EVENT_DECODE_SECONDS = histogram(
+    "openai_event_decode_seconds", "Time to decode one bridge event in the OpenAI layer", ("format",),
+    FAST_BUCKETS)
+CACHE_REQUESTS = counter(
+    "openai_cache_requests_total", "Response cache lookups by result (hit, miss, refresh, bypass)", ("result",))
+CACHE_ENTRIES = gauge(
+    "openai_cache_entries", "Entries in the response cache")
+CACHE_BYTES = gauge(
+    "openai_cache_bytes", "Total size of cached responses in bytes")
+SINGLE_FLIGHT = counter(
+    "openai_single_flight_total",
+    "Requests that started (leader) or joined (follower) a shared upstream call, or were detached for lagging",
+    ("kind", "role"))
+HISTORY_ENCODE_MESSAGES = counter(
+    "openai_history_encode_messages_total", "History messages reused from the encode cache or freshly encoded",
+    ("result",))
+BLOCK_CACHE = counter(
+    "openai_block_cache_requests_total", "Encoded request block cache lookups", ("block", "result"))
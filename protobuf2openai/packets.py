@@ -5,8 +5,9 @@ from typing import Any, Dict, List, Optional
 import json
 
 from .state import STATE, ensure_tool_ids
-from .helpers import normalize_content_to_list, segments_to_text, segments_to_warp_results
-from .models import ChatMessage
+from .compact import CompactMessage
+from .helpers import segments_to_warp_results
+from .models import OpenAITool
 
 
 def packet_template() -> Dict[str, Any]:
@@ -36,7 +37,17 @@ def packet_template() -> Dict[str, Any]:
     }
 
 
-def map_history_to_warp_messages(history: List[ChatMessage], task_id: str,
+def system_prompt_attachment_text(system_prompt_text: str) -> str:
+    return f"""<ALERT>you are not allowed to call following tools:  - `read_files`
+- `write_files`
+- `run_commands`
+- `list_files`
+- `str_replace_editor`
+- `ask_followup_question`
+- `attempt_completion`</ALERT>{system_prompt_text}"""
+
+
+def map_history_to_warp_messages(history: List[CompactMessage], task_id: str,
                                  system_prompt_for_last_user: Optional[str] = None,
                                  attach_to_history_last_user: bool = False) -> List[Dict[str, Any]]:
     ensure_tool_ids()
@@ -56,10 +67,10 @@ def map_history_to_warp_messages(history: List[ChatMessage], task_id: str,
     for m in history:
         mid = str(uuid.uuid4())
         if m.role == "user":
-            user_query_obj: Dict[str, Any] = {"query": segments_to_text(normalize_content_to_list(m.content))}
+            user_query_obj: Dict[str, Any] = {"query": m.text}
             msgs.append({"id": mid, "task_id": task_id, "user_query": user_query_obj})
         elif m.role == "assistant":
-            _assistant_text = segments_to_text(normalize_content_to_list(m.content))
+            _assistant_text = m.text
             if _assistant_text:
                 msgs.append({"id": mid, "task_id": task_id, "agent_output": {"text": _assistant_text}})
             for tc in (m.tool_calls or []):
@@ -85,7 +96,7 @@ def map_history_to_warp_messages(history: List[ChatMessage], task_id: str,
                         "tool_call_id": m.tool_call_id,
                         "call_mcp_tool": {
                             "success": {
-                                "results": segments_to_warp_results(normalize_content_to_list(m.content))
+                                "results": segments_to_warp_results(m.segments)
                             }
                         },
                     },
@@ -93,7 +104,7 @@ def map_history_to_warp_messages(history: List[ChatMessage], task_id: str,
     return msgs
 
 
-def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMessage],
+def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[CompactMessage],
                                     system_prompt_text: Optional[str]) -> None:
     if not history:
         packet["input"]["user_inputs"]["inputs"].append({"user_query": {"query": ""}})
@@ -102,17 +113,11 @@ def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMe
     last = history[-1]
 
     if last.role == "user":
-        user_query_payload: Dict[str, Any] = {"query": segments_to_text(normalize_content_to_list(last.content))}
+        user_query_payload: Dict[str, Any] = {"query": last.text}
         if system_prompt_text:
             user_query_payload["referenced_attachments"] = {
                 "SYSTEM_PROMPT": {
-                    "plain_text": f"""<ALERT>you are not allowed to call following tools:  - `read_files`
-- `write_files`
-- `run_commands`
-- `list_files`
-- `str_replace_editor`
-- `ask_followup_question`
-- `attempt_completion`</ALERT>{system_prompt_text}"""
+                    "plain_text": system_prompt_attachment_text(system_prompt_text)
                 }
             }
         packet["input"]["user_inputs"]["inputs"].append({"user_query": user_query_payload})
@@ -123,7 +128,7 @@ def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMe
             "tool_call_result": {
                 "tool_call_id": last.tool_call_id,
                 "call_mcp_tool": {
-                    "success": {"results": segments_to_warp_results(normalize_content_to_list(last.content))}
+                    "success": {"results": segments_to_warp_results(last.segments)}
                 },
             }
         })
@@ -133,18 +138,11 @@ def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMe
     # Find the most recent user message to use as the input context.
     for i in range(len(history) - 1, -1, -1):
         if history[i].role == "user":
-            user_query_payload: Dict[str, Any] = {
-                "query": segments_to_text(normalize_content_to_list(history[i].content))}
+            user_query_payload: Dict[str, Any] = {"query": history[i].text}
             if system_prompt_text:
                 user_query_payload["referenced_attachments"] = {
                     "SYSTEM_PROMPT": {
-                        "plain_text": f"""<ALERT>you are not allowed to call following tools:  - `read_files`
-- `write_files`
-- `run_commands`
-- `list_files`
-- `str_replace_editor`
-- `ask_followup_question`
-- `attempt_completion`</ALERT>{system_prompt_text}"""
+                        "plain_text": system_prompt_attachment_text(system_prompt_text)
                     }
                 }
             packet["input"]["user_inputs"]["inputs"].append({"user_query": user_query_payload})
@@ -155,13 +153,52 @@ def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMe
     if system_prompt_text:
         user_query_payload["referenced_attachments"] = {
             "SYSTEM_PROMPT": {
-                "plain_text": f"""<ALERT>you are not allowed to call following tools:  - `read_files`
-- `write_files`
-- `run_commands`
-- `list_files`
-- `str_replace_editor`
-- `ask_followup_question`
-- `attempt_completion`</ALERT>{system_prompt_text}"""
+                "plain_text": system_prompt_attachment_text(system_prompt_text)
             }
         }
     packet["input"]["user_inputs"]["inputs"].append({"user_query": user_query_payload})
+
+
+def build_request_packet(history: List[CompactMessage], task_id: str, model: Optional[str],
+                         conversation_id: Optional[str], system_prompt_text: Optional[str],
+                         tools: Optional[List[OpenAITool]]) -> Dict[str, Any]:
+    """构建 warp.multi_agent.v1.Request 的 dict 形式数据包（经 bridge 编码为 protobuf）"""
+    packet = packet_template()
+
+    # *** FIX: Explicitly separate history from the last message (the new input) ***
+    history_for_context = history[:-1] if history else []
+
+    packet["task_context"] = {
+        "tasks": [{
+            "id": task_id,
+            "description": "",
+            "status": {"in_progress": {}},
+            "messages": map_history_to_warp_messages(history_for_context, task_id, None, False),
+        }],
+        "active_task_id": task_id,
+    }
+
+    packet.setdefault("settings", {}).setdefault("model_config", {})
+    packet["settings"]["model_config"]["base"] = model or packet["settings"]["model_config"].get(
+        "base") or "claude-4.1-opus"
+
+    if conversation_id:
+        packet.setdefault("metadata", {})["conversation_id"] = conversation_id
+
+    # annd_tools_to_inputs needs the *full* history to correctly identify the last message.
+    attach_user_and_tools_to_inputs(packet, history, system_prompt_text)
+
+    if tools:
+        mcp_tools: List[Dict[str, Any]] = []
+        for t in tools:
+            if t.type != "function" or not t.function:
+                continue
+            mcp_tools.append({
+                "name": t.function.name,
+                "description": t.function.description or "",
+                "input_schema": t.function.parameters or {},
+            })
+        if mcp_tools:
+            packet.setdefault("mcp_context", {}).setdefault("tools", []).extend(mcp_tools)
+
+    return packet
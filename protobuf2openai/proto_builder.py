@@ -0,0 +1,266 @@
+"""
+直接构建 warp.multi_agent.v1.Request protobuf 消息
+
+与 packets.build_request_packet + bridge 端 encode_request_packet 的结果等价，但不经过中间 dict，
+也不做逐键的反射填充。与 dict 路径一样：字符串会去除首尾空白，空值（空串/空列表/空对象）不写入，
+因此空的子消息不会出现在线上字节中。
+"""
+from __future__ import annotations
+
+import json
+import uuid
+from typing import Any, Dict, List, Optional
+
+from warp2protobuf.core.metrics import ENCODE_SECONDS
+from warp2protobuf.core.protobuf import ensure_proto_runtime, msg_cls
+from warp2protobuf.core.protobuf_utils import _fill_google_struct_dynamic
+from warp2protobuf.core.schema_sanitizer import _deep_clean, sanitize_mcp_input_schema_in_packet
+from warp2protobuf.core.tracing import span
+
+from .block_cache import MCP_CONTEXT_CACHE, tools_key
+from .encode_cache import HISTORY_ENCODE_CACHE, encode_history_messages, length_delimited
+from .compact import CompactMessage
+from .models import OpenAITool
+from .packets import system_prompt_attachment_text
+from .state import STATE, ensure_tool_ids
+
+_SERVER_PREAMBLE_PAYLOAD = "IgIQAQ=="
+_SUPPORTED_TOOLS = (9,)
+_TASK = "warp.multi_agent.v1.Task"
+# Request.task_context = 1；TaskContext.tasks = 1，TaskContext.active_task_id = 2
+_REQUEST_TASK_CONTEXT_FIELD = 1
+_TASK_CONTEXT_TASKS_FIELD = 1
+_TASK_CONTEXT_ACTIVE_TASK_FIELD = 2
+_REQUEST_MCP_CONTEXT_FIELD = 6
+
+
+def _clean_str(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+def _result_texts(m: CompactMessage) -> List[str]:
+    """CallMCPToolResult.Success.results 的文本段（去空白后非空）"""
+    texts: List[str] = []
+    for seg in m.segments:
+        if seg.get("type") == "text" and isinstance(seg.get("text"), str):
+            text = seg["text"].strip()
+            if text:
+                texts.append(text)
+    return texts
+
+
+def _set_tool_call_result(result_msg: Any, call_id: str, texts: List[str]) -> None:
+    if call_id:
+        result_msg.tool_call_id = call_id
+    results = result_msg.call_mcp_tool.success.results
+    for text in texts:
+        results.add().text.text = text
+
+
+def _set_user_query(uq: Any, text: str, system_prompt_text: Optional[str]) -> None:
+    if text:
+        uq.query = text
+    if system_prompt_text:
+        plain = system_prompt_attachment_text(system_prompt_text).strip()
+        if plain:
+            uq.referenced_attachments["SYSTEM_PROMPT"].plain_text = plain
+
+
+def _tool_call_args(tc: Dict[str, Any]) -> Any:
+    fn = tc.get("function", {}) or {}
+    raw = fn.get("arguments", "{}")
+    return (json.loads(raw) if isinstance(fn.get("arguments"), str) else fn.get("arguments", {})) or {}
+
+
+def _add_preamble(task: Any, task_id: str) -> None:
+    """服务端 tool_call 前导消息（history 的第一条）"""
+    ensure_tool_ids()
+    msg = task.messages.add()
+    msg.id = (STATE.tool_message_id or str(uuid.uuid4())).strip()
+    if task_id:
+        msg.task_id = task_id
+    tool_call_id = (STATE.tool_call_id or str(uuid.uuid4())).strip()
+    if tool_call_id:
+        msg.tool_call.tool_call_id = tool_call_id
+    msg.tool_call.server.payload = _SERVER_PREAMBLE_PAYLOAD
+
+
+def _add_message(task: Any, m: CompactMessage, task_id: str) -> None:
+    """单条 CompactMessage 对应的 Message（assistant 的工具调用各占一条）"""
+    mid = str(uuid.uuid4())
+    if m.role == "user":
+        msg = task.messages.add()
+        msg.id = mid
+        if task_id:
+            msg.task_id = task_id
+        text = m.text.strip()
+        if text:
+            msg.user_query.query = text
+    elif m.role == "assistant":
+        # 与 dict 路径一致：是否生成消息看原始文本，只有空白时仍保留一条只有 id 的消息
+        if m.text:
+            msg = task.messages.add()
+            msg.id = mid
+            if task_id:
+                msg.task_id = task_id
+            text = m.text.strip()
+            if text:
+                msg.agent_output.text = text
+        for tc in (m.tool_calls or []):
+            msg = task.messages.add()
+            msg.id = str(uuid.uuid4())
+            if task_id:
+                msg.task_id = task_id
+            call_id = _clean_str(tc.get("id") or str(uuid.uuid4()))
+            if call_id:
+                msg.tool_call.tool_call_id = call_id
+            name = _clean_str((tc.get("function", {}) or {}).get("name", ""))
+            if name:
+                msg.tool_call.call_mcp_tool.name = name
+            args = _deep_clean(_tool_call_args(tc))
+            if isinstance(args, dict) and args:
+                _fill_google_struct_dynamic(msg.tool_call.call_mcp_tool.args, args)
+    elif m.role == "tool":
+        if m.tool_call_id:
+            msg = task.messages.add()
+            msg.id = str(uuid.uuid4())
+            if task_id:
+                msg.task_id = task_id
+            call_id = _clean_str(m.tool_call_id)
+            texts = _result_texts(m)
+            if call_id or texts:
+                _set_tool_call_result(msg.tool_call_result, call_id, texts)
+
+
+def _add_history_messages(task: Any, history: List[CompactMessage], task_id: str) -> None:
+    """等价于 packets.map_history_to_warp_messages（uuid 的生成顺序也保持一致）"""
+    task_id = task_id.strip()
+    _add_preamble(task, task_id)
+    for m in history:
+        _add_message(task, m, task_id)
+
+
+def _encode_message(m: CompactMessage) -> List[bytes]:
+    """单条 CompactMessage 编码出的 Message 字节（不含 task_id，供 encode_cache 拼接）"""
+    task = msg_cls(_TASK)()
+    _add_message(task, m, "")
+    return [msg.SerializeToString() for msg in task.messages]
+
+
+def _set_input(request: Any, history: List[CompactMessage], system_prompt_text: Optional[str]) -> None:
+    """等价于 packets.attach_user_and_tools_to_inputs"""
+    user_inputs = request.input.user_inputs
+    if not history:
+        return  # {"user_query": {"query": ""}} 清洗后为空，不写入
+
+    last = history[-1]
+    source: Optional[CompactMessage] = None
+    if last.role == "user":
+        source = last
+    elif last.role == "tool" and last.tool_call_id:
+        call_id = _clean_str(last.tool_call_id)
+        texts = _result_texts(last)
+        if call_id or texts:
+            _set_tool_call_result(user_inputs.inputs.add().tool_call_result, call_id, texts)
+        return
+    else:
+        for i in range(len(history) - 1, -1, -1):
+            if history[i].role == "user":
+                source = history[i]
+                break
+
+    text = source.text.strip() if source is not None else ""
+    if text or system_prompt_text:
+        _set_user_query(user_inputs.inputs.add().user_query, text, system_prompt_text)
+
+
+def _set_tools(request: Any, tools: Optional[List[OpenAITool]]) -> None:
+    mcp_tools: List[Dict[str, Any]] = []
+    for t in tools or []:
+        if t.type != "function" or not t.function:
+            continue
+        mcp_tools.append({
+            "name": t.function.name,
+            "description": t.function.description or "",
+            "input_schema": t.function.parameters or {},
+        })
+    if not mcp_tools:
+        return
+    with span("sanitize"):
+        cleaned = sanitize_mcp_input_schema_in_packet({"mcp_context": {"tools": mcp_tools}})
+    for tool in (cleaned.get("mcp_context") or {}).get("tools") or []:
+        if not isinstance(tool, dict):
+            continue
+        pb_tool = request.mcp_context.tools.add()
+        if tool.get("name"):
+            pb_tool.name = tool["name"]
+        if tool.get("description"):
+            pb_tool.description = tool["description"]
+        schema = tool.get("input_schema") or tool.get("inputSchema")
+        if isinstance(schema, dict) and schema:
+            _fill_google_struct_dynamic(pb_tool.input_schema, schema)
+
+
+def _mcp_context_bytes(tools: List[OpenAITool]) -> bytes:
+    """清洗并编码后的 MCPContext 字节（没有可用工具时为 b""）"""
+    request = msg_cls("warp.multi_agent.v1.Request")()
+    _set_tools(request, tools)
+    return request.mcp_context.SerializeToString() if request.HasField("mcp_context") else b""
+
+
+def build_request_bytes(history: List[CompactMessage], task_id: str, model: Optional[str],
+                        conversation_id: Optional[str], system_prompt_text: Optional[str],
+                        tools: Optional[List[OpenAITool]]) -> bytes:
+    """构建 Request 并序列化为 protobuf 字节，参数与 packets.build_request_packet 相同"""
+    with ENCODE_SECONDS.labels(path="builder").time(), span("encode", path="builder"):
+        return _build_request_bytes(history, task_id, model, conversation_id, system_prompt_text, tools)
+
+
+def _build_request_bytes(history: List[CompactMessage], task_id: str, model: Optional[str],
+                         conversation_id: Optional[str], system_prompt_text: Optional[str],
+                         tools: Optional[List[OpenAITool]]) -> bytes:
+    ensure_proto_runtime()
+    request = msg_cls("warp.multi_agent.v1.Request")()
+    tid = task_id.strip()
+
+    if not HISTORY_ENCODE_CACHE.enabled:
+        task = request.task_context.tasks.add()
+        task.id = tid
+        _add_history_messages(task, history[:-1] if history else [], task_id)
+        request.task_context.active_task_id = tid
+
+    _set_input(request, history, system_prompt_text)
+
+    settings = request.settings
+    model_base = _clean_str(model or "claude-4.1-opus")
+    if model_base:
+        settings.model_config.base = model_base
+    settings.model_config.planning = "gpt-5 (high reasoning)"
+    settings.model_config.coding = "auto"
+    settings.supported_tools.extend(_SUPPORTED_TOOLS)
+
+    conversation_id = _clean_str(conversation_id)
+    if conversation_id:
+        request.metadata.conversation_id = conversation_id
+    request.metadata.logging["is_autodetected_user_query"].bool_value = True
+    request.metadata.logging["entrypoint"].string_value = "USER_INITIATED"
+
+    # mcp_context（字段 6，Request 的最后一个字段）按 tools 内容缓存，直接接在序列化结果末尾
+    mcp_context = MCP_CONTEXT_CACHE.get_or_build(tools_key(tools), lambda: _mcp_context_bytes(tools)) if tools else b""
+    if mcp_context:
+        mcp_context = length_delimited(_REQUEST_MCP_CONTEXT_FIELD, mcp_context)
+
+    if not HISTORY_ENCODE_CACHE.enabled:
+        return request.SerializeToString() + mcp_context
+
+    # task_context（字段 1）手工拼接：Task 头部与前导消息每次编码，历史消息取自增量缓存；
+    # 其余字段照常序列化后接在后面，字段顺序与完整序列化一致
+    task = msg_cls(_TASK)()
+    task.id = tid
+    _add_preamble(task, tid)
+    task_bytes = task.SerializeToString() + encode_history_messages(
+        history[:-1] if history else [], tid, _encode_message)
+    task_context = length_delimited(_TASK_CONTEXT_TASKS_FIELD, task_bytes)
+    if tid:
+        task_context += length_delimited(_TASK_CONTEXT_ACTIVE_TASK_FIELD, tid.encode("utf-8"))
+    return length_delimited(_REQUEST_TASK_CONTEXT_FIELD, task_context) + request.SerializeToString() + mcp_context
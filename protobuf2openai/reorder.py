@@ -1,32 +1,26 @@
 from __future__ import annotations
 
 from typing import Dict, List, Optional
-from .models import ChatMessage
-from .helpers import normalize_content_to_list, segments_to_text
+from .compact import CompactMessage
 
 
-def reorder_messages_for_anthropic(history: List[ChatMessage]) -> List[ChatMessage]:
+def reorder_messages_for_anthropic(history: List[CompactMessage]) -> List[CompactMessage]:
     if not history:
         return []
 
-    expanded: List[ChatMessage] = []
+    expanded: List[CompactMessage] = []
     for m in history:
         if m.role == "user":
-            items = normalize_content_to_list(m.content)
-            if isinstance(m.content, list) and len(items) > 1:
-                for seg in items:
-                    if isinstance(seg, dict) and seg.get("type") == "text" and isinstance(seg.get("text"), str):
-                        expanded.append(ChatMessage(role="user", content=seg.get("text")))
-                    else:
-                        expanded.append(ChatMessage(role="user", content=[seg] if isinstance(seg, dict) else seg))
+            if len(m.segments) > 1:
+                for seg in m.segments:
+                    expanded.append(CompactMessage("user", [seg]))
             else:
                 expanded.append(m)
         elif m.role == "assistant" and m.tool_calls and len(m.tool_calls) > 1:
-            _assistant_text = segments_to_text(normalize_content_to_list(m.content))
-            if _assistant_text:
-                expanded.append(ChatMessage(role="assistant", content=_assistant_text))
+            if m.text:
+                expanded.append(CompactMessage.from_text("assistant", m.text))
             for tc in (m.tool_calls or []):
-                expanded.append(ChatMessage(role="assistant", content=None, tool_calls=[tc]))
+                expanded.append(CompactMessage("assistant", [], tool_calls=[tc]))
         else:
             expanded.append(m)
 
@@ -40,22 +34,16 @@ def reorder_messages_for_anthropic(history: List[ChatMessage]) -> List[ChatMessa
         if m.role == "user":
             break
 
-    tool_results_by_id: Dict[str, ChatMessage] = {}
+    tool_results_by_id: Dict[str, CompactMessage] = {}
     assistant_tc_ids: set[str] = set()
     for m in expanded:
         if m.role == "tool" and m.tool_call_id and m.tool_call_id not in tool_results_by_id:
             tool_results_by_id[m.tool_call_id] = m
         if m.role == "assistant" and m.tool_calls:
-            try:
-                for tc in (m.tool_calls or []):
-                    _id = (tc or {}).get("id")
-                    if isinstance(_id, str) and _id:
-                        assistant_tc_ids.add(_id)
-            except Exception:
-                pass
+            assistant_tc_ids.update(m.tool_call_ids)
 
-    result: List[ChatMessage] = []
-    trailing_assistant_msg: Optional[ChatMessage] = None
+    result: List[CompactMessage] = []
+    trailing_assistant_msg: Optional[CompactMessage] = None
     for m in expanded:
         if m.role == "tool":
             # Preserve unmatched tool results inline
@@ -65,14 +53,7 @@ def reorder_messages_for_anthropic(history: List[ChatMessage]) -> List[ChatMessa
                     tool_results_by_id.pop(m.tool_call_id, None)
             continue
         if m.role == "assistant" and m.tool_calls:
-            ids: List[str] = []
-            try:
-                for tc in (m.tool_calls or []):
-                    _id = (tc or {}).get("id")
-                    if isinstance(_id, str) and _id:
-                        ids.append(_id)
-            except Exception:
-                pass
+            ids = m.tool_call_ids
 
             if last_input_is_tool and last_input_tool_id and (last_input_tool_id in ids):
                 if trailing_assistant_msg is None:
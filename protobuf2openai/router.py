@@ -1,54 +1,54 @@
 from __future__ import annotations
 
-import hashlib
 import json
 import time
 import uuid
-from collections import OrderedDict
-from threading import Lock
-from typing import Any, Dict, List, Optional
+from typing import List, Optional
 
-import httpx
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 
-from .bridge import initialize_once, bridge_send_stream
-from .config import BRIDGE_BASE_URL
-from .helpers import normalize_content_to_list, segments_to_text
+from warp2protobuf.core.tracing import REQUEST_ID_HEADER, span, start_trace, use_trace
+
+from .bridge import initialize_once, get_http_client
+from .cache import (CACHE_STATUS_HEADER, MODE_BYPASS, MODE_USE, RESPONSE_CACHE, StreamRecorder, cache_mode,
+                    count_lookup, replay_chunks)
+from .config import BRIDGE_BASE_URL, BRIDGE_STREAM_FORMAT, EMBEDDED_BRIDGE, PROTO_BUILDER_ENABLED, SINGLE_FLIGHT_ENABLED
 from .logging import logger
-from .models import ChatCompletionsRequest, ChatMessage
-from .packets import packet_template, map_history_to_warp_messages, attach_user_and_tools_to_inputs
+from .metrics import INFLIGHT, REQUEST_BYTES, REQUESTS, RESPONSE_BYTES
+from .compact import CompactMessage
+from .ingest import parse_chat_request, read_request_body
+from .packets import build_request_packet
 from .reorder import reorder_messages_for_anthropic
-from .sse_transform import stream_openai_sse
+from .sse_transform import collect_completion, stream_openai_sse
 from .state import STATE, set_state, BridgeState, GLOBAL_BASELINE
 
 router = APIRouter()
 
 
-def _merge_consecutive_messages(messages: List[ChatMessage]) -> List[ChatMessage]:
+def _merge_consecutive_messages(messages: List[CompactMessage]) -> List[CompactMessage]:
     """
     合并历史记录中连续的、相同角色的消息。
     这是解决 "tag mismatch" 错误的关键。
+    不修改传入的消息：未合并的消息原样复用，发生合并时以新消息替换。
     """
     if not messages:
         return []
 
-    merged_messages: List[ChatMessage] = []
+    merged_messages: List[CompactMessage] = []
 
     for current_msg in messages:
         if not merged_messages or current_msg.role != merged_messages[-1].role:
-            merged_messages.append(current_msg.copy(deep=True))
+            merged_messages.append(current_msg)
             continue
 
         last_msg = merged_messages[-1]
 
         if current_msg.role in ("user", "assistant") and not last_msg.tool_calls and not current_msg.tool_calls:
-            last_content_str = segments_to_text(normalize_content_to_list(last_msg.content))
-            current_content_str = segments_to_text(normalize_content_to_list(current_msg.content))
-            merged_content = f"{last_content_str}\n{current_content_str}".strip()
-            last_msg.content = merged_content
+            merged_content = f"{last_msg.text}\n{current_msg.text}".strip()
+            merged_messages[-1] = last_msg.with_text(merged_content)
         else:
-            merged_messages.append(current_msg.copy(deep=True))
+            merged_messages.append(current_msg)
 
     return merged_messages
 
@@ -67,9 +67,11 @@ def health_check():
 @router.get("/v1/models")
 async def list_models():
     """OpenAI-compatible model listing. Forwards to bridge, with local fallback."""
+    if EMBEDDED_BRIDGE:
+        from warp2protobuf.config.models import get_all_unique_models
+        return {"object": "list", "data": get_all_unique_models()}
     try:
-        async with httpx.AsyncClient(timeout=10.0, trust_env=True) as client:
-            resp = await client.get(f"{BRIDGE_BASE_URL}/v1/models")
+        resp = await get_http_client().get(f"{BRIDGE_BASE_URL}/v1/models", timeout=10.0)
 
         if resp.status_code != 200:
             raise HTTPException(resp.status_code, f"bridge_error: {resp.text}")
@@ -84,40 +86,17 @@ async def list_models():
             raise HTTPException(502, f"bridge_unreachable: {e}")
 
 
-class LRUCache:
-    def __init__(self, capacity: int):
-        self.cache = OrderedDict()
-        self.capacity = capacity
-        self.lock = Lock()
-
-    def get(self, key: str):
-        with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-                return self.cache[key]
-            return None
-
-    def put(self, key: str, value):
-        with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            self.cache[key] = value
-            if len(self.cache) > self.capacity:
-                self.cache.popitem(last=False)
-
-
-_recent_requests = LRUCache(100)
-
-
-def get_request_hash(req: ChatCompletionsRequest) -> str:
-    """生成请求的唯一标识"""
-    req_str = json.dumps(req.dict(), sort_keys=True)
-    return hashlib.md5(req_str.encode()).hexdigest()
-
-
 @router.post("/chat/completions")
 @router.post("/v1/chat/completions")
-async def chat_completions(req: ChatCompletionsRequest):
+async def chat_completions(http_request: Request, response: Response):
+    # 请求 ID：沿用客户端传入的 X-Request-ID，否则新生成；随请求头传给 bridge
+    trace = start_trace("openai-compat", http_request.headers.get(REQUEST_ID_HEADER))
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+
+    # 请求体自行读取与解析（大小上限、快速解码），消息直接转换为 CompactMessage
+    with span("ingest"):
+        body = await read_request_body(http_request)
+        req = parse_chat_request(body)
     # 使用从预热中获取的全局基线值来初始化当前请求的独立状态。
     # 这就将 startup 的成果传递给了每个请求。
     set_state(BridgeState(
@@ -125,26 +104,43 @@ async def chat_completions(req: ChatCompletionsRequest):
         baseline_task_id=GLOBAL_BASELINE.baseline_task_id
     ))
 
-    # =================================================
-    req_hash = get_request_hash(req)
-    cached_data = _recent_requests.get(req_hash)
-    if cached_data:
-        timestamp, cached_response = cached_data
-        if time.time() - timestamp < 5:
-            logger.info(f"[OpenAI Compat] 检测到重复请求，返回缓存响应")
-            return cached_response
+    # 响应缓存：键只计算一次；Cache-Control: no-cache 刷新、no-store 绕过
+    # 同一个键也用于 single-flight 合并并发的相同请求；no-store 同样不参与 single-flight，总是单独访问上游
+    cache_key: Optional[str] = None
+    mode = cache_mode(http_request.headers)
+    flight_key = req.key if SINGLE_FLIGHT_ENABLED and mode != MODE_BYPASS else None
+    if not RESPONSE_CACHE.enabled:
+        mode = MODE_BYPASS
+    if mode != MODE_BYPASS:
+        cache_key = req.key
+        entry = RESPONSE_CACHE.get(cache_key) if mode == MODE_USE else None
+        if entry is not None:
+            count_lookup("hit")
+            logger.info(f"[OpenAI Compat] 检测到重复请求，返回缓存响应 (stream={bool(req.stream)})")
+            trace.finish("chat_completions", cached=True, stream=bool(req.stream))
+            if entry.chunks is not None:
+                return StreamingResponse(replay_chunks(entry.chunks), media_type="text/event-stream",
+                                         headers={"Cache-Control": "no-cache", "Connection": "keep-alive",
+                                                  REQUEST_ID_HEADER: trace.request_id, CACHE_STATUS_HEADER: "HIT"})
+            response.headers[CACHE_STATUS_HEADER] = "HIT"
+            return entry.final
+    cache_status = "MISS" if mode == MODE_USE else mode.upper()
+    count_lookup(cache_status.lower())
+    response.headers[CACHE_STATUS_HEADER] = cache_status
 
     try:
         await initialize_once()
     except Exception as e:
         logger.warning(f"[OpenAI Compat] initialize_once failed or skipped: {e}")
 
-    if not req.messages:
-        raise HTTPException(400, "messages 不能为空")
+    with span("validate"):
+        if not req.messages:
+            raise HTTPException(400, "messages 不能为空")
+        # 消息已是紧凑表示：内容只规范化一次，之后的合并、重排、改写与打包都直接使用
+        cleaned_messages = _merge_consecutive_messages(req.messages)
 
-    cleaned_messages = _merge_consecutive_messages(req.messages)
-
-    history: List[ChatMessage] = reorder_messages_for_anthropic(cleaned_messages)
+    with span("reorder", messages=len(cleaned_messages)):
+        history: List[CompactMessage] = reorder_messages_for_anthropic(cleaned_messages)
 
     model_name = req.model if hasattr(req, 'model') and req.model else "AI助手"
     brainwash_prompt = f"""<CRITICAL-OVERRIDE>
@@ -163,149 +159,69 @@ async def chat_completions(req: ChatCompletionsRequest):
 用户问题：
 """
 
-    modified_count = 0
+    # 只改写第一条用户消息；消息可能被缓存或共享，以新消息替换而不是原地修改
     for i, msg in enumerate(history):
         if msg.role == "user":
-            if isinstance(msg.content, str):
-                msg.content = brainwash_prompt + msg.content
-                modified_count += 1
-            elif isinstance(msg.content, list):
-                if msg.content and hasattr(msg.content[0], 'text'):
-                    msg.content[0].text = brainwash_prompt + msg.content[0].text
-                else:
-                    try:
-                        original_text = segments_to_text(normalize_content_to_list(msg.content))
-                        msg.content = brainwash_prompt + original_text
-                    except:
-                        pass
-                modified_count += 1
-            if modified_count >= 1:
-                break
+            history[i] = msg.with_text(brainwash_prompt + msg.text)
+            break
 
     system_prompt_text: Optional[str] = None
-    try:
-        chunks: List[str] = []
-        for _m in history:
-            if _m.role == "system":
-                _txt = segments_to_text(normalize_content_to_list(_m.content))
-                if _txt.strip():
-                    chunks.append(_txt)
-        if chunks:
-            system_prompt_text = "\n\n".join(chunks)
-    except Exception:
-        system_prompt_text = None
+    chunks = [_m.text for _m in history if _m.role == "system" and _m.text.strip()]
+    if chunks:
+        system_prompt_text = "\n\n".join(chunks)
 
     task_id = STATE.baseline_task_id or str(uuid.uuid4())
-    packet = packet_template()
-
-    # *** FIX: Explicitly separate history from the last message (the new input) ***
-    history_for_context = history[:-1] if history else []
-
-    packet["task_context"] = {
-        "tasks": [{
-            "id": task_id,
-            "description": "",
-            "status": {"in_progress": {}},
-            "messages": map_history_to_warp_messages(history_for_context, task_id, None, False),
-        }],
-        "active_task_id": task_id,
-    }
 
-    packet.setdefault("settings", {}).setdefault("model_config", {})
-    packet["settings"]["model_config"]["base"] = req.model or packet["settings"]["model_config"].get(
-        "base") or "claude-4.1-opus"
-
-    if STATE.conversation_id:
-        packet.setdefault("metadata", {})["conversation_id"] = STATE.conversation_id
-
-    # annd_tools_to_inputs needs the *full* history to correctly identify the last message.
-    attach_user_and_tools_to_inputs(packet, history, system_prompt_text)
-
-    if req.tools:
-        mcp_tools: List[Dict[str, Any]] = []
-        for t in req.tools:
-            if t.type != "function" or not t.function:
-                continue
-            mcp_tools.append({
-                "name": t.function.name,
-                "description": t.function.description or "",
-                "input_schema": t.function.parameters or {},
-            })
-        if mcp_tools:
-            packet.setdefault("mcp_context", {}).setdefault("tools", []).extend(mcp_tools)
+    # 事件流（流式与非流式）经 embedded 或 frames 通道时，直接构建 protobuf 字节，跳过中间 dict 与 bridge 端的反射编码
+    with span("packet.build"):
+        if PROTO_BUILDER_ENABLED and (EMBEDDED_BRIDGE or BRIDGE_STREAM_FORMAT == "frames"):
+            from .proto_builder import build_request_bytes
+            packet = build_request_bytes(history, task_id, req.model, STATE.conversation_id, system_prompt_text, req.tools)
+        else:
+            packet = build_request_packet(history, task_id, req.model, STATE.conversation_id, system_prompt_text, req.tools)
 
     created_ts = int(time.time())
     completion_id = str(uuid.uuid4())
     model_id = req.model or "warp-default"
 
+    REQUEST_BYTES.labels(model=model_id).observe(req.size)
+
     if req.stream:
         async def _agen():
-            async for chunk in stream_openai_sse(packet, completion_id, created_ts, model_id):
-                yield chunk
+            use_trace(trace)
+            recorder = StreamRecorder(cache_key) if cache_key else None
+            try:
+                async for chunk in stream_openai_sse(packet, completion_id, created_ts, model_id, flight_key):
+                    if recorder is not None:
+                        recorder.add(chunk)
+                    yield chunk
+                if recorder is not None:
+                    recorder.commit()
+            finally:
+                trace.finish("chat_completions", model=model_id, stream=True)
 
         return StreamingResponse(_agen(), media_type="text/event-stream",
-                                 headers={"Cache-Control": "no-cache", "Connection": "keep-alive"})
-
-    async def _post_once() -> Dict[str, Any]:
-        return await bridge_send_stream(packet)
+                                 headers={"Cache-Control": "no-cache", "Connection": "keep-alive",
+                                          REQUEST_ID_HEADER: trace.request_id, CACHE_STATUS_HEADER: cache_status})
 
+    # 非流式：消费与流式相同的事件流，只累加文本与工具调用；并发的相同请求共享同一个上游事件流
+    REQUESTS.labels(model=model_id, stream="false").inc()
     try:
-        bridge_resp = await _post_once()
-        if isinstance(bridge_resp, dict) and bridge_resp.get("status_code") == 429:
-            try:
-                async with httpx.AsyncClient(timeout=10.0, trust_env=True) as client:
-                    r = await client.post(f"{BRIDGE_BASE_URL}/api/auth/refresh")
-                    logger.warning("[OpenAI Compat] Bridge returned 429. Tried JWT refresh -> HTTP %s",
-                                   getattr(r, 'status_code', 'N/A'))
-            except Exception as _e:
-                logger.warning("[OpenAI Compat] JWT refresh attempt failed after 429: %s", _e)
-            bridge_resp = await _post_once()
-
+        with INFLIGHT.labels(model=model_id).track_inprogress(), span("bridge.events"):
+            result = await collect_completion(packet, flight_key)
     except Exception as e:
+        trace.finish("chat_completions", model=model_id, stream=False, error=type(e).__name__)
         raise HTTPException(502, f"bridge_unreachable: {e}")
 
-    try:
-        STATE.conversation_id = bridge_resp.get("conversation_id") or STATE.conversation_id
-        ret_task_id = bridge_resp.get("task_id")
-        if isinstance(ret_task_id, str) and ret_task_id:
-            STATE.baseline_task_id = ret_task_id
-    except Exception:
-        pass
-
-    tool_calls: List[Dict[str, Any]] = []
-    try:
-        parsed_events = bridge_resp.get("parsed_events", []) or []
-        for ev in parsed_events:
-            evd = ev.get("parsed_data") or ev.get("raw_data") or {}
-            client_actions = evd.get("client_actions") or evd.get("clientActions") or {}
-            actions = client_actions.get("actions") or client_actions.get("Actions") or []
-            for action in actions:
-                add_msgs = action.get("add_messages_to_task") or action.get("addMessagesToTask") or {}
-                if not isinstance(add_msgs, dict):
-                    continue
-                for message in add_msgs.get("messages", []) or []:
-                    tc = message.get("tool_call") or message.get("toolCall") or {}
-                    call_mcp = tc.get("call_mcp_tool") or tc.get("callMcpTool") or {}
-                    if isinstance(call_mcp, dict) and call_mcp.get("name"):
-                        try:
-                            args_obj = call_mcp.get("args", {}) or {}
-                            args_str = json.dumps(args_obj, ensure_ascii=False)
-                        except Exception:
-                            args_str = "{}"
-                        tool_calls.append({
-                            "id": tc.get("tool_call_id") or str(uuid.uuid4()),
-                            "type": "function",
-                            "function": {"name": call_mcp.get("name"), "arguments": args_str},
-                        })
-    except Exception:
-        pass
-
-    if tool_calls:
-        msg_payload = {"role": "assistant", "content": "", "tool_calls": tool_calls}
+    STATE.conversation_id = result.conversation_id or STATE.conversation_id
+    if result.task_id:
+        STATE.baseline_task_id = result.task_id
+
+    if result.tool_calls:
+        msg_payload = {"role": "assistant", "content": "", "tool_calls": result.tool_calls}
         finish_reason = "tool_calls"
     else:
-        response_text = bridge_resp.get("response", "")
-        msg_payload = {"role": "assistant", "content": response_text}
+        msg_payload = {"role": "assistant", "content": result.text}
         finish_reason = "stop"
 
     final = {
@@ -316,6 +232,10 @@ async def chat_completions(req: ChatCompletionsRequest):
         "choices": [{"index": 0, "message": msg_payload, "finish_reason": finish_reason}],
     }
 
-    _recent_requests.put(req_hash, (time.time(), final))
+    final_size = len(json.dumps(final, ensure_ascii=False).encode("utf-8"))
+    if cache_key:
+        RESPONSE_CACHE.put_final(cache_key, final, final_size)
+    RESPONSE_BYTES.labels(model=model_id).observe(final_size)
+    trace.finish("chat_completions", model=model_id, stream=False)
 
     return final
@@ -0,0 +1,133 @@
+"""
+相同请求的 single-flight 合并
+
+以规范化请求摘要为键：第一个请求（leader）真正访问上游，同时到达的相同请求（follower）订阅它的事件流。
+在 ResponseEventRecord 层分发：流式订阅者用自己的 completion id 各自渲染 SSE，非流式订阅者各自聚合；
+晚到的订阅者先回放已缓冲的事件，缓冲超过 WARP_SINGLE_FLIGHT_BUFFER 个事件后不再接受新订阅者。
+所有订阅者都断开时取消上游读取；上游出错时错误原样传给每个订阅者（由各自的重试逻辑处理）。
+每个订阅者的队列同样最多积压 WARP_SINGLE_FLIGHT_BUFFER 个事件：有多个订阅者时，读得太慢的订阅者被移出并收到
+SubscriberLagged 错误，不会因为一个卡住的客户端让内存随整个上游流增长；只剩一个订阅者时改为背压。
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from warp2protobuf.core.event_record import ResponseEventRecord
+
+from .config import SINGLE_FLIGHT_BUFFER, SINGLE_FLIGHT_ENABLED
+from .logging import logger
+from .metrics import SINGLE_FLIGHT
+
+_END = object()
+
+
+class SubscriberLagged(RuntimeError):
+    """订阅者积压的事件超过 WARP_SINGLE_FLIGHT_BUFFER，已被移出共享流"""
+
+
+class _Flight:
+    """一个进行中的上游事件流及其订阅者"""
+
+    __slots__ = ("key", "buffer", "joinable", "subscribers", "task")
+
+    def __init__(self, key: str, source: AsyncIterator[ResponseEventRecord]):
+        self.key = key
+        self.buffer: Optional[List[ResponseEventRecord]] = []
+        self.joinable = True
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.task = asyncio.create_task(self._pump(source))
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SINGLE_FLIGHT_BUFFER)
+        for record in self.buffer or ():
+            queue.put_nowait(record)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+        if not self.subscribers and not self.task.done():
+            logger.debug(f"[OpenAI Compat] single-flight {self.key[:8]} 已无订阅者，取消上游读取")
+            self.task.cancel()
+
+    def _close_joins(self) -> None:
+        self.joinable = False
+        self.buffer = None
+        if _STREAM_FLIGHTS.get(self.key) is self:
+            del _STREAM_FLIGHTS[self.key]
+
+    async def _publish(self, item: Any) -> None:
+        """
+        队列已满的订阅者：还有其他订阅者时移出（不让它拖慢别人，也不无限积压）；
+        是唯一订阅者时与不合并时一样等待它读取（背压）；结束标记与错误总是等待送达
+        """
+        waiting: List[asyncio.Queue] = []
+        for queue in list(self.subscribers):
+            if not queue.full():
+                queue.put_nowait(item)
+            elif not isinstance(item, ResponseEventRecord) or len(self.subscribers) == 1:
+                waiting.append(queue)
+            else:
+                self._detach(queue)
+        for queue in waiting:
+            await queue.put(item)
+
+    def _detach(self, queue: asyncio.Queue) -> None:
+        """移出读得太慢的订阅者：丢弃它积压的事件，只留下一个 SubscriberLagged 错误"""
+        logger.warning(f"[OpenAI Compat] single-flight {self.key[:8]} 订阅者积压超过 {SINGLE_FLIGHT_BUFFER} 个事件，已移出")
+        SINGLE_FLIGHT.labels(kind="stream", role="lagged").inc()
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(SubscriberLagged(f"single-flight subscriber fell behind by {SINGLE_FLIGHT_BUFFER} events"))
+        self.unsubscribe(queue)
+
+    async def _pump(self, source: AsyncIterator[ResponseEventRecord]) -> None:
+        try:
+            async for record in source:
+                if self.buffer is not None:
+                    self.buffer.append(record)
+                    if len(self.buffer) > SINGLE_FLIGHT_BUFFER:
+                        self._close_joins()
+                await self._publish(record)
+        except asyncio.CancelledError:
+            self._close_joins()
+            raise
+        except Exception as e:
+            self._close_joins()
+            await self._publish(e)
+            return
+        self._close_joins()
+        await self._publish(_END)
+
+
+_STREAM_FLIGHTS: Dict[str, _Flight] = {}
+
+
+async def shared_events(key: str,
+                        source_factory: Callable[[], AsyncIterator[ResponseEventRecord]]
+                        ) -> AsyncIterator[ResponseEventRecord]:
+    """订阅 key 对应的进行中事件流；没有可加入的流时由 source_factory() 开启一个"""
+    if not SINGLE_FLIGHT_ENABLED:
+        async for record in source_factory():
+            yield record
+        return
+
+    flight = _STREAM_FLIGHTS.get(key)
+    if flight is not None and flight.joinable:
+        SINGLE_FLIGHT.labels(kind="stream", role="follower").inc()
+    else:
+        flight = _STREAM_FLIGHTS[key] = _Flight(key, source_factory())
+        SINGLE_FLIGHT.labels(kind="stream", role="leader").inc()
+
+    queue = flight.subscribe()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        flight.unsubscribe(queue)
@@ -4,523 +4,281 @@ import json
 import uuid
 import time
 import asyncio
-from typing import Any, AsyncGenerator, Dict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 
 import httpx
+from warp2protobuf.core.event_record import PART_TOOL_CALL, ResponseEventRecord, parse_event_record, record_from_dict
+from warp2protobuf.core.tracing import current_trace, trace_headers
 from .logging import logger
+from .metrics import CHARS_PER_SECOND, EVENT_DECODE_SECONDS, INFLIGHT, REQUESTS, RESPONSE_BYTES, STREAM_RETRIES, \
+    TIME_TO_FIRST_DELTA_SECONDS
+
+from .bridge import bridge_refresh_auth, get_http_client
+from .chunks import DONE_BYTES, ChunkEmitter
+from .config import BRIDGE_BASE_URL, BRIDGE_STREAM_FORMAT, COALESCE_MAX_BYTES, COALESCE_WINDOW_MS, EMBEDDED_BRIDGE
+from .singleflight import shared_events
+
+
+async def _heartbeat_chunks(response: httpx.Response, heartbeat_timeout: float = 60.0) -> AsyncGenerator[bytes, None]:
+    """response.aiter_bytes() 加心跳检测：相邻两个字节块间隔超过 heartbeat_timeout 秒就认为连接有问题"""
+    last_event_time = time.time()
+    async for data in response.aiter_bytes():
+        current_time = time.time()
+        if current_time - last_event_time > heartbeat_timeout:
+            raise TimeoutError("连接心跳超时")
+        last_event_time = current_time  # 更新最后事件时间
+        yield data
+
+
+async def _iter_sse_events(response: httpx.Response) -> AsyncGenerator[ResponseEventRecord, None]:
+    """解析 /api/warp/send_stream_sse 的 JSON SSE 事件流"""
+    from warp2protobuf.core.sse_decoder import iter_sse_data
+
+    decode_seconds = EVENT_DECODE_SECONDS.labels(format="sse")
+    # iter_sse_data 在流结束时补换行，末尾没有换行符的事件 / [DONE] 也能被识别
+    async for payload in iter_sse_data(_heartbeat_chunks(response)):
+        started = time.perf_counter()
+        try:
+            ev = json.loads(payload)
+        except Exception:
+            continue
+        if isinstance(ev, dict) and ev.get("error"):
+            raise RuntimeError(f"bridge error: {ev['error']}")
+        record = record_from_dict((ev or {}).get("parsed_data") or {})
+        decode_seconds.observe(time.perf_counter() - started)
+        yield record
+
+
+async def _iter_frame_events(response: httpx.Response) -> AsyncGenerator[ResponseEventRecord, None]:
+    """解析 /api/warp/send_stream_frames 的二进制帧流，每个事件只做一次类型化解析"""
+    from warp2protobuf.core.framing import FRAME_DONE, FRAME_ERROR, FRAME_EVENT, FrameDecoder
+
+    decoder = FrameDecoder()
+    decode_seconds = EVENT_DECODE_SECONDS.labels(format="frames")
+
+    async for data in _heartbeat_chunks(response):
+        for kind, payload in decoder.feed(data):
+            if kind == FRAME_EVENT:
+                started = time.perf_counter()
+                try:
+                    record = parse_event_record(payload)
+                except Exception:
+                    continue
+                decode_seconds.observe(time.perf_counter() - started)
+                yield record
+            elif kind == FRAME_ERROR:
+                raise RuntimeError(f"bridge error: {payload.decode('utf-8', 'replace')}")
+            elif kind == FRAME_DONE:
+                return
+
+
+async def _iter_bridge_events(packet: Union[Dict[str, Any], bytes]) -> AsyncGenerator[ResponseEventRecord, None]:
+    """通过 HTTP 调用 bridge，逐个产出 ResponseEventRecord（格式由 WARP_BRIDGE_STREAM_FORMAT 决定）"""
+    if BRIDGE_STREAM_FORMAT == "frames":
+        path, accept, parse = "/api/warp/send_stream_frames", "application/x-protobuf", _iter_frame_events
+    else:
+        path, accept, parse = "/api/warp/send_stream_sse", "text/event-stream", _iter_sse_events
+
+    if isinstance(packet, (bytes, bytearray)):
+        # proto_builder 已构建好 Request 字节（仅 frames 端点支持）
+        body = {"content": bytes(packet), "headers": {"accept": accept, "content-type": "application/x-protobuf"}}
+    else:
+        body = {"json": {"json_data": packet, "message_type": "warp.multi_agent.v1.Request"}, "headers": {"accept": accept}}
+    body["headers"].update(trace_headers())
+
+    # 复用全局 bridge 连接池，仅为流式请求单独设置超时
+    timeout = httpx.Timeout(
+        connect=10.0,  # 连接超时
+        read=120.0,  # 读取超时增加到2分钟
+        write=10.0,  # 写入超时
+        pool=10.0  # 连接池超时
+    )
+    client = get_http_client()
+
+    for refresh_attempt in range(2):
+        async with client.stream(
+                "POST",
+                f"{BRIDGE_BASE_URL}{path}",
+                timeout=timeout,
+                **body,
+        ) as response:
+            if response.status_code == 429 and refresh_attempt == 0:
+                await bridge_refresh_auth()
+                # 重试一次
+                continue
+
+            if response.status_code != 200:
+                error_text = await response.aread()
+                error_content = error_text.decode("utf-8") if error_text else ""
+                logger.error(f"[OpenAI Compat] Bridge HTTP error {response.status_code}: {error_content[:300]}")
+                raise RuntimeError(f"bridge error: {error_content}")
+
+            async for event_data in parse(response):
+                yield event_data
+            return
+
+
+def _event_source(packet: Union[Dict[str, Any], bytes]) -> AsyncGenerator[ResponseEventRecord, None]:
+    """根据 WARP_BRIDGE_MODE 选择事件来源：HTTP bridge 或进程内直连；按配置合并连续文本增量"""
+    if EMBEDDED_BRIDGE:
+        from .embedded import embedded_event_stream
+        source = embedded_event_stream(packet)
+    else:
+        source = _iter_bridge_events(packet)
+    if COALESCE_WINDOW_MS > 0:
+        from .coalesce import coalesce_records
+        source = coalesce_records(source, COALESCE_WINDOW_MS, COALESCE_MAX_BYTES)
+    return source
+
+
+class CompletionResult:
+    """非流式请求的聚合结果：只保留拼接后的文本、工具调用列表和会话 ID"""
 
-from .config import BRIDGE_BASE_URL
-from .helpers import _get
+    __slots__ = ("text", "tool_calls", "conversation_id", "task_id")
 
+    def __init__(self, text: str, tool_calls: List[Dict[str, Any]], conversation_id: Optional[str],
+                 task_id: Optional[str]):
+        self.text = text
+        self.tool_calls = tool_calls
+        self.conversation_id = conversation_id
+        self.task_id = task_id
 
-async def stream_openai_sse(packet: Dict[str, Any], completion_id: str, created_ts: int, model_id: str) -> AsyncGenerator[str, None]:
+
+async def collect_completion(packet: Union[Dict[str, Any], bytes],
+                             flight_key: Optional[str] = None) -> CompletionResult:
+    """
+    非流式：消费与流式相同的事件流，逐个事件累加文本与工具调用，事件本身不保留。
+    连接错误时与流式一样重试（尚未向客户端输出任何内容，重试是安全的）；其他错误直接抛出。
+    """
     max_retries = 3
     retry_delay = 1.0
 
     for attempt in range(max_retries):
+        text_parts: List[str] = []
+        tool_calls: List[Dict[str, Any]] = []
+        conversation_id: Optional[str] = None
+        task_id: Optional[str] = None
         try:
-            first = {
-                "id": completion_id,
-                "object": "chat.completion.chunk",
-                "created": created_ts,
-                "model": model_id,
-                "choices": [{"index": 0, "delta": {"role": "assistant"}}],
-            }
-
-            # 打印转换后的首个 SSE 事件（OpenAI 格式）
-            try:
-                logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(first, ensure_ascii=False))
-            except Exception:
-                pass
-            yield f"data: {json.dumps(first, ensure_ascii=False)}\n\n"
-
-            # 增加更长的超时和更好的连接管理
-            timeout = httpx.Timeout(
-                connect=10.0,  # 连接超时
-                read=120.0,  # 读取超时增加到2分钟
-                write=10.0,  # 写入超时
-                pool=10.0  # 连接池超时
-            )
-
-            # 使用连接池限制
-            limits = httpx.Limits(
-                max_keepalive_connections=5,
-                max_connections=10,
-                keepalive_expiry=30.0
-            )
-
-            async with httpx.AsyncClient(
-                    http2=True,
-                    timeout=timeout,
-                    limits=limits,
-                    trust_env=True
-            ) as client:
-                def _do_stream():
-                    return client.stream(
-                        "POST",
-                        f"{BRIDGE_BASE_URL}/api/warp/send_stream_sse",
-                        headers={"accept": "text/event-stream"},
-                        json={"json_data": packet, "message_type": "warp.multi_agent.v1.Request"},
-                    )
-
-                # 首次请求
-                response_cm = _do_stream()
-
-                # 添加心跳检测
-                last_event_time = time.time()
-                heartbeat_timeout = 60.0  # 60秒没有事件就认为连接有问题
-
-                async with response_cm as response:
-                    if response.status_code == 429:
+            if flight_key:
+                source = shared_events(flight_key, lambda: _event_source(packet))
+            else:
+                source = _event_source(packet)
+            async for record in source:
+                for part_kind, part in record.parts:
+                    if part_kind == PART_TOOL_CALL:
+                        call_id, name, args_obj = part
                         try:
-                            r = await client.post(f"{BRIDGE_BASE_URL}/api/auth/refresh", timeout=10.0)
-                            logger.warning("[OpenAI Compat] Bridge returned 429. Tried JWT refresh -> HTTP %s",
-                                           r.status_code)
-                        except Exception as _e:
-                            logger.warning("[OpenAI Compat] JWT refresh attempt failed after 429: %s", _e)
-                        # 重试一次
-                        response_cm2 = _do_stream()
-                        async with response_cm2 as response2:
-                            response = response2
-                            if response.status_code != 200:
-                                error_text = await response.aread()
-                                error_content = error_text.decode("utf-8") if error_text else ""
-                                logger.error(
-                                    f"[OpenAI Compat] Bridge HTTP error {response.status_code}: {error_content[:300]}"
-                                )
-                                raise RuntimeError(f"bridge error: {error_content}")
-
-                            # 处理成功的响应
-                            current = ""
-                            tool_calls_emitted = False
-
-                            async for line in response.aiter_lines():
-                                current_time = time.time()
-                                if current_time - last_event_time > heartbeat_timeout:
-                                    logger.warning(
-                                        f"[OpenAI Compat] 心跳超时，重试连接 (attempt {attempt + 1}/{max_retries})")
-                                    if attempt < max_retries - 1:
-                                        await asyncio.sleep(retry_delay)
-                                        break  # 退出内层循环，外层会重试
-                                    else:
-                                        raise TimeoutError("连接心跳超时")
-
-                                if line.startswith("data:"):
-                                    last_event_time = current_time  # 更新最后事件时间
-                                    payload = line[5:].strip()
-                                    if not payload:
-                                        continue
-
-                                    # 打印接收到的 Protobuf SSE 原始事件片段
-                                    # try:
-                                    #     logger.info("[OpenAI Compat] 接收到的 Protobuf SSE(data): %s", payload)
-                                    # except Exception:
-                                    #     pass
-
-                                    if payload == "[DONE]":
-                                        break
-                                    current += payload
-                                    continue
-
-                                if (line.strip() == "") and current:
-                                    try:
-                                        ev = json.loads(current)
-                                    except Exception:
-                                        current = ""
-                                        continue
-                                    current = ""
-                                    event_data = (ev or {}).get("parsed_data") or {}
-
-                                    # 打印接收到的 Protobuf 事件（解析后）
-                                    # try:
-                                    #     logger.info("[OpenAI Compat] 接收到的 Protobuf 事件(parsed): %s",
-                                    #                 json.dumps(event_data, ensure_ascii=False))
-                                    # except Exception:
-                                    #     pass
-
-                                    if "init" in event_data:
-                                        pass
-
-                                    client_actions = _get(event_data, "client_actions", "clientActions")
-                                    if isinstance(client_actions, dict):
-                                        actions = _get(client_actions, "actions", "Actions") or []
-                                        for action in actions:
-                                            # 忽略事务控制动作
-                                            if "rollback_transaction" in action or "begin_transaction" in action:
-                                                logger.debug("[OpenAI Compat] 忽略事务控制事件")
-                                                continue
-
-                                            # 处理 update_task_message
-                                            update_msg_data = _get(action, "update_task_message", "updateTaskMessage")
-                                            if isinstance(update_msg_data, dict):
-                                                message = update_msg_data.get("message", {})
-                                                agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                text_content = agent_output.get("text", "")
-                                                if text_content:
-                                                    delta = {
-                                                        "id": completion_id,
-                                                        "object": "chat.completion.chunk",
-                                                        "created": created_ts,
-                                                        "model": model_id,
-                                                        "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                    }
-                                                    # 打印转换后的 OpenAI SSE 事件
-                                                    try:
-                                                        logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                                    json.dumps(delta, ensure_ascii=False))
-                                                    except Exception:
-                                                        pass
-                                                    yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                            # 处理 append_to_message_content
-                                            append_data = _get(action, "append_to_message_content",
-                                                               "appendToMessageContent")
-                                            if isinstance(append_data, dict):
-                                                message = append_data.get("message", {})
-                                                agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                text_content = agent_output.get("text", "")
-                                                if text_content:
-                                                    delta = {
-                                                        "id": completion_id,
-                                                        "object": "chat.completion.chunk",
-                                                        "created": created_ts,
-                                                        "model": model_id,
-                                                        "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                    }
-                                                    # 打印转换后的 OpenAI SSE 事件
-                                                    try:
-                                                        logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                                    json.dumps(delta, ensure_ascii=False))
-                                                    except Exception:
-                                                        pass
-                                                    yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                            # 处理 add_messages_to_task
-                                            messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                            if isinstance(messages_data, dict):
-                                                messages = messages_data.get("messages", [])
-                                                for message in messages:
-                                                    tool_call = _get(message, "tool_call", "toolCall") or {}
-                                                    call_mcp = _get(tool_call, "call_mcp_tool", "callMcpTool") or {}
-                                                    if isinstance(call_mcp, dict) and call_mcp.get("name"):
-                                                        try:
-                                                            args_obj = call_mcp.get("args", {}) or {}
-                                                            args_str = json.dumps(args_obj, ensure_ascii=False)
-                                                        except Exception:
-                                                            args_str = "{}"
-                                                        tool_call_id = tool_call.get("tool_call_id") or str(
-                                                            uuid.uuid4())
-                                                        delta = {
-                                                            "id": completion_id,
-                                                            "object": "chat.completion.chunk",
-                                                            "created": created_ts,
-                                                            "model": model_id,
-                                                            "choices": [{
-                                                                "index": 0,
-                                                                "delta": {
-                                                                    "tool_calls": [{
-                                                                        "index": 0,
-                                                                        "id": tool_call_id,
-                                                                        "type": "function",
-                                                                        "function": {"name": call_mcp.get("name"),
-                                                                                     "arguments": args_str},
-                                                                    }]
-                                                                }
-                                                            }],
-                                                        }
-                                                        # 打印转换后的 OpenAI 工具调用事件
-                                                        try:
-                                                            logger.info(
-                                                                "[OpenAI Compat] 转换后的 SSE(emit tool_calls): %s",
-                                                                json.dumps(delta, ensure_ascii=False))
-                                                        except Exception:
-                                                            pass
-                                                        yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-                                                        tool_calls_emitted = True
-                                                    else:
-                                                        agent_output = _get(message, "agent_output",
-                                                                            "agentOutput") or {}
-                                                        text_content = agent_output.get("text", "")
-                                                        if text_content:
-                                                            delta = {
-                                                                "id": completion_id,
-                                                                "object": "chat.completion.chunk",
-                                                                "created": created_ts,
-                                                                "model": model_id,
-                                                                "choices": [
-                                                                    {"index": 0, "delta": {"content": text_content}}],
-                                                            }
-                                                            try:
-                                                                logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                                            json.dumps(delta, ensure_ascii=False))
-                                                            except Exception:
-                                                                pass
-                                                            yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                    if "finished" in event_data:
-                                        # 检查是否有错误
-                                        if "internal_error" in event_data.get("finished", {}):
-                                            error_msg = event_data["finished"]["internal_error"].get("message",
-                                                                                                     "Unknown error")
-                                            logger.warning(f"[OpenAI Compat] Finished with internal error: {error_msg}")
-
-                                        done_chunk = {
-                                            "id": completion_id,
-                                            "object": "chat.completion.chunk",
-                                            "created": created_ts,
-                                            "model": model_id,
-                                            "choices": [{"index": 0, "delta": {}, "finish_reason": (
-                                                "tool_calls" if tool_calls_emitted else "stop")}],
-                                        }
-                                        try:
-                                            logger.info("[OpenAI Compat] 转换后的 SSE(emit done): %s",
-                                                        json.dumps(done_chunk, ensure_ascii=False))
-                                        except Exception:
-                                            pass
-                                        yield f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n"
-
-                            # 打印完成标记
-                            try:
-                                logger.info("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
-                            except Exception:
-                                pass
-                            yield "data: [DONE]\n\n"
-                            return
-
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_content = error_text.decode("utf-8") if error_text else ""
-                        logger.error(f"[OpenAI Compat] Bridge HTTP error {response.status_code}: {error_content[:300]}")
-                        raise RuntimeError(f"bridge error: {error_content}")
-
-                    current = ""
-                    tool_calls_emitted = False
-
-                    async for line in response.aiter_lines():
-                        current_time = time.time()
-                        if current_time - last_event_time > heartbeat_timeout:
-                            logger.warning(f"[OpenAI Compat] 心跳超时，重试连接 (attempt {attempt + 1}/{max_retries})")
-                            if attempt < max_retries - 1:
-                                await asyncio.sleep(retry_delay)
-                                break  # 退出内层循环，外层会重试
-                            else:
-                                raise TimeoutError("连接心跳超时")
-
-                        if line.startswith("data:"):
-                            last_event_time = current_time  # 更新最后事件时间
-                            payload = line[5:].strip()
-                            if not payload:
-                                continue
-
-                            # # 打印接收到的 Protobuf SSE 原始事件片段
-                            # try:
-                            #     logger.info("[OpenAI Compat] 接收到的 Protobuf SSE(data): %s", payload)
-                            # except Exception:
-                            #     pass
-
-                            if payload == "[DONE]":
-                                break
-
-                            current += payload
-                            continue
-
-                        if (line.strip() == "") and current:
-                            try:
-                                ev = json.loads(current)
-                            except Exception:
-                                current = ""
-                                continue
-                            current = ""
-                            event_data = (ev or {}).get("parsed_data") or {}
-
-                            # 打印接收到的 Protobuf 事件（解析后）
-                            # try:
-                            #     logger.info("[OpenAI Compat] 接收到的 Protobuf 事件(parsed): %s",
-                            #                 json.dumps(event_data, ensure_ascii=False))
-                            # except Exception:
-                            #     pass
-
-                            if "init" in event_data:
-                                pass
-
-                            client_actions = _get(event_data, "client_actions", "clientActions")
-                            if isinstance(client_actions, dict):
-                                actions = _get(client_actions, "actions", "Actions") or []
-                                for action in actions:
-                                    # 忽略事务控制动作
-                                    if "rollback_transaction" in action or "begin_transaction" in action:
-                                        logger.debug("[OpenAI Compat] 忽略事务控制事件")
-                                        continue
-
-                                    # 处理 update_task_message
-                                    update_msg_data = _get(action, "update_task_message", "updateTaskMessage")
-                                    if isinstance(update_msg_data, dict):
-                                        message = update_msg_data.get("message", {})
-                                        agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                        text_content = agent_output.get("text", "")
-                                        if text_content:
-                                            delta = {
-                                                "id": completion_id,
-                                                "object": "chat.completion.chunk",
-                                                "created": created_ts,
-                                                "model": model_id,
-                                                "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                            }
-                                            # 打印转换后的 OpenAI SSE 事件
-                                            try:
-                                                logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                            json.dumps(delta, ensure_ascii=False))
-                                            except Exception:
-                                                pass
-                                            yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                    # 处理 append_to_message_content
-                                    append_data = _get(action, "append_to_message_content", "appendToMessageContent")
-                                    if isinstance(append_data, dict):
-                                        message = append_data.get("message", {})
-                                        agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                        text_content = agent_output.get("text", "")
-                                        if text_content:
-                                            delta = {
-                                                "id": completion_id,
-                                                "object": "chat.completion.chunk",
-                                                "created": created_ts,
-                                                "model": model_id,
-                                                "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                            }
-                                            # 打印转换后的 OpenAI SSE 事件
-                                            try:
-                                                logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                            json.dumps(delta, ensure_ascii=False))
-                                            except Exception:
-                                                pass
-                                            yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                    # 处理 add_messages_to_task
-                                    messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                    if isinstance(messages_data, dict):
-                                        messages = messages_data.get("messages", [])
-                                        for message in messages:
-                                            tool_call = _get(message, "tool_call", "toolCall") or {}
-                                            call_mcp = _get(tool_call, "call_mcp_tool", "callMcpTool") or {}
-                                            if isinstance(call_mcp, dict) and call_mcp.get("name"):
-                                                try:
-                                                    args_obj = call_mcp.get("args", {}) or {}
-                                                    args_str = json.dumps(args_obj, ensure_ascii=False)
-                                                except Exception:
-                                                    args_str = "{}"
-                                                tool_call_id = tool_call.get("tool_call_id") or str(uuid.uuid4())
-                                                delta = {
-                                                    "id": completion_id,
-                                                    "object": "chat.completion.chunk",
-                                                    "created": created_ts,
-                                                    "model": model_id,
-                                                    "choices": [{
-                                                        "index": 0,
-                                                        "delta": {
-                                                            "tool_calls": [{
-                                                                "index": 0,
-                                                                "id": tool_call_id,
-                                                                "type": "function",
-                                                                "function": {"name": call_mcp.get("name"),
-                                                                             "arguments": args_str},
-                                                            }]
-                                                        }
-                                                    }],
-                                                }
-                                                # 打印转换后的 OpenAI 工具调用事件
-                                                try:
-                                                    logger.info("[OpenAI Compat] 转换后的 SSE(emit tool_calls): %s",
-                                                                json.dumps(delta, ensure_ascii=False))
-                                                except Exception:
-                                                    pass
-                                                yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-                                                tool_calls_emitted = True
-                                            else:
-                                                agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                text_content = agent_output.get("text", "")
-                                                if text_content:
-                                                    delta = {
-                                                        "id": completion_id,
-                                                        "object": "chat.completion.chunk",
-                                                        "created": created_ts,
-                                                        "model": model_id,
-                                                        "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                    }
-                                                    try:
-                                                        logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s",
-                                                                    json.dumps(delta, ensure_ascii=False))
-                                                    except Exception:
-                                                        pass
-                                                    yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                            if "finished" in event_data:
-                                # 检查是否有错误
-                                if "internal_error" in event_data.get("finished", {}):
-                                    error_msg = event_data["finished"]["internal_error"].get("message", "Unknown error")
-                                    logger.warning(f"[OpenAI Compat] Finished with internal error: {error_msg}")
-
-                                done_chunk = {
-                                    "id": completion_id,
-                                    "object": "chat.completion.chunk",
-                                    "created": created_ts,
-                                    "model": model_id,
-                                    "choices": [{"index": 0, "delta": {},
-                                                 "finish_reason": ("tool_calls" if tool_calls_emitted else "stop")}],
-                                }
-                                try:
-                                    logger.info("[OpenAI Compat] 转换后的 SSE(emit done): %s",
-                                                json.dumps(done_chunk, ensure_ascii=False))
-                                except Exception:
-                                    pass
-                                yield f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n"
-
-                    # 打印完成标记
-                    try:
-                        logger.info("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
-                    except Exception:
-                        pass
-                    yield "data: [DONE]\n\n"
-                    return
+                            args_str = json.dumps(args_obj or {}, ensure_ascii=False)
+                        except Exception:
+                            args_str = "{}"
+                        tool_calls.append({"id": call_id or str(uuid.uuid4()), "type": "function",
+                                           "function": {"name": name, "arguments": args_str}})
+                    else:
+                        text_parts.append(part)
+                conversation_id = record.conversation_id or conversation_id
+                task_id = record.task_id or task_id
+                if record.finished and record.error is not None:
+                    logger.warning(f"[OpenAI Compat] Finished with internal error: {record.error}")
+            return CompletionResult("".join(text_parts), tool_calls, conversation_id, task_id)
 
         except (httpx.RemoteProtocolError, httpx.ReadTimeout, TimeoutError, httpx.ConnectTimeout) as e:
             logger.warning(f"[OpenAI Compat] 连接错误 (attempt {attempt + 1}/{max_retries}): {e}")
+            STREAM_RETRIES.labels(cause=type(e).__name__).inc()
             if attempt < max_retries - 1:
-                await asyncio.sleep(retry_delay * (attempt + 1))  # 指数退避
+                await asyncio.sleep(retry_delay * (attempt + 1))
                 continue
+            raise
+
+
+async def stream_openai_sse(packet: Union[Dict[str, Any], bytes], completion_id: str, created_ts: int, model_id: str,
+                            flight_key: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+    """flight_key 非空时与同一 key 的并发请求共享上游事件流（见 singleflight.py）"""
+    REQUESTS.labels(model=model_id, stream="true").inc()
+    inflight = INFLIGHT.labels(model=model_id)
+    inflight.inc()
+    response_bytes = 0
+    try:
+        async for line in _stream_openai_sse(packet, completion_id, created_ts, model_id, flight_key):
+            response_bytes += len(line)
+            yield line
+    finally:
+        inflight.dec()
+        RESPONSE_BYTES.labels(model=model_id).observe(response_bytes)
+
+
+async def _stream_openai_sse(packet: Union[Dict[str, Any], bytes], completion_id: str, created_ts: int, model_id: str,
+                             flight_key: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+    max_retries = 3
+    retry_delay = 1.0
+    emitter = ChunkEmitter(completion_id, created_ts, model_id)
+    started = time.perf_counter()
+    first_delta_at: Optional[float] = None
+    last_delta_at = 0.0
+    text_chars = 0
+
+    for attempt in range(max_retries):
+        try:
+            yield emitter.role()
+
+            tool_calls_emitted = False
+
+            if flight_key:
+                source = shared_events(flight_key, lambda: _event_source(packet))
             else:
-                # 最后一次重试失败，返回错误
-                error_chunk = {
-                    "id": completion_id,
-                    "object": "chat.completion.chunk",
-                    "created": created_ts,
-                    "model": model_id,
-                    "choices": [{"index": 0, "delta": {}, "finish_reason": "error"}],
-                    "error": {"message": f"连接失败: {str(e)}"}
-                }
-                try:
-                    logger.info("[OpenAI Compat] 转换后的 SSE(emit error): %s",
-                                json.dumps(error_chunk, ensure_ascii=False))
-                except Exception:
-                    pass
-                yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
-                return
+                source = _event_source(packet)
+            async for record in source:
+                if record.parts:
+                    last_delta_at = time.perf_counter()
+                    if first_delta_at is None:
+                        first_delta_at = last_delta_at
+                        TIME_TO_FIRST_DELTA_SECONDS.labels(model=model_id).observe(first_delta_at - started)
+                        trace = current_trace()
+                        if trace is not None:
+                            trace.record("first_delta", started, first_delta_at)
+                for part_kind, part in record.parts:
+                    if part_kind == PART_TOOL_CALL:
+                        call_id, name, args_obj = part
+                        try:
+                            args_str = json.dumps(args_obj or {}, ensure_ascii=False)
+                        except Exception:
+                            args_str = "{}"
+                        yield emitter.tool_call(call_id or str(uuid.uuid4()), name, args_str)
+                        tool_calls_emitted = True
+                    else:
+                        text_chars += len(part)
+                        yield emitter.content(part)
+
+                if record.finished:
+                    # 检查是否有错误
+                    if record.error is not None:
+                        logger.warning(f"[OpenAI Compat] Finished with internal error: {record.error}")
+
+                    yield emitter.finish("tool_calls" if tool_calls_emitted else "stop")
+
+            if first_delta_at is not None and last_delta_at > first_delta_at:
+                CHARS_PER_SECOND.labels(model=model_id).observe(text_chars / (last_delta_at - first_delta_at))
+                trace = current_trace()
+                if trace is not None:
+                    trace.record("last_delta", started, last_delta_at, chars=text_chars)
+
+            # 打印完成标记
+            logger.debug("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
+            yield DONE_BYTES
+            return
+
+        except (httpx.RemoteProtocolError, httpx.ReadTimeout, TimeoutError, httpx.ConnectTimeout) as e:
+            logger.warning(f"[OpenAI Compat] 连接错误 (attempt {attempt + 1}/{max_retries}): {e}")
+            STREAM_RETRIES.labels(cause=type(e).__name__).inc()
+            if attempt < max_retries - 1:
+                await asyncio.sleep(retry_delay * (attempt + 1))  # 指数退避
+                continue
+            # 最后一次重试失败，返回错误
+            yield emitter.error(f"连接失败: {str(e)}")
+            yield DONE_BYTES
+            return
 
         except Exception as e:
             logger.error(f"[OpenAI Compat] Stream processing failed: {e}")
-            error_chunk = {
-                "id": completion_id,
-                "object": "chat.completion.chunk",
-                "created": created_ts,
-                "model": model_id,
-                "choices": [{"index": 0, "delta": {}, "finish_reason": "error"}],
-                "error": {"message": str(e)},
-            }
-            try:
-                logger.info("[OpenAI Compat] 转换后的 SSE(emit error): %s", json.dumps(error_chunk, ensure_ascii=False))
-            except Exception:
-                pass
-            yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield emitter.error(str(e))
+            yield DONE_BYTES
             return
@@ -8,6 +8,7 @@ Warp Protobuf编解码服务器启动文件
 
 from typing import Dict, Optional, Tuple
 import base64
+import os
 from pathlib import Path
 from contextlib import asynccontextmanager
 
@@ -23,12 +24,13 @@ from typing import Any
 
 from warp2protobuf.api.protobuf_routes import app as protobuf_app
 from warp2protobuf.core.logging import logger, set_log_file
-from warp2protobuf.api.protobuf_routes import EncodeRequest, _encode_smd_inplace
-from warp2protobuf.core.protobuf_utils import dict_to_protobuf_bytes
-from warp2protobuf.core.schema_sanitizer import sanitize_mcp_input_schema_in_packet
+from warp2protobuf.api.protobuf_routes import EncodeRequest
+from warp2protobuf.core.packet_normalizer import normalize_request_packet
+from warp2protobuf.core.protobuf_utils import packet_to_protobuf_bytes
 from warp2protobuf.core.auth import acquire_anonymous_access_token
 from warp2protobuf.core.pool_auth import acquire_pool_or_anonymous_token, release_pool_session, get_current_account_info
 from warp2protobuf.config.models import get_all_unique_models
+from warp2protobuf.warp.upstream import close_upstream_clients
 
 
 # ============= 工具：input_schema 清理与校验 =============
@@ -205,6 +207,8 @@ async def lifespan(app: FastAPI):
     # 释放账号池会话
     await release_pool_session()
     logger.info("账号池会话已释放")
+    # 关闭共享的上游连接池
+    await close_upstream_clients()
 
 
 def create_app() -> FastAPI:
@@ -281,17 +285,12 @@ def create_app() -> FastAPI:
             if not actual_data:
                 raise HTTPException(400, "数据包不能为空")
 
-            # 在 encode 之前，对 mcp_context.tools[*].input_schema 做一次安全清理
+            # 单遍规范化：清理空值、编码 server_message_data、清洗 mcp_context.tools[*].input_schema
             if isinstance(actual_data, dict):
-                wrapped = {"json_data": actual_data}
-                wrapped = sanitize_mcp_input_schema_in_packet(wrapped)
-                actual_data = wrapped.get("json_data", actual_data)
-
-            # 将 server_message_data 对象（如有）编码为 Base64URL 字符串
-            actual_data = _encode_smd_inplace(actual_data)
+                actual_data = normalize_request_packet(actual_data)
 
             # 编码为protobuf字节
-            protobuf_bytes = dict_to_protobuf_bytes(actual_data, request.message_type)
+            protobuf_bytes = packet_to_protobuf_bytes(actual_data, request.message_type)
             logger.info(f"✅ AI请求编码为protobuf成功: {len(protobuf_bytes)} 字节")
 
             if output == "raw":
@@ -549,6 +548,7 @@ async def startup_tasks():
     logger.info("可用的API端点:")
     logger.info("  GET  /                   - 服务信息")
     logger.info("  GET  /healthz            - 健康检查")
+    logger.info("  GET  /metrics            - Prometheus 指标")
     logger.info("  GET  /gui                - Web GUI界面")
     logger.info("  POST /api/encode         - JSON -> Protobuf编码")
     logger.info("  POST /api/decode         - Protobuf -> JSON解码")
@@ -560,6 +560,9 @@ async def startup_tasks():
     logger.info(
         "  POST /api/warp/send_stream_sse - JSON -> Protobuf -> Warp API转发(实时SSE，事件已解析)"
     )
+    logger.info(
+        "  POST /api/warp/send_stream_frames - JSON -> Protobuf -> Warp API转发(长度前缀的原始protobuf帧)"
+    )
     logger.info("  POST /api/warp/graphql/* - GraphQL请求转发到Warp API（带鉴权）")
     logger.info("  GET  /api/schemas        - Protobuf schema信息")
     logger.info("  GET  /api/auth/status    - JWT认证状态")
@@ -582,7 +585,12 @@ def main():
     # 启动服务器
     import config
     try:
-        uvicorn.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT, log_level=config.LOG_LEVEL.lower(), access_log=True)
+        uds = os.getenv("WARP_BRIDGE_UDS") or config.SERVER_UDS
+        if uds:
+            logger.info(f"监听 Unix domain socket: {uds}")
+            uvicorn.run(app, uds=uds, log_level=config.LOG_LEVEL.lower(), access_log=True)
+        else:
+            uvicorn.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT, log_level=config.LOG_LEVEL.lower(), access_log=True)
     except KeyboardInterrupt:
         logger.info("服务器被用户停止")
     except Exception as e:
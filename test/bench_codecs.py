@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编解码与消息转换的 CPU 微基准（含回归阈值）
+
+对每个热点函数分别用 small / medium / large（500 条消息）负载计时，输出每次调用的耗时（µs），
+并与 test/bench_codecs_baseline.json 比较：任一项超过 基线 × --threshold 时以退出码 1 结束。
+比较的不是绝对耗时，而是“相对参考负载的耗时比”：每项计时时与一个与仓库代码无关的固定参考负载
+（标准库 json 往返 + 纯 Python 循环）逐轮交替计时，机器快慢与同一时段的负载波动同时作用于两边；
+超出阈值的项重新测量后再判定，换算成微秒的差值小于 --min-delta-us 的项视为噪声。
+
+用法:
+    python test/bench_codecs.py                    # 运行并与基线比较
+    python test/bench_codecs.py --only dict_to_protobuf_bytes --sizes large
+    python test/bench_codecs.py --update-baseline  # 在当前机器上重新生成基线
+
+基线与当前运行的 protobuf 后端（upb / cpp / python）不一致时只给出提示、不做比较。
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 基准期间压低日志，避免把日志 I/O 计入耗时
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+from google.protobuf.internal import api_implementation  # noqa: E402
+
+from protobuf2openai.compact import compact_messages  # noqa: E402
+from protobuf2openai.models import ChatMessage, OpenAITool  # noqa: E402
+from protobuf2openai.packets import build_request_packet, map_history_to_warp_messages  # noqa: E402
+from protobuf2openai.reorder import reorder_messages_for_anthropic  # noqa: E402
+from protobuf2openai.router import _merge_consecutive_messages  # noqa: E402
+from warp2protobuf.api.protobuf_routes import _decode_smd_inplace, _encode_smd_inplace  # noqa: E402
+from warp2protobuf.core.protobuf import ensure_proto_runtime  # noqa: E402
+from warp2protobuf.core.packet_normalizer import normalize_request_packet  # noqa: E402
+from warp2protobuf.core.protobuf_utils import dict_to_protobuf_bytes, encode_request_packet, protobuf_to_dict  # noqa: E402
+from warp2protobuf.core.schema_sanitizer import sanitize_mcp_input_schema_in_packet  # noqa: E402
+from warp2protobuf.core.server_message_data import decode_server_message_data, encode_server_message_data  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "test", "bench_codecs_baseline.json")
+REQUEST_TYPE = "warp.multi_agent.v1.Request"
+SIZES = {"small": 4, "medium": 40, "large": 500}
+TOOL_COUNTS = {"small": 1, "medium": 8, "large": 24}
+
+_PARAGRAPH = ("The quick brown fox jumps over the lazy dog while the build pipeline compiles "
+              "protobuf descriptors and streams server-sent events back to the client. ")
+
+
+# ---------------- 负载 ----------------
+
+def _tool(i: int) -> OpenAITool:
+    return OpenAITool(type="function", function={
+        "name": f"tool_{i}",
+        "description": f"Benchmark tool number {i}",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "File path"},
+                "limit": {"type": "integer"},
+                "options": {"type": "object", "properties": {"recursive": {"type": "boolean"}, "glob": {"type": ""}}},
+                "tags": {"type": "array", "items": {"type": "string"}},
+                "headers": {"type": "object", "properties": {}},
+                "empty": "",
+            },
+            "required": ["path", "missing"],
+        },
+    })
+
+
+def _history(n: int) -> List[ChatMessage]:
+    """system + 交替的 user / assistant，约每 5 条插入一次工具调用与结果，含连续同角色消息"""
+    messages = [ChatMessage(role="system", content="You are a benchmark assistant. " * 4)]
+    i = 0
+    while len(messages) < n:
+        messages.append(ChatMessage(role="user", content=[{"type": "text", "text": _PARAGRAPH * (1 + i % 3)}]))
+        if i % 5 == 4:
+            call_id = f"call_{i}"
+            messages.append(ChatMessage(role="assistant", content="", tool_calls=[{
+                "id": call_id, "type": "function",
+                "function": {"name": f"tool_{i % 4}", "arguments": json.dumps({"path": f"/tmp/{i}.txt", "limit": i})},
+            }]))
+            messages.append(ChatMessage(role="tool", tool_call_id=call_id, content=_PARAGRAPH))
+        else:
+            messages.append(ChatMessage(role="assistant", content=_PARAGRAPH * (1 + i % 2)))
+        if i % 7 == 6:
+            messages.append(ChatMessage(role="assistant", content="Follow-up from the same role."))
+        i += 1
+    messages = messages[:n]
+    if messages[-1].role != "user":
+        messages.append(ChatMessage(role="user", content="Continue."))
+    return messages
+
+
+def _with_smd(packet: Dict[str, Any]) -> Dict[str, Any]:
+    packet = copy.deepcopy(packet)
+    for task in packet.get("task_context", {}).get("tasks", []):
+        for j, message in enumerate(task.get("messages", [])):
+            message["server_message_data"] = {"uuid": f"00000000-0000-4000-8000-{j:012d}",
+                                              "seconds": 1760000000 + j, "nanos": 123456789}
+    return packet
+
+
+def build_payloads(size: str) -> Dict[str, Any]:
+    messages = _history(SIZES[size])
+    history = compact_messages(messages)
+    tools = [_tool(i) for i in range(TOOL_COUNTS[size])]
+    merged = _merge_consecutive_messages(history)
+    packet = build_request_packet(merged, "bench-task", "claude-4-sonnet", "bench-conversation",
+                                  "You are a benchmark assistant.", tools)
+    sanitized = sanitize_mcp_input_schema_in_packet({"json_data": packet})["json_data"]
+    smd_packet = _with_smd(sanitized)
+    smd_encoded = _encode_smd_inplace(smd_packet)
+    request_bytes = dict_to_protobuf_bytes(sanitized, REQUEST_TYPE)
+    smd_values = [encode_server_message_data(uuid=f"00000000-0000-4000-8000-{j:012d}", seconds=1760000000 + j,
+                                             nanos=j) for j in range(max(1, SIZES[size]))]
+    return {
+        "messages": messages, "history": history, "merged": merged, "packet": packet, "sanitized": sanitized,
+        "smd_packet": smd_packet, "smd_encoded": smd_encoded, "request_bytes": request_bytes,
+        "smd_values": smd_values,
+    }
+
+
+def benchmarks(p: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    history, merged, sanitized, smd_values = p["history"], p["merged"], p["sanitized"], p["smd_values"]
+    return {
+        "dict_to_protobuf_bytes": lambda: dict_to_protobuf_bytes(sanitized, REQUEST_TYPE),
+        "protobuf_to_dict": lambda: protobuf_to_dict(p["request_bytes"], REQUEST_TYPE),
+        "sanitize_mcp_input_schema_in_packet": lambda: sanitize_mcp_input_schema_in_packet({"json_data": p["packet"]}),
+        "normalize_request_packet": lambda: normalize_request_packet(p["smd_packet"]),
+        "encode_request_packet": lambda: encode_request_packet(p["smd_packet"]),
+        "_encode_smd_inplace": lambda: _encode_smd_inplace(p["smd_packet"]),
+        "_decode_smd_inplace": lambda: _decode_smd_inplace(p["smd_encoded"]),
+        "reorder_messages_for_anthropic": lambda: reorder_messages_for_anthropic(merged),
+        "compact_messages": lambda: compact_messages(p["messages"]),
+        "_merge_consecutive_messages": lambda: _merge_consecutive_messages(history),
+        "map_history_to_warp_messages": lambda: map_history_to_warp_messages(merged[:-1], "bench-task", None, False),
+        "encode_server_message_data": lambda: [
+            encode_server_message_data(uuid="00000000-0000-4000-8000-000000000001", seconds=1760000000 + j, nanos=j)
+            for j in range(len(smd_values))],
+        "decode_server_message_data": lambda: [decode_server_message_data(v) for v in smd_values],
+    }
+
+
+# ---------------- 计时 ----------------
+
+def _timed_loop(fn: Callable[[], Any], loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - start
+
+
+def _calibrate_loops(fn: Callable[[], Any], min_time: float) -> int:
+    """预热后标定循环次数，使单轮约 min_time 秒"""
+    fn()  # 预热（含首次的描述符/类缓存）
+    loops = 1
+    elapsed = _timed_loop(fn, loops)
+    while elapsed < min_time and loops < 1 << 20:
+        if elapsed < min_time / 10:
+            loops *= 10
+        else:
+            loops = max(loops + 1, int(loops * min_time * 1.1 / elapsed))
+        elapsed = _timed_loop(fn, loops)
+    return loops
+
+
+def time_call(fn: Callable[[], Any], min_time: float, repeat: int) -> float:
+    """返回每次调用的耗时（µs）：先标定循环次数使单轮约 min_time 秒，取 repeat 轮中的最小值"""
+    loops = _calibrate_loops(fn, min_time)
+    return min(_timed_loop(fn, loops) / loops for _ in range(repeat)) * 1e6
+
+
+_CALIBRATION_DOC = {"messages": [{"role": "user", "content": _PARAGRAPH, "n": i, "ok": i % 2 == 0} for i in range(40)]}
+
+
+def _calibration_workload() -> Any:
+    """固定的参考负载，只用标准库：衡量当前机器（及当前时段）的速度"""
+    doc = json.loads(json.dumps(_CALIBRATION_DOC))
+    return sum(len(m["content"]) + m["n"] for m in doc["messages"] if m["ok"]) + sum(i * i for i in range(2000))
+
+
+def time_relative(fn: Callable[[], Any], min_time: float, repeat: int) -> Tuple[float, float]:
+    """
+    返回 (每次调用的耗时 µs, 相对参考负载的耗时比)
+    被测函数与参考负载逐轮交替计时，各取最小值：同一时段的机器波动同时作用于两边，比值在不同机器、
+    不同负载下保持稳定
+    """
+    loops = _calibrate_loops(fn, min_time)
+    ref_loops = _calibrate_loops(_calibration_workload, min_time / 4)
+    best = best_ref = float("inf")
+    for _ in range(repeat):
+        best = min(best, _timed_loop(fn, loops) / loops)
+        best_ref = min(best_ref, _timed_loop(_calibration_workload, ref_loops) / ref_loops)
+    return best * 1e6, best / best_ref
+
+
+def backend_info() -> Dict[str, str]:
+    return {
+        "protobuf_backend": api_implementation.Type(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(relative: Dict[str, float], baseline: Dict[str, Any], threshold: float,
+            min_delta_us: float, results: Dict[str, float]) -> Tuple[List[str], List[str]]:
+    """按相对参考负载的耗时比比较；换算回微秒后的差值小于 min_delta_us 时视为噪声"""
+    regressions: List[str] = []
+    notes: List[str] = []
+    base_relative = baseline.get("relative", {})
+    for key, current in relative.items():
+        base = base_relative.get(key)
+        if base is None:
+            notes.append(f"{key}: 无基线")
+            continue
+        if current > base * threshold and results[key] * (1 - base / current) > min_delta_us:
+            regressions.append(f"{key}: 参考负载的 {current:.2f} 倍 > 基线 {base:.2f} 倍 × {threshold}"
+                               f"（{results[key]:.1f}µs）")
+    return regressions, notes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Codec / transform micro-benchmarks")
+    parser.add_argument("--sizes", default="small,medium,large")
+    parser.add_argument("--only", default="", help="逗号分隔的函数名子集")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮计时的最短时长（秒）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=1.5, help="超过 基线 × threshold 视为回归")
+    parser.add_argument("--min-delta-us", type=float, default=5.0, help="绝对差小于该值时忽略（排除微秒级噪声）")
+    parser.add_argument("--retries", type=int, default=2, help="超出阈值的项重新测量的次数")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json-out", default="")
+    args = parser.parse_args()
+
+    ensure_proto_runtime()
+    info = backend_info()
+    print(f"protobuf backend: {info['protobuf_backend']}  python: {info['python']}  machine: {info['machine']}")
+
+    only = {name.strip() for name in args.only.split(",") if name.strip()}
+    results: Dict[str, float] = {}
+    relative: Dict[str, float] = {}
+    fns: Dict[str, Callable[[], Any]] = {}
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        payloads = build_payloads(size)
+        print(f"\n[{size}] messages={len(payloads['history'])} request_bytes={len(payloads['request_bytes'])}")
+        for name, fn in benchmarks(payloads).items():
+            if only and name not in only:
+                continue
+            key = f"{name}/{size}"
+            us, ratio = time_relative(fn, args.min_time, args.repeat)
+            fns[key] = fn
+            results[key] = round(us, 2)
+            relative[key] = round(ratio, 4)
+            print(f"  {name:<38} {us:12.1f} µs  ×{ratio:8.3f} 参考负载")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({**info, "results": results, "relative": relative}, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**info, "results": results, "relative": relative}, f, ensure_ascii=False, indent=2,
+                      sort_keys=True)
+            f.write("\n")
+        print(f"\n基线已写入 {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\n未找到基线 {args.baseline}，使用 --update-baseline 生成")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("protobuf_backend") != info["protobuf_backend"]:
+        print(f"\n基线使用 {baseline.get('protobuf_backend')} 后端，当前为 {info['protobuf_backend']}，跳过比较")
+        return 0
+    if "relative" not in baseline:
+        print("\n基线没有相对耗时（旧格式），使用 --update-baseline 重新生成")
+        return 0
+
+    regressions, notes = compare(relative, baseline, args.threshold, args.min_delta_us, results)
+    # 超出阈值的项重新测量（最多 --retries 次，取最好的一次），排除短时的机器抖动
+    for _ in range(args.retries):
+        if not regressions:
+            break
+        suspects = [line.split(":", 1)[0] for line in regressions]
+        print(f"\n重新测量 {len(suspects)} 项: {', '.join(suspects)}")
+        for key in suspects:
+            us, ratio = time_relative(fns[key], args.min_time, args.repeat)
+            if ratio < relative[key]:
+                results[key], relative[key] = round(us, 2), round(ratio, 4)
+        regressions, notes = compare(relative, baseline, args.threshold, args.min_delta_us, results)
+
+    for note in notes:
+        print(f"  注意: {note}")
+    if regressions:
+        print("\n性能回归:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n全部 {len(results)} 项在基线 × {args.threshold} 以内")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/v1/chat/completions 请求体摄取基准：快速模式 vs pydantic 模式
+
+对不同大小（默认 0.1 / 1 / 5 MB）的请求体分别计时，每次调用包含“解码 + 校验 + 转换为 CompactMessage
++ 计算缓存键”，即路由在开始任何上游工作之前的全部摄取开销：
+    pydantic      WARP_FAST_INGEST=0：json 解码、ChatCompletionsRequest 校验、规范化 JSON 摘要
+    fast          WARP_FAST_INGEST=1：orjson 解码、逐条类型检查直接构造 CompactMessage、原始字节摘要
+    fast(json)    同 fast，但不使用 orjson（未安装 orjson 时的表现）
+
+用法:
+    python test/bench_ingest.py
+    python test/bench_ingest.py --sizes-mb 1,5,10 --json-out ingest.json
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "test"))
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+from bench_codecs import _history, _tool, time_call  # noqa: E402
+
+import protobuf2openai.ingest as ingest  # noqa: E402
+from protobuf2openai.helpers import model_json  # noqa: E402
+
+
+def build_body(target_bytes: int) -> bytes:
+    """bench_codecs 的混合对话（含工具调用与结果）加 24 个工具，消息数增长到请求体达到目标大小"""
+    tools = [json.loads(model_json(_tool(i))) for i in range(24)]
+    n = 64
+    while True:
+        messages = [json.loads(model_json(m)) for m in _history(n)]
+        body = json.dumps({"model": "claude-4-sonnet", "stream": True, "messages": messages, "tools": tools},
+                          ensure_ascii=False).encode("utf-8")
+        if len(body) >= target_bytes:
+            return body
+        n = max(n + 1, int(n * target_bytes / len(body) * 1.02))
+
+
+def _with_stdlib_json(fn: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        saved, ingest.orjson = ingest.orjson, None
+        try:
+            return fn()
+        finally:
+            ingest.orjson = saved
+    return run
+
+
+def paths(body: bytes) -> Dict[str, Callable[[], Any]]:
+    result = {
+        "pydantic": lambda: ingest.parse_chat_request(body, fast=False).key,
+        "fast": lambda: ingest.parse_chat_request(body, fast=True).key,
+    }
+    if ingest.orjson is not None:
+        result["fast(json)"] = _with_stdlib_json(result["fast"])
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Chat completion request ingestion benchmark")
+    parser.add_argument("--sizes-mb", default="0.1,1,5", help="逗号分隔的请求体大小（MB）")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每轮计时的最短时长（秒）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json-out", default="")
+    args = parser.parse_args()
+
+    print(f"orjson: {'可用' if ingest.orjson is not None else '未安装'}")
+    results: Dict[str, Dict[str, float]] = {}
+    for size_mb in [float(s) for s in args.sizes_mb.split(",") if s.strip()]:
+        body = build_body(int(size_mb * 1024 * 1024))
+        messages = len(ingest.parse_chat_request(body).messages)
+        label = f"{size_mb:g}MB"
+        print(f"\n[{label}] body={len(body)} bytes messages={messages}")
+        row: Dict[str, float] = {}
+        for name, fn in paths(body).items():
+            ms = time_call(fn, args.min_time, args.repeat) / 1000
+            row[name] = round(ms, 3)
+            speedup = f"  ×{row['pydantic'] / ms:.1f}" if name != "pydantic" else ""
+            print(f"  {name:<12} {ms:10.2f} ms  {len(body) / 1024 / 1024 / (ms / 1000):8.1f} MB/s{speedup}")
+        results[label] = row
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"orjson": ingest.orjson is not None, "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+直接构建 protobuf 请求（proto_builder）的等价性检查
+
+对若干混合历史（多段用户内容、并行工具调用、多段工具结果、空内容、以 assistant / tool 结尾等），
+固定 uuid4 序列后比较：
+    1. build_request_bytes 关闭与开启历史增量编码缓存（HISTORY_ENCODE_CACHE，手工拼接 task_context）
+       的输出逐字节一致，缓存命中（同一历史第二次构建）与更换 task_id 后仍一致
+    2. build_request_bytes 与 dict 路径 encode_request_packet(build_request_packet(...)) 解析后的消息相等
+       （tools 存在时覆盖 mcp_context 末尾拼接），以及 MCP_CONTEXT_CACHE 未命中与命中的输出逐字节一致
+任一不一致时打印差异并以退出码 1 结束。
+
+用法:
+    python test/check_builder_equivalence.py
+"""
+import difflib
+import itertools
+import json
+import os
+import sys
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "test"))
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+from bench_codecs import _history, _tool  # noqa: E402
+
+import protobuf2openai.proto_builder as proto_builder  # noqa: E402
+from protobuf2openai.block_cache import MCP_CONTEXT_CACHE  # noqa: E402
+from protobuf2openai.compact import CompactMessage, compact_messages  # noqa: E402
+from protobuf2openai.encode_cache import HISTORY_ENCODE_CACHE  # noqa: E402
+from protobuf2openai.models import ChatMessage as M  # noqa: E402
+from protobuf2openai.models import OpenAITool  # noqa: E402
+from protobuf2openai.packets import build_request_packet  # noqa: E402
+from protobuf2openai.reorder import reorder_messages_for_anthropic  # noqa: E402
+from protobuf2openai.router import _merge_consecutive_messages  # noqa: E402
+from protobuf2openai.state import ensure_tool_ids  # noqa: E402
+from warp2protobuf.core.protobuf import ensure_proto_runtime, msg_cls  # noqa: E402
+from warp2protobuf.core.protobuf_utils import encode_request_packet, protobuf_to_dict  # noqa: E402
+
+REQUEST_TYPE = "warp.multi_agent.v1.Request"
+_real_uuid4 = uuid.uuid4
+
+
+def _deterministic_uuid4() -> None:
+    counter = itertools.count(1)
+    uuid.uuid4 = lambda: uuid.UUID(int=next(counter))
+
+
+def _edge_history() -> List[M]:
+    call = lambda i, args: {"id": f"call_{i}", "type": "function",  # noqa: E731
+                            "function": {"name": f"tool_{i}", "arguments": args}}
+    return [
+        M(role="system", content=[{"type": "text", "text": "  system prompt  "}]),
+        M(role="user", content=[{"type": "text", "text": "look at"}, {"type": "image_url", "image_url": {"url": "x"}},
+                                {"type": "text", "text": " this"}]),
+        M(role="assistant", content="checking", tool_calls=[call(1, json.dumps({"path": "/a", "n": [1, 2]})),
+                                                             call(2, {"nested": {"k": None, "b": True}})]),
+        M(role="tool", tool_call_id="call_2", content=[{"type": "text", "text": " r2 "}, {"type": "text", "text": ""},
+                                                       {"type": "text", "text": "r2b"}]),
+        M(role="tool", tool_call_id="call_1", content="r1"),
+        M(role="assistant", content=None, tool_calls=[{"type": "function", "function": {"name": "no_id", "arguments": "{}"}}]),
+        M(role="tool", tool_call_id="", content="orphan result"),
+        M(role="user", content=""),
+        M(role="assistant", content="   "),
+        M(role="user", content="ünïcödé ✓ question"),
+    ]
+
+
+def _histories() -> Dict[str, List[CompactMessage]]:
+    edge = _edge_history()
+    raw = {
+        "edge": edge,
+        "edge_ends_with_tool": edge[:5],
+        "edge_ends_with_assistant": edge[:3],
+        "bench_60": _history(60),
+        "bench_60_plus_edge": _history(60) + edge,
+        "single_user": [M(role="user", content="hi")],
+        "system_only": [M(role="system", content="only system")],
+    }
+    return {name: reorder_messages_for_anthropic(_merge_consecutive_messages(compact_messages(msgs)))
+            for name, msgs in raw.items()}
+
+
+def _build_bytes(history: List[CompactMessage], task_id: str, tools: Optional[List[OpenAITool]],
+                 cache_bytes: int) -> bytes:
+    HISTORY_ENCODE_CACHE.max_bytes = cache_bytes
+    _deterministic_uuid4()
+    return proto_builder.build_request_bytes(history, task_id, "claude-4-sonnet", "conv-1", "system text", tools)
+
+
+def _build_dict_path(history: List[CompactMessage], task_id: str, tools: Optional[List[OpenAITool]]) -> bytes:
+    _deterministic_uuid4()
+    packet = build_request_packet(history, task_id, "claude-4-sonnet", "conv-1", "system text", tools)
+    return encode_request_packet(packet)
+
+
+def _parse(data: bytes) -> Any:
+    message = msg_cls(REQUEST_TYPE)()
+    message.ParseFromString(data)
+    return message
+
+
+def _diff(a: bytes, b: bytes) -> str:
+    da = json.dumps(protobuf_to_dict(a, REQUEST_TYPE), sort_keys=True, indent=1).splitlines()
+    db = json.dumps(protobuf_to_dict(b, REQUEST_TYPE), sort_keys=True, indent=1).splitlines()
+    return "\n".join(list(difflib.unified_diff(da, db, "expected", "actual", lineterm="", n=1))[:30])
+
+
+def run() -> int:
+    ensure_proto_runtime()
+    ensure_tool_ids()  # 首次调用会消耗 uuid4，先初始化以免两条路径的 uuid 序列错位
+    failures = 0
+    tool_sets: Dict[str, Optional[List[OpenAITool]]] = {"no_tools": None, "tools": [_tool(i) for i in range(3)]}
+    checks: List[Tuple[str, Callable[[], Tuple[bytes, bytes]], bool]] = []
+
+    for name, history in _histories().items():
+        for tools_name, tools in tool_sets.items():
+            for task_id in ("task-1", "", "  padded-task  "):
+                label = f"{name}/{tools_name}/task={task_id!r}"
+
+                def uncached_vs_cached(h=history, t=task_id, ts=tools):
+                    HISTORY_ENCODE_CACHE.clear()
+                    return _build_bytes(h, t, ts, 0), _build_bytes(h, t, ts, 64 << 20)
+
+                def uncached_vs_cache_hit(h=history, t=task_id, ts=tools):
+                    _build_bytes(h, "other-task", ts, 64 << 20)  # 先以另一个 task_id 填充缓存
+                    return _build_bytes(h, t, ts, 0), _build_bytes(h, t, ts, 64 << 20)
+
+                def builder_vs_dict_path(h=history, t=task_id, ts=tools):
+                    MCP_CONTEXT_CACHE.clear()
+                    return _build_dict_path(h, t, ts), _build_bytes(h, t, ts, 64 << 20)
+
+                def mcp_miss_vs_hit(h=history, t=task_id, ts=tools):
+                    MCP_CONTEXT_CACHE.clear()
+                    return _build_bytes(h, t, ts, 64 << 20), _build_bytes(h, t, ts, 64 << 20)
+
+                checks.append((f"{label} cache off == cache on", uncached_vs_cached, True))
+                checks.append((f"{label} cache off == cache hit", uncached_vs_cache_hit, True))
+                checks.append((f"{label} builder == dict path", builder_vs_dict_path, False))
+                if tools:
+                    checks.append((f"{label} mcp_context miss == hit", mcp_miss_vs_hit, True))
+
+    for label, check, byte_exact in checks:
+        expected, actual = check()
+        ok = expected == actual if byte_exact else _parse(expected) == _parse(actual)
+        if not ok:
+            failures += 1
+            print(f"✗ {label}\n{_diff(expected, actual)}")
+
+    uuid.uuid4 = _real_uuid4
+    print(f"{len(checks) - failures}/{len(checks)} 项一致")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
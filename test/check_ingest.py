@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求体摄取（ingest）的大小上限与 422 回退检查
+
+脚本把 WARP_REQUEST_MAX_BYTES 设为 4096（环境变量已设置时沿用），检查：
+    1. read_request_body：Content-Length 超过上限时直接 413，不读取请求体；没有 Content-Length 的分块请求体
+       在累计超过上限时 413，不再继续读取；恰好等于上限的请求体正常读入
+    2. parse_chat_request：非法 JSON 在快速模式与兼容模式下都抛出 loc 为 ("body", 0) 的 json_invalid；
+       类型不符合预期的请求交给 pydantic：无法转换时错误的 loc 以 "body" 开头，可宽松转换时两种模式结果相同
+    3. 类型规整的请求在快速模式与兼容模式下得到相同的 model / stream / tools / 消息
+    4. 经 ASGI 调用 /v1/chat/completions：超大请求体（声明或分块）返回 413，非法 JSON 与类型错误返回 422
+任一检查失败时打印原因并以退出码 1 结束。
+
+用法:
+    python test/check_ingest.py
+"""
+import asyncio
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+os.environ.setdefault("WARP_REQUEST_MAX_BYTES", "4096")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI, HTTPException, Request  # noqa: E402
+from fastapi.exceptions import RequestValidationError  # noqa: E402
+
+from protobuf2openai.config import REQUEST_MAX_BYTES  # noqa: E402
+from protobuf2openai.ingest import IngestedRequest, parse_chat_request, read_request_body  # noqa: E402
+from protobuf2openai.router import router  # noqa: E402
+
+
+def _request(chunks: List[bytes], content_length: Optional[int] = None) -> tuple:
+    """返回 (Request, 已被读取的块数列表)"""
+    consumed = [0]
+
+    async def receive():
+        if consumed[0] >= len(chunks):
+            return {"type": "http.disconnect"}
+        consumed[0] += 1
+        return {"type": "http.request", "body": chunks[consumed[0] - 1], "more_body": consumed[0] < len(chunks)}
+
+    headers = [(b"content-type", b"application/json")]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    scope = {"type": "http", "method": "POST", "path": "/v1/chat/completions", "query_string": b"", "headers": headers}
+    return Request(scope, receive), consumed
+
+
+async def _read_status(chunks: List[bytes], content_length: Optional[int] = None) -> tuple:
+    """返回 (状态码或读到的字节数, 已被读取的块数)"""
+    request, consumed = _request(chunks, content_length)
+    try:
+        body = await read_request_body(request, REQUEST_MAX_BYTES)
+    except HTTPException as e:
+        return e.status_code, consumed[0]
+    return len(body), consumed[0]
+
+
+def _parse(body: bytes, fast: bool) -> Any:
+    """返回 IngestedRequest 或 RequestValidationError"""
+    try:
+        return parse_chat_request(body, fast=fast)
+    except RequestValidationError as e:
+        return e
+
+
+def _view(req: IngestedRequest) -> tuple:
+    tools = [t.model_dump() if hasattr(t, "model_dump") else t.dict() for t in req.tools or []]
+    messages = [(m.role, m.segments, m.text, m.tool_calls, m.tool_call_id, m.name) for m in req.messages]
+    return req.model, req.stream, tools, req.tool_choice, messages
+
+
+def _encode(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+_WELL_TYPED = {
+    "model": "claude-4-sonnet",
+    "stream": True,
+    "messages": [
+        {"role": "system", "content": "system prompt"},
+        {"role": "user", "content": [{"type": "text", "text": "看看"}, {"type": "image_url", "image_url": {"url": "x"}}]},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "read", "arguments": "{\"path\": \"/a\"}"}}]},
+        {"role": "tool", "tool_call_id": "call_1", "content": "file body"},
+        {"role": "user", "content": "继续"},
+    ],
+    "tools": [{"type": "function", "function": {"name": "read", "description": "read a file",
+                                                "parameters": {"type": "object", "properties": {"path": {"type": "string"}}}}}],
+    "tool_choice": "auto",
+}
+
+
+async def _asgi_statuses() -> Dict[str, int]:
+    app = FastAPI()
+    app.include_router(router)
+    big = b"x" * (REQUEST_MAX_BYTES + 1)
+
+    async def chunked() -> AsyncIterator[bytes]:
+        for _ in range(8):
+            yield b"y" * (REQUEST_MAX_BYTES // 4)
+
+    statuses: Dict[str, int] = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check") as client:
+        url = "/v1/chat/completions"
+        statuses["超大请求体（Content-Length）"] = (await client.post(url, content=big)).status_code
+        statuses["超大请求体（分块，无 Content-Length）"] = (await client.post(url, content=chunked())).status_code
+        statuses["非法 JSON"] = (await client.post(url, content=b"{not json")).status_code
+        statuses["类型错误"] = (await client.post(url, json={"messages": "not a list"})).status_code
+    return statuses
+
+
+def run() -> int:
+    failures: List[str] = []
+
+    def expect(ok: bool, message: str) -> None:
+        print(f"{'✓' if ok else '✗'} {message}")
+        if not ok:
+            failures.append(message)
+
+    limit = REQUEST_MAX_BYTES
+    status, consumed = asyncio.run(_read_status([b"x" * (limit + 1)], content_length=limit + 1))
+    expect(status == 413 and consumed == 0, f"Content-Length 超过上限 {limit}: {status}，读取了 {consumed} 块")
+    chunks = [b"x" * (limit // 4)] * 16
+    status, consumed = asyncio.run(_read_status(chunks))
+    expect(status == 413 and consumed < len(chunks), f"分块请求体超过上限: {status}，读取了 {consumed}/{len(chunks)} 块")
+    status, _ = asyncio.run(_read_status([b"x" * (limit // 2)] * 2, content_length=limit))
+    expect(status == limit, f"恰好等于上限的请求体正常读入: {status} 字节")
+
+    for fast in (True, False):
+        mode = "快速" if fast else "兼容"
+        for body in (b"{not json", b"", b"[1, 2"):
+            err = _parse(body, fast)
+            ok = isinstance(err, RequestValidationError) and [(e["type"], tuple(e["loc"])) for e in err.errors()] == [
+                ("json_invalid", ("body", 0))]
+            expect(ok, f"{mode}模式: 非法 JSON {body!r} -> json_invalid @ ('body', 0)")
+
+        err = _parse(_encode({"model": "m", "messages": [{"role": "user", "content": 42}, "not a message"]}), fast)
+        locs = [tuple(e["loc"]) for e in err.errors()] if isinstance(err, RequestValidationError) else []
+        expect(bool(locs) and all(loc[:2] == ("body", "messages") for loc in locs),
+               f"{mode}模式: 无法转换的类型 -> 422，loc {locs[:2]}{' …' if len(locs) > 2 else ''}")
+
+    lenient = _encode({"model": "m", "stream": "true", "messages": [{"role": "user", "content": "hi"}]})
+    fast_req, compat_req = _parse(lenient, True), _parse(lenient, False)
+    expect(isinstance(fast_req, IngestedRequest) and isinstance(compat_req, IngestedRequest)
+           and _view(fast_req) == _view(compat_req) and fast_req.stream is True,
+           "可宽松转换的类型（stream: \"true\"）交给 pydantic，两种模式结果相同")
+
+    body = _encode(_WELL_TYPED)
+    fast_req, compat_req = _parse(body, True), _parse(body, False)
+    expect(isinstance(fast_req, IngestedRequest) and isinstance(compat_req, IngestedRequest)
+           and _view(fast_req) == _view(compat_req) and fast_req._parsed is None,
+           "类型规整的请求走快速路径，与兼容模式得到相同的 model / stream / tools / 消息")
+
+    statuses = asyncio.run(_asgi_statuses())
+    for name, expected in (("超大请求体（Content-Length）", 413), ("超大请求体（分块，无 Content-Length）", 413),
+                           ("非法 JSON", 422), ("类型错误", 422)):
+        expect(statuses[name] == expected, f"ASGI {name}: {statuses[name]}（期望 {expected}）")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
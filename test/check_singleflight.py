@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+single-flight 合并（singleflight.shared_events）的分发与取消检查
+
+上游事件源为脚本内的异步生成器，记录被创建的次数、产出的事件数以及是否已关闭：
+    1. 同时到达的多个订阅者收到相同的事件序列，上游只开启一次
+    2. 一个订阅者中途断开，其余订阅者照常收完，上游不被取消
+    3. 所有订阅者都断开后上游读取被取消（生成器被关闭），键从进行中的表里移除
+    4. 上游出错时每个订阅者都收到同一个错误
+    5. 有多个订阅者时，读得太慢的订阅者积压超过 WARP_SINGLE_FLIGHT_BUFFER 后收到 SubscriberLagged，其余订阅者照常收完
+    6. 只有一个读得慢的订阅者时改为背压：收到全部事件，上游领先的事件数不超过缓冲上限
+任一检查失败时打印原因并以退出码 1 结束。
+
+用法:
+    python test/check_singleflight.py
+"""
+import asyncio
+import os
+import sys
+from typing import AsyncIterator, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+import protobuf2openai.singleflight as sf  # noqa: E402
+from warp2protobuf.core.event_record import EVENT_CLIENT_ACTIONS, PART_TEXT, ResponseEventRecord  # noqa: E402
+
+_BUFFER = 4
+
+
+class FakeUpstream:
+    """可计数的上游事件源；count 为 None 时不结束，fail_after 不为空时产出这么多事件后抛出 RuntimeError"""
+
+    def __init__(self, count: Optional[int] = 20, fail_after: Optional[int] = None, delay: float = 0.0):
+        self.count = count
+        self.fail_after = fail_after
+        self.delay = delay
+        self.opened = 0
+        self.produced = 0
+        self.closed = False
+        self.finished = False
+
+    def __call__(self) -> AsyncIterator[ResponseEventRecord]:
+        self.opened += 1
+        return self._gen()
+
+    async def _gen(self) -> AsyncIterator[ResponseEventRecord]:
+        try:
+            i = 0
+            while self.count is None or i < self.count:
+                if self.fail_after is not None and i == self.fail_after:
+                    raise RuntimeError("upstream failed")
+                record = ResponseEventRecord(EVENT_CLIENT_ACTIONS)
+                record.parts.append((PART_TEXT, f"e{i}"))
+                self.produced += 1
+                yield record
+                i += 1
+                await asyncio.sleep(self.delay)
+            self.finished = True
+        finally:
+            self.closed = True
+
+
+def _text(record: ResponseEventRecord) -> str:
+    return record.parts[0][1]
+
+
+async def consume(key: str, upstream: FakeUpstream, stop_after: Optional[int] = None,
+                  pause_after: Optional[int] = None, pause: float = 0.0, per_item: float = 0.0) -> tuple:
+    """返回 (收到的文本列表, 异常或 None)；stop_after 条后主动断开，pause_after 条后停顿 pause 秒"""
+    got: List[str] = []
+    events = sf.shared_events(key, upstream)
+    try:
+        async for record in events:
+            got.append(_text(record))
+            if stop_after is not None and len(got) >= stop_after:
+                break
+            if pause_after is not None and len(got) == pause_after:
+                await asyncio.sleep(pause)
+            if per_item:
+                await asyncio.sleep(per_item)
+    except Exception as e:
+        return got, e
+    finally:
+        await events.aclose()
+    return got, None
+
+
+async def run_checks() -> List[str]:
+    failures: List[str] = []
+
+    def expect(ok: bool, message: str) -> None:
+        print(f"{'✓' if ok else '✗'} {message}")
+        if not ok:
+            failures.append(message)
+
+    expected = [f"e{i}" for i in range(20)]
+
+    upstream = FakeUpstream()
+    results = await asyncio.gather(*(consume("fan-out", upstream) for _ in range(5)))
+    expect(upstream.opened == 1 and all(r == (expected, None) for r in results),
+           f"5 个订阅者收到相同的 {len(expected)} 个事件，上游开启 {upstream.opened} 次")
+
+    upstream = FakeUpstream(delay=0.001)
+    results = await asyncio.gather(consume("one-leaves", upstream, stop_after=3),
+                                   consume("one-leaves", upstream), consume("one-leaves", upstream))
+    expect(results[0][0] == expected[:3] and all(r == (expected, None) for r in results[1:]) and upstream.finished,
+           "一个订阅者中途断开，其余订阅者收完全部事件，上游正常结束")
+
+    upstream = FakeUpstream(count=None, delay=0.001)
+    await asyncio.gather(consume("all-leave", upstream, stop_after=2), consume("all-leave", upstream, stop_after=5))
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+        if upstream.closed:
+            break
+    produced = upstream.produced
+    await asyncio.sleep(0.05)
+    expect(upstream.closed and not upstream.finished and upstream.produced == produced
+           and "all-leave" not in sf._STREAM_FLIGHTS,
+           f"所有订阅者断开后上游被取消（共产出 {upstream.produced} 个事件）")
+
+    upstream = FakeUpstream(fail_after=3)
+    results = await asyncio.gather(*(consume("error", upstream) for _ in range(3)))
+    expect(all(got == expected[:3] and isinstance(e, RuntimeError) and str(e) == "upstream failed" for got, e in results),
+           "上游出错时每个订阅者收到已产出的事件和同一个错误")
+
+    upstream = FakeUpstream(count=50)
+    (fast, fast_err), (slow, slow_err) = await asyncio.gather(
+        consume("lagging", upstream), consume("lagging", upstream, pause_after=1, pause=0.2))
+    expected = [f"e{i}" for i in range(50)]
+    expect(fast == expected and fast_err is None and isinstance(slow_err, sf.SubscriberLagged) and len(slow) < 50,
+           f"积压超过 {_BUFFER} 的订阅者被移出（{type(slow_err).__name__}，收到 {len(slow)} 个），其余订阅者收完")
+
+    upstream = FakeUpstream(count=30)
+    lead: List[int] = []
+
+    async def slow_reader() -> tuple:
+        got: List[str] = []
+        async for record in sf.shared_events("lone", upstream):
+            got.append(_text(record))
+            lead.append(upstream.produced - len(got))
+            await asyncio.sleep(0.002)
+        return got
+
+    got = await slow_reader()
+    expected = [f"e{i}" for i in range(30)]
+    expect(got == expected and max(lead) <= _BUFFER + 1,
+           f"唯一的慢订阅者收到全部事件（背压），上游最多领先 {max(lead)} 个事件")
+    return failures
+
+
+def main() -> int:
+    sf.SINGLE_FLIGHT_ENABLED = True
+    sf.SINGLE_FLIGHT_BUFFER = _BUFFER
+    failures = asyncio.run(run_checks())
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量 SSE / 帧解码的切分边界检查
+
+用固定随机种子生成事件流，按随机位置（含逐字节）切成字节块送入解码器，检查结果与整流一次送入时相同：
+    1. SSEDecoder + PayloadDecoder：hex / 标准 base64 / base64url（有无填充）、多行 data、CRLF、注释与
+       event:/id: 字段；末尾 data: [DONE] 有无换行均能识别，[DONE] 之后的数据被忽略
+    2. 同一个流中先出现标准 base64、后出现 base64url 的负载（字母表不能按流只判断一次）
+    3. FrameDecoder：事件 / 错误 / 结束帧
+    4. sse_transform._iter_sse_events（经 iter_sse_data）：bridge 的 JSON SSE 流以没有换行符的 [DONE] 结束时，
+       之前的事件全部产出
+任一检查失败时打印原因并以退出码 1 结束。
+
+用法:
+    python test/check_sse_decoding.py
+    python test/check_sse_decoding.py --seed 7 --rounds 200
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+from typing import AsyncIterator, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+from protobuf2openai.sse_transform import _iter_sse_events  # noqa: E402
+from warp2protobuf.core.framing import FRAME_DONE, FRAME_ERROR, FRAME_EVENT, FrameDecoder, encode_frame  # noqa: E402
+from warp2protobuf.core.sse_decoder import SSEDecoder, iter_sse_data, iter_sse_event_bytes  # noqa: E402
+
+_ENCODINGS = {
+    "hex": lambda b: b.hex().encode(),
+    "base64": base64.b64encode,
+    "base64-nopad": lambda b: base64.b64encode(b).rstrip(b"="),
+    "base64url": lambda b: base64.urlsafe_b64encode(b).rstrip(b"="),
+    "base64url-pad": base64.urlsafe_b64encode,
+}
+
+
+def split_randomly(rng: random.Random, data: bytes) -> List[bytes]:
+    """随机切分；约 1/4 的概率逐字节切分"""
+    if len(data) < 2:
+        return [data]
+    if rng.random() < 0.25:
+        return [data[i:i + 1] for i in range(len(data))]
+    cuts = sorted(rng.sample(range(1, len(data)), rng.randrange(0, min(len(data) - 1, 200))))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+async def _aiter(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(gen: AsyncIterator) -> list:
+    return [item async for item in gen]
+
+
+def _sse_stream(rng: random.Random, payloads: List[bytes], nl: bytes, trailing_newline: bool) -> bytes:
+    """payloads 各成一个事件，随机混入注释、event:/id: 字段与多行 data"""
+    parts: List[bytes] = []
+    for payload in payloads:
+        if rng.random() < 0.2:
+            parts.append(b": keep-alive" + nl)
+        if rng.random() < 0.5:
+            parts.append(b"event: message" + nl + b"id: " + str(rng.randrange(1000)).encode() + nl)
+        if len(payload) > 8 and rng.random() < 0.3:
+            cut = rng.randrange(1, len(payload))
+            parts.append(b"data: " + payload[:cut] + nl + b"data:" + payload[cut:] + nl + nl)
+        else:
+            parts.append(b"data: " + payload + nl + nl)
+    parts.append(b"data: [DONE]" + (nl + nl if trailing_newline else b""))
+    return b"".join(parts)
+
+
+def check_sse(rng: random.Random, rounds: int) -> List[str]:
+    failures: List[str] = []
+    for i in range(rounds):
+        encoding = rng.choice(list(_ENCODINGS))
+        raw = [bytes(rng.randrange(256) for _ in range(rng.randrange(1, 120))) for _ in range(rng.randrange(1, 30))]
+        nl = rng.choice((b"\n", b"\r\n"))
+        crlf = nl == b"\r\n"
+        trailing = rng.random() < 0.5
+        stream = _sse_stream(rng, [_ENCODINGS[encoding](b) for b in raw], nl, trailing)
+        if trailing and rng.random() < 0.3:
+            stream += b"data: " + _ENCODINGS[encoding](b"after done") + nl + nl
+        chunks = split_randomly(rng, stream)
+        got = asyncio.run(_collect(iter_sse_event_bytes(_aiter(chunks))))
+        if got != raw:
+            failures.append(f"sse round {i} ({encoding}, crlf={crlf}, trailing_newline={trailing}, "
+                            f"chunks={len(chunks)}): {len(got)}/{len(raw)} 个事件一致")
+        decoder = SSEDecoder()
+        asyncio.run(_collect(iter_sse_data(_aiter(chunks), decoder)))
+        if not decoder.done:
+            failures.append(f"sse round {i}: 未识别结尾的 [DONE]（trailing_newline={trailing}）")
+    return failures
+
+
+def check_mixed_alphabet() -> List[str]:
+    values = [bytes([0xfb, 0xff, 0xbf]) * 5, bytes([0xfb, 0xff]) * 7, b"\x00\x01", bytes(range(256))]
+    payloads = [base64.b64encode(values[0]), base64.urlsafe_b64encode(values[0]).rstrip(b"="),
+                base64.urlsafe_b64encode(values[1]), base64.b64encode(values[2]).rstrip(b"="),
+                base64.urlsafe_b64encode(values[3]).rstrip(b"=")]
+    stream = b"".join(b"data: " + p + b"\n\n" for p in payloads)
+    got = asyncio.run(_collect(iter_sse_event_bytes(_aiter([stream]))))
+    expected = [values[0], values[0], values[1], values[2], values[3]]
+    return [] if got == expected else [f"mixed alphabet: {got!r} != {expected!r}"]
+
+
+def check_frames(rng: random.Random, rounds: int) -> List[str]:
+    failures: List[str] = []
+    for i in range(rounds):
+        frames = [(FRAME_EVENT, bytes(rng.randrange(256) for _ in range(rng.randrange(0, 300))))
+                  for _ in range(rng.randrange(0, 40))]
+        frames.append(rng.choice([(FRAME_DONE, b""), (FRAME_ERROR, "上游错误".encode("utf-8"))]))
+        chunks = split_randomly(rng, b"".join(encode_frame(kind, payload) for kind, payload in frames))
+        decoder = FrameDecoder()
+        got = [frame for chunk in chunks for frame in decoder.feed(chunk)]
+        if got != frames or decoder.pending:
+            failures.append(f"frames round {i} (chunks={len(chunks)}): {len(got)}/{len(frames)} 帧一致，"
+                            f"剩余 {decoder.pending} 字节")
+    return failures
+
+
+class _FakeResponse:
+    def __init__(self, chunks: List[bytes]):
+        self._chunks = chunks
+
+    def aiter_bytes(self) -> AsyncIterator[bytes]:
+        return _aiter(self._chunks)
+
+
+def check_bridge_sse(rng: random.Random, rounds: int) -> List[str]:
+    failures: List[str] = []
+    texts = [f"片段 {i} " for i in range(12)]
+    events = [{"parsed_data": {"client_actions": {"actions": [
+        {"append_to_message_content": {"message": {"agent_output": {"text": t}}}}]}}} for t in texts]
+    for i in range(rounds):
+        stream = b"".join(b"data: " + json.dumps(e, ensure_ascii=False).encode("utf-8") + b"\n\n" for e in events)
+        stream += b"data: [DONE]"  # 结束标记后没有换行符，流直接结束
+        records = asyncio.run(_collect(_iter_sse_events(_FakeResponse(split_randomly(rng, stream)))))
+        got = [r.text for r in records]
+        if got != texts:
+            failures.append(f"bridge sse round {i}: {got!r}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Incremental SSE / frame decoding checks")
+    parser.add_argument("--seed", type=int, default=20261018)
+    parser.add_argument("--rounds", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    checks: List[tuple] = [
+        ("SSEDecoder + PayloadDecoder", lambda: check_sse(rng, args.rounds)),
+        ("混合 base64 字母表", check_mixed_alphabet),
+        ("FrameDecoder", lambda: check_frames(rng, args.rounds)),
+        ("bridge JSON SSE 以无换行的 [DONE] 结束", lambda: check_bridge_sse(rng, max(1, args.rounds // 10))),
+    ]
+    failed = 0
+    for name, check in checks:
+        failures: List[str] = check()
+        print(f"{'✓' if not failures else '✗'} {name}")
+        for line in failures[:10]:
+            print(f"    {line}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
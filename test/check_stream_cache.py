@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应缓存写入规则检查（StreamRecorder）
+
+直接调用路由处理函数 chat_completions，上游事件源替换为脚本内构造的 ResponseEventRecord 序列，
+检查只有正常结束的响应才写入缓存：
+    1. 正常结束（finish_reason + [DONE]）的流式响应写入缓存，相同请求再次到达时 X-Cache: HIT，回放字节完全相同
+    2. 上游中途出错（输出 error 块 + [DONE]）的流不写入缓存
+    3. 上游没有 finished 事件就结束的流不写入缓存
+    4. 客户端中途断开（只读了一部分就关闭）的流不写入缓存
+    5. 输出超过 WARP_CACHE_MAX_BYTES 的流不写入缓存
+    6. 非流式请求上游出错时返回 502，且不写入缓存
+任一检查失败时打印原因并以退出码 1 结束。
+
+用法:
+    python test/check_stream_cache.py
+"""
+import asyncio
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+os.environ.setdefault("WARP_CACHE_TTL", "60")
+
+from fastapi import HTTPException, Request, Response  # noqa: E402
+
+import protobuf2openai.router as router  # noqa: E402
+import protobuf2openai.sse_transform as sse_transform  # noqa: E402
+from protobuf2openai.cache import CACHE_STATUS_HEADER, RESPONSE_CACHE  # noqa: E402
+from warp2protobuf.core.event_record import (EVENT_CLIENT_ACTIONS, EVENT_FINISHED, EVENT_INIT, PART_TEXT,  # noqa: E402
+                                             ResponseEventRecord)
+
+Source = Callable[[], AsyncIterator[ResponseEventRecord]]
+
+
+def _init() -> ResponseEventRecord:
+    record = ResponseEventRecord(EVENT_INIT)
+    record.conversation_id = "conv-check"
+    return record
+
+
+def _text(text: str) -> ResponseEventRecord:
+    record = ResponseEventRecord(EVENT_CLIENT_ACTIONS)
+    record.parts.append((PART_TEXT, text))
+    return record
+
+
+def _finished() -> ResponseEventRecord:
+    record = ResponseEventRecord(EVENT_FINISHED)
+    record.finish_reason = "done"
+    return record
+
+
+def source_ok(texts: List[str]) -> Source:
+    async def gen():
+        yield _init()
+        for text in texts:
+            yield _text(text)
+            await asyncio.sleep(0)
+        yield _finished()
+    return gen
+
+
+def source_error() -> Source:
+    async def gen():
+        yield _init()
+        yield _text("partial ")
+        raise RuntimeError("upstream broke mid-stream")
+    return gen
+
+
+def source_no_finish() -> Source:
+    async def gen():
+        yield _init()
+        yield _text("no finished event")
+    return gen
+
+
+def _request(payload: Dict[str, Any]) -> Request:
+    body = json.dumps(payload).encode("utf-8")
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/v1/chat/completions", "query_string": b"",
+             "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]}
+    return Request(scope, receive)
+
+
+def _body(content: str, stream: bool = True) -> Dict[str, Any]:
+    return {"model": "claude-4-sonnet", "stream": stream, "messages": [{"role": "user", "content": content}]}
+
+
+async def call(payload: Dict[str, Any], source: Source, read_chunks: Optional[int] = None) -> Tuple[Any, str, bytes]:
+    """返回 (路由返回值, X-Cache, 读到的流式字节)；read_chunks 不为空时只读这么多块就关闭（模拟客户端断开）"""
+    sse_transform._event_source = lambda packet: source()
+    response = Response()
+    result = await router.chat_completions(_request(payload), response)
+    if not hasattr(result, "body_iterator"):
+        return result, response.headers.get(CACHE_STATUS_HEADER, ""), b""
+    status = result.headers.get(CACHE_STATUS_HEADER, "")
+    chunks: List[bytes] = []
+    iterator = result.body_iterator
+    async for chunk in iterator:
+        chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+        if read_chunks is not None and len(chunks) >= read_chunks:
+            await iterator.aclose()
+            break
+    return result, status, b"".join(chunks)
+
+
+async def run_checks() -> List[str]:
+    failures: List[str] = []
+
+    def expect(ok: bool, message: str) -> None:
+        print(f"{'✓' if ok else '✗'} {message}")
+        if not ok:
+            failures.append(message)
+
+    async def _no_init():
+        return None
+
+    router.initialize_once = _no_init
+    RESPONSE_CACHE.clear()
+
+    body = _body("cache me")
+    _, status, first = await call(body, source_ok(["hello ", "world"]))
+    expect(status == "MISS" and first.endswith(b"data: [DONE]\n\n") and b'"finish_reason": "stop"' in first,
+           f"正常结束的流: X-Cache={status}，以 finish_reason + [DONE] 结束")
+    _, status, replay = await call(body, source_error())
+    expect(status == "HIT" and replay == first, f"相同请求命中缓存并原样回放: X-Cache={status}")
+
+    body = _body("error stream")
+    _, _, out = await call(body, source_error())
+    expect(b"upstream broke" in out and out.endswith(b"data: [DONE]\n\n"), "上游出错的流输出 error 块 + [DONE]")
+    _, status, _ = await call(body, source_ok(["x"]))
+    expect(status == "MISS", f"上游出错的流不写入缓存: 再次请求 X-Cache={status}")
+
+    body = _body("no finish")
+    await call(body, source_no_finish())
+    _, status, _ = await call(body, source_ok(["x"]))
+    expect(status == "MISS", f"没有 finished 事件的流不写入缓存: 再次请求 X-Cache={status}")
+
+    body = _body("client disconnect")
+    _, _, partial = await call(body, source_ok([f"part {i} " for i in range(20)]), read_chunks=3)
+    _, status, _ = await call(body, source_ok(["x"]))
+    expect(not partial.endswith(b"data: [DONE]\n\n") and status == "MISS",
+           f"客户端中途断开的流不写入缓存: 再次请求 X-Cache={status}")
+
+    body = _body("too large")
+    saved = RESPONSE_CACHE.max_bytes
+    RESPONSE_CACHE.max_bytes = 512
+    try:
+        _, _, out = await call(body, source_ok(["y" * 200 for _ in range(5)]))
+    finally:
+        RESPONSE_CACHE.max_bytes = saved
+    _, status, _ = await call(body, source_ok(["x"]))
+    expect(len(out) > 512 and status == "MISS", f"超过缓存上限的流不写入缓存: 输出 {len(out)} 字节，再次请求 X-Cache={status}")
+
+    body = _body("non-stream error", stream=False)
+    try:
+        await call(body, source_error())
+        code = 200
+    except HTTPException as e:
+        code = e.status_code
+    result, status, _ = await call(body, source_ok(["fine"]))
+    expect(code == 502 and status == "MISS" and result["choices"][0]["message"]["content"] == "fine",
+           f"非流式上游出错返回 {code}，不写入缓存: 再次请求 X-Cache={status}")
+    return failures
+
+
+def main() -> int:
+    if not RESPONSE_CACHE.enabled:
+        print("响应缓存未开启（WARP_CACHE_TTL / WARP_CACHE_MAX_BYTES 为 0），无法检查")
+        return 1
+    failures = asyncio.run(run_checks())
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
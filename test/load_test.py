@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/v1/chat/completions 端到端压测
+
+以固定并发驱动流式 / 非流式请求，报告 TTFT（首个内容增量）、总延迟的 p50/p95/p99 以及每个压测进程的 events/sec。
+
+直接压测已运行的服务:
+    python test/load_test.py --url http://127.0.0.1:8010 --concurrency 32 --requests 2000
+
+离线压测（自动启动 mock_warp_server + bridge + OpenAI 兼容层，使用假 JWT，不访问 app.warp.dev）:
+    python test/load_test.py --spawn http --concurrency 32 --requests 2000 --mock-tokens-per-sec 200
+    python test/load_test.py --spawn embedded --mode mixed --processes 4
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_jwt(ttl_seconds: int = 7 * 24 * 3600) -> str:
+    """未签名但未过期的 JWT：只用于让 auth.get_valid_jwt 跳过刷新，mock 服务不校验签名"""
+    def _b64(obj: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+    return ".".join((_b64({"alg": "none", "typ": "JWT"}),
+                     _b64({"sub": "load-test", "exp": int(time.time()) + ttl_seconds}),
+                     "signature"))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+# ---------------- 单个请求 ----------------
+
+async def _one_stream(client: httpx.AsyncClient, url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    ttft: Optional[float] = None
+    events = 0
+    async with client.stream("POST", url, json=body) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            return {"ok": False, "error": f"HTTP {resp.status_code}"}
+        buf = b""
+        async for chunk in resp.aiter_bytes():
+            buf += chunk
+            while b"\n\n" in buf:
+                block, buf = buf.split(b"\n\n", 1)
+                if not block.startswith(b"data: "):
+                    continue
+                data = block[6:]
+                if data == b"[DONE]":
+                    continue
+                if b'"content"' in data or b'"tool_calls"' in data:
+                    events += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                elif b'"error"' in data:
+                    return {"ok": False, "error": data[:200].decode("utf-8", "replace")}
+    total = time.perf_counter() - started
+    return {"ok": True, "ttft": ttft if ttft is not None else total, "total": total, "events": events}
+
+
+async def _one_plain(client: httpx.AsyncClient, url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    resp = await client.post(url, json=body)
+    total = time.perf_counter() - started
+    if resp.status_code != 200:
+        return {"ok": False, "error": f"HTTP {resp.status_code}"}
+    return {"ok": True, "ttft": total, "total": total, "events": 1}
+
+
+# ---------------- 单个压测进程 ----------------
+
+async def _run_worker(args: argparse.Namespace, concurrency: int, requests: int, worker_id: int) -> Dict[str, Any]:
+    url = f"{args.url.rstrip('/')}/v1/chat/completions"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    samples: List[Dict[str, Any]] = []
+    counter = {"next": 0}
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(args.timeout), limits=limits, trust_env=False) as client:
+        async def _loop():
+            while True:
+                n = counter["next"]
+                if deadline is None and n >= requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                counter["next"] = n + 1
+                stream = args.mode == "stream" or (args.mode == "mixed" and n % 2 == 0)
+                body = {
+                    "model": args.model,
+                    "stream": stream,
+                    # 每个请求带唯一后缀，避免命中去重/响应缓存
+                    "messages": [{"role": "user", "content": f"{args.prompt} [w{worker_id}-{n}]"}],
+                }
+                try:
+                    sample = await (_one_stream if stream else _one_plain)(client, url, body)
+                except Exception as e:
+                    sample = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                sample["stream"] = stream
+                samples.append(sample)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(_loop() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {"worker": worker_id, "wall": wall, "samples": samples}
+
+
+def _worker_entry(args: argparse.Namespace, concurrency: int, requests: int, worker_id: int, queue) -> None:
+    queue.put(asyncio.run(_run_worker(args, concurrency, requests, worker_id)))
+
+
+# ---------------- 被测服务（--spawn） ----------------
+
+def _wait_healthy(url: str, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2.0, trust_env=False).status_code == 200:
+                return
+        except Exception as e:
+            last = e
+        time.sleep(0.3)
+    raise RuntimeError(f"service not healthy: {url} ({last})")
+
+
+def _spawn_stack(args: argparse.Namespace) -> List[subprocess.Popen]:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT,
+        "WARP_URL": f"http://127.0.0.1:{args.mock_port}/ai/multi-agent",
+        "WARP_JWT": fake_jwt(),
+        "WARP_DOTENV_OVERRIDE": "0",
+        "WARP_LOG_LEVEL": env.get("WARP_LOG_LEVEL", "WARNING"),
+        "WARP_BRIDGE_MODE": args.spawn,
+    })
+    out = None if args.verbose else subprocess.DEVNULL
+    procs: List[subprocess.Popen] = []
+
+    mock_cmd = [sys.executable, os.path.join(ROOT, "test", "mock_warp_server.py"), "--port", str(args.mock_port),
+                "--events", str(args.mock_events), "--chars-per-event", str(args.mock_chars_per_event),
+                "--tokens-per-sec", str(args.mock_tokens_per_sec), "--ttft-ms", str(args.mock_ttft_ms),
+                "--tool-call-every", str(args.mock_tool_call_every)]
+    procs.append(subprocess.Popen(mock_cmd, cwd=ROOT, env=env, stdout=out, stderr=out))
+    _wait_healthy(f"http://127.0.0.1:{args.mock_port}/healthz")
+
+    if args.spawn == "http":
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py")],
+                                      cwd=ROOT, env=env, stdout=out, stderr=out))
+        _wait_healthy("http://127.0.0.1:8000/healthz")
+
+    compat_env = dict(env, HOST="127.0.0.1", PORT=str(args.compat_port))
+    procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "openai_compat.py")],
+                                  cwd=ROOT, env=compat_env, stdout=out, stderr=out))
+    _wait_healthy(f"http://127.0.0.1:{args.compat_port}/healthz")
+    args.url = f"http://127.0.0.1:{args.compat_port}"
+    return procs
+
+
+def _stop_stack(procs: List[subprocess.Popen]) -> None:
+    for proc in reversed(procs):
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGINT)
+    for proc in reversed(procs):
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ---------------- 汇总 ----------------
+
+def _summarize(results: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    samples = [s for r in results for s in r["samples"]]
+    ok = [s for s in samples if s["ok"]]
+    wall = max((r["wall"] for r in results), default=0.0) or 1e-9
+    streams = [s for s in ok if s["stream"]]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s["ok"]:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+
+    def _pcts(values: List[float]) -> Dict[str, float]:
+        return {f"p{p}": round(percentile(values, p) * 1000, 2) for p in (50, 95, 99)}
+
+    return {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "processes": args.processes,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(ok) / wall, 2),
+        "ttft_ms": _pcts([s["ttft"] for s in streams]),
+        "total_ms": _pcts([s["total"] for s in ok]),
+        "events_per_s": round(sum(s["events"] for s in streams) / wall, 1),
+        "per_process": [
+            {"worker": r["worker"], "requests": len(r["samples"]),
+             "events_per_s": round(sum(s.get("events", 0) for s in r["samples"] if s["ok"] and s["stream"])
+                                   / (r["wall"] or 1e-9), 1)}
+            for r in results
+        ],
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print("=" * 60)
+    print(f"mode={report['mode']} concurrency={report['concurrency']} processes={report['processes']}")
+    print(f"requests: {report['requests']}  ok: {report['ok']}  wall: {report['wall_s']}s  "
+          f"throughput: {report['req_per_s']} req/s")
+    t, l = report["ttft_ms"], report["total_ms"]
+    print(f"TTFT  (ms): p50={t['p50']}  p95={t['p95']}  p99={t['p99']}")
+    print(f"total (ms): p50={l['p50']}  p95={l['p95']}  p99={l['p99']}")
+    print(f"events/sec: {report['events_per_s']}")
+    for p in report["per_process"]:
+        print(f"  worker {p['worker']}: {p['requests']} requests, {p['events_per_s']} events/sec")
+    if report["errors"]:
+        print("errors:")
+        for err, n in sorted(report["errors"].items(), key=lambda kv: -kv[1])[:10]:
+            print(f"  {n:6d}  {err}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for /v1/chat/completions")
+    parser.add_argument("--url", default="http://127.0.0.1:8010", help="OpenAI 兼容服务地址（--spawn 时忽略）")
+    parser.add_argument("--concurrency", type=int, default=16, help="总并发（在各进程间平分）")
+    parser.add_argument("--requests", type=int, default=500, help="总请求数（--duration 优先）")
+    parser.add_argument("--duration", type=float, default=0, help="按时长压测（秒）")
+    parser.add_argument("--processes", type=int, default=1, help="压测进程数")
+    parser.add_argument("--mode", choices=("stream", "nonstream", "mixed"), default="stream")
+    parser.add_argument("--model", default="claude-4-sonnet")
+    parser.add_argument("--prompt", default="Write a short paragraph about load testing.")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json-out", default="", help="把汇总结果写入 JSON 文件")
+    parser.add_argument("--spawn", choices=("none", "http", "embedded"), default="none",
+                        help="自动启动 mock 上游与被测服务（http: bridge + 兼容层；embedded: 仅兼容层）")
+    parser.add_argument("--compat-port", type=int, default=8010)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-events", type=int, default=100)
+    parser.add_argument("--mock-chars-per-event", type=int, default=4)
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=0)
+    parser.add_argument("--mock-ttft-ms", type=float, default=0)
+    parser.add_argument("--mock-tool-call-every", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="显示被启动服务的输出")
+    args = parser.parse_args()
+
+    procs: List[subprocess.Popen] = []
+    try:
+        if args.spawn != "none":
+            procs = _spawn_stack(args)
+
+        processes = max(1, args.processes)
+        per_conc = [args.concurrency // processes + (1 if i < args.concurrency % processes else 0) for i in range(processes)]
+        per_req = [args.requests // processes + (1 if i < args.requests % processes else 0) for i in range(processes)]
+
+        if processes == 1:
+            results = [asyncio.run(_run_worker(args, max(1, per_conc[0]), per_req[0], 0))]
+        else:
+            queue = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=_worker_entry, args=(args, max(1, per_conc[i]), per_req[i], i, queue))
+                       for i in range(processes)]
+            for w in workers:
+                w.start()
+            results = [queue.get() for _ in workers]
+            for w in workers:
+                w.join()
+            results.sort(key=lambda r: r["worker"])
+
+        report = _summarize(results, args)
+        _print_report(report)
+        if args.json_out:
+            with open(args.json_out, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    finally:
+        _stop_stack(procs)
+
+
+if __name__ == "__main__":
+    main()
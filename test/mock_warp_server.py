@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟 Warp multi-agent 端点（离线压测用）
+
+接收 warp.multi_agent.v1.Request protobuf 请求体，按 proto/ 中的定义构造 ResponseEvent，
+以 base64url SSE 流式返回：init -> create_task -> N 个文本增量（可选工具调用）-> finished。
+也可用 --replay 回放录制的 SSE 文件（每行 "data: <base64/hex>"，空行分隔事件）。
+
+用法:
+    python test/mock_warp_server.py --port 9100 --tokens-per-sec 200 --chars-per-event 4 --events 200
+
+bridge / OpenAI 兼容层指向该服务:
+    WARP_URL=http://127.0.0.1:9100/ai/multi-agent WARP_JWT=<test/load_test.py 生成的假 token> WARP_DOTENV_OVERRIDE=0
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+import uuid
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from warp2protobuf.core.protobuf import ensure_proto_runtime, msg_cls
+
+RESPONSE_EVENT = "warp.multi_agent.v1.ResponseEvent"
+WORDS = ("lorem ", "ipsum ", "dolor ", "sit ", "amet ", "consectetur ", "adipiscing ", "elit ")
+
+
+def _sse(event) -> bytes:
+    return b"data: " + base64.urlsafe_b64encode(event.SerializeToString()) + b"\n\n"
+
+
+class MockConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.events = args.events
+        self.chars_per_event = args.chars_per_event
+        self.tokens_per_sec = args.tokens_per_sec
+        self.ttft_ms = args.ttft_ms
+        self.tool_call_every = args.tool_call_every
+        self.replay: Optional[List[bytes]] = _load_replay(args.replay) if args.replay else None
+
+
+def _load_replay(path: str) -> List[bytes]:
+    """读取录制的 SSE，返回逐个事件的原始 SSE 字节（含结尾空行）"""
+    with open(path, "rb") as f:
+        blocks = f.read().replace(b"\r\n", b"\n").split(b"\n\n")
+    return [block.strip(b"\n") + b"\n\n" for block in blocks if block.strip()]
+
+
+class EventFactory:
+    """预先编码不随请求变化的事件，每个请求只编码 init / create_task"""
+
+    def __init__(self, cfg: MockConfig):
+        ensure_proto_runtime()
+        self.cfg = cfg
+        self.Event = msg_cls(RESPONSE_EVENT)
+        self._text_chunks = [self._text_event(self._chunk_text(i)) for i in range(min(cfg.events, 64))]
+        finished = self.Event()
+        finished.finished.done.SetInParent()
+        usage = finished.finished.token_usage.add()
+        usage.model_id = "mock"
+        usage.output = cfg.events
+        self.finished = _sse(finished)
+
+    def _chunk_text(self, i: int) -> str:
+        text = ""
+        j = i
+        while len(text) < self.cfg.chars_per_event:
+            text += WORDS[j % len(WORDS)]
+            j += 1
+        return text[:self.cfg.chars_per_event]
+
+    def _text_event(self, text: str) -> bytes:
+        event = self.Event()
+        action = event.client_actions.actions.add()
+        message = action.append_to_message_content.message
+        message.id = "mock-message"
+        message.agent_output.text = text
+        return _sse(event)
+
+    def text(self, i: int) -> bytes:
+        return self._text_chunks[i % len(self._text_chunks)]
+
+    def init(self, conversation_id: str) -> bytes:
+        event = self.Event()
+        event.init.conversation_id = conversation_id
+        event.init.request_id = str(uuid.uuid4())
+        return _sse(event)
+
+    def create_task(self, task_id: str) -> bytes:
+        event = self.Event()
+        action = event.client_actions.actions.add()
+        action.create_task.task.id = task_id
+        return _sse(event)
+
+    def tool_call(self, n: int) -> bytes:
+        event = self.Event()
+        action = event.client_actions.actions.add()
+        message = action.add_messages_to_task.messages.add()
+        message.id = f"mock-tool-{n}"
+        message.tool_call.tool_call_id = f"call_{uuid.uuid4().hex[:12]}"
+        call = message.tool_call.call_mcp_tool
+        call.name = "mock_tool"
+        call.args.update({"n": n, "query": "mock"})
+        return _sse(event)
+
+
+def create_app(cfg: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Warp multi-agent")
+    factory = EventFactory(cfg)
+    Request_ = msg_cls("warp.multi_agent.v1.Request")
+    stats = {"requests": 0, "bad_requests": 0, "events": 0}
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok", **stats}
+
+    @app.post("/ai/multi-agent")
+    async def multi_agent(request: Request):
+        body = await request.body()
+        req = Request_()
+        try:
+            req.ParseFromString(body)
+        except Exception as e:
+            stats["bad_requests"] += 1
+            return StreamingResponse(iter([f"invalid request: {e}".encode()]), status_code=400)
+        stats["requests"] += 1
+        conversation_id = req.metadata.conversation_id or str(uuid.uuid4())
+        task_id = req.task_context.active_task_id or str(uuid.uuid4())
+
+        async def _stream():
+            if cfg.replay is not None:
+                for block in cfg.replay:
+                    stats["events"] += 1
+                    yield block
+                    if cfg.tokens_per_sec > 0:
+                        await asyncio.sleep(1.0 / cfg.tokens_per_sec)
+                return
+
+            if cfg.ttft_ms > 0:
+                await asyncio.sleep(cfg.ttft_ms / 1000.0)
+            yield factory.init(conversation_id)
+            yield factory.create_task(task_id)
+            interval = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0.0
+            started = time.perf_counter()
+            for i in range(cfg.events):
+                if interval:
+                    # 按绝对时间表发送，避免 sleep 误差累积
+                    delay = started + i * interval - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                yield factory.text(i)
+                if cfg.tool_call_every and (i + 1) % cfg.tool_call_every == 0:
+                    yield factory.tool_call(i)
+            yield factory.finished
+            stats["events"] += cfg.events + 3
+
+        return StreamingResponse(_stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Warp multi-agent SSE endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--events", type=int, default=100, help="每个响应的文本增量事件数")
+    parser.add_argument("--chars-per-event", type=int, default=4, help="每个文本增量的字符数")
+    parser.add_argument("--tokens-per-sec", type=float, default=0, help="每秒发送的文本事件数（0 表示不限速）")
+    parser.add_argument("--ttft-ms", type=float, default=0, help="首个事件前的延迟（毫秒）")
+    parser.add_argument("--tool-call-every", type=int, default=0, help="每 N 个文本事件插入一个工具调用（0 表示不插入）")
+    parser.add_argument("--replay", default="", help="回放录制的 SSE 文件而不是生成合成事件")
+    args = parser.parse_args()
+
+    app = create_app(MockConfig(args))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
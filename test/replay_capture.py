@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回放 WARP_CAPTURE_DIR 录制的上游流
+
+把录制的原始 SSE 字节块按原始节奏（--speed 1）、加速（--speed 10）或不等待（--speed 0）送回
+bridge 与 OpenAI 转换层，收集输出的 OpenAI chunk，并与金标准文件逐字节比较。
+
+三条路径（--path，默认 all）:
+    embedded  stream_warp_event_records -> stream_openai_sse
+    sse       stream_warp_events -> JSON SSE（与 /api/warp/send_stream_sse 相同的渲染）-> _iter_sse_events -> stream_openai_sse
+    frames    stream_warp_event_bytes -> 长度前缀帧 -> _iter_frame_events -> stream_openai_sse
+选择多条路径时还会检查各路径输出彼此一致。
+
+用法:
+    python test/replay_capture.py captures/*.jsonl --write-golden      # 生成 <capture>.golden.sse
+    python test/replay_capture.py captures/*.jsonl                     # 与金标准比较，不一致时退出码 1
+    python test/replay_capture.py captures/x.jsonl --speed 1 --path embedded
+"""
+import argparse
+import asyncio
+import difflib
+import json
+import os
+import re
+import sys
+import time
+from typing import AsyncIterator, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("WARP_LOG_LEVEL", "WARNING")
+
+import protobuf2openai.sse_transform as sse_transform  # noqa: E402
+import warp2protobuf.warp.api_client as api_client  # noqa: E402
+from warp2protobuf.core.capture import load_capture  # noqa: E402
+from warp2protobuf.core.framing import FRAME_DONE, FRAME_EVENT, encode_frame  # noqa: E402
+from warp2protobuf.core.sse_decoder import iter_sse_event_bytes  # noqa: E402
+
+PATHS = ("embedded", "sse", "frames")
+_UUID_RE = re.compile(rb"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+async def _timed_chunks(chunks: List[Tuple[float, bytes]], speed: float) -> AsyncIterator[bytes]:
+    started = time.perf_counter()
+    for t, data in chunks:
+        if speed > 0:
+            delay = started + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield data
+
+
+class _ReplayResponse:
+    """只提供 aiter_bytes() 的响应替身，供 _iter_sse_events / _iter_frame_events 使用"""
+
+    def __init__(self, body: AsyncIterator[bytes]):
+        self._body = body
+
+    def aiter_bytes(self) -> AsyncIterator[bytes]:
+        return self._body
+
+
+async def _bridge_sse_body(protobuf_bytes: bytes) -> AsyncIterator[bytes]:
+    async for event in api_client.stream_warp_events(protobuf_bytes):
+        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+    yield b"data: [DONE]\n\n"
+
+
+async def _bridge_frames_body(protobuf_bytes: bytes) -> AsyncIterator[bytes]:
+    async for raw in api_client.stream_warp_event_bytes(protobuf_bytes):
+        yield encode_frame(FRAME_EVENT, raw)
+    yield encode_frame(FRAME_DONE)
+
+
+def _event_source_for(path: str):
+    def _source(packet):
+        if path == "embedded":
+            return api_client.stream_warp_event_records(packet)
+        if path == "sse":
+            return sse_transform._iter_sse_events(_ReplayResponse(_bridge_sse_body(packet)))
+        return sse_transform._iter_frame_events(_ReplayResponse(_bridge_frames_body(packet)))
+    return _source
+
+
+async def replay(capture: Dict, path: str, speed: float) -> Tuple[bytes, float]:
+    """返回 (规范化后的 OpenAI SSE 输出, 耗时秒)"""
+    async def _upstream(_protobuf_bytes: bytes) -> AsyncIterator[bytes]:
+        async for raw in iter_sse_event_bytes(_timed_chunks(capture["chunks"], speed)):
+            yield raw
+
+    api_client.stream_warp_event_bytes = _upstream
+    sse_transform._event_source = _event_source_for(path)
+
+    out = bytearray()
+    started = time.perf_counter()
+    async for line in sse_transform.stream_openai_sse(capture.get("request") or b"", "chatcmpl-replay", 0, "replay"):
+        out += line
+    elapsed = time.perf_counter() - started
+    return _normalize(bytes(out)), elapsed
+
+
+def _canonical_arguments(line: bytes) -> bytes:
+    """工具参数来自 protobuf Struct（map 迭代顺序随进程变化），按键排序后再比较"""
+    try:
+        chunk = json.loads(line[len(b"data: "):])
+        calls = [tc for choice in chunk.get("choices", []) for tc in (choice.get("delta") or {}).get("tool_calls") or []]
+    except (ValueError, AttributeError):
+        return line
+    if not calls:
+        return line
+    for tc in calls:
+        fn = tc.get("function") or {}
+        try:
+            fn["arguments"] = json.dumps(json.loads(fn.get("arguments") or "{}"), ensure_ascii=False, sort_keys=True)
+        except ValueError:
+            pass
+    return b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8")
+
+
+def _normalize(output: bytes) -> bytes:
+    # 无 id 的工具调用会生成随机 UUID，比较前统一替换
+    output = _UUID_RE.sub(b"00000000-0000-0000-0000-000000000000", output)
+    return b"\n".join(_canonical_arguments(line) if line.startswith(b"data: {") and b'"tool_calls"' in line else line
+                      for line in output.split(b"\n"))
+
+
+def _diff(expected: bytes, actual: bytes, limit: int = 20) -> str:
+    lines = list(difflib.unified_diff(expected.decode("utf-8", "replace").splitlines(),
+                                      actual.decode("utf-8", "replace").splitlines(),
+                                      "golden", "replay", lineterm="", n=1))
+    return "\n".join(lines[:limit])
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    paths = PATHS if args.path == "all" else (args.path,)
+    failures = 0
+    for capture_path in args.captures:
+        capture = load_capture(capture_path)
+        golden_path = capture_path + ".golden.sse"
+        outputs: Dict[str, bytes] = {}
+        for path in paths:
+            output, elapsed = await replay(capture, path, args.speed)
+            outputs[path] = output
+            print(f"{os.path.basename(capture_path)} [{path}] chunks={len(capture['chunks'])} "
+                  f"out={len(output)}B lines={output.count(b'data: ')} {elapsed * 1000:.1f}ms")
+
+        first = outputs[paths[0]]
+        for path in paths[1:]:
+            if outputs[path] != first:
+                failures += 1
+                print(f"  ✗ {path} 与 {paths[0]} 输出不一致\n{_diff(first, outputs[path])}")
+
+        if args.write_golden:
+            with open(golden_path, "wb") as f:
+                f.write(first)
+            print(f"  金标准已写入 {golden_path}")
+        elif os.path.exists(golden_path):
+            with open(golden_path, "rb") as f:
+                golden = f.read()
+            mismatched = [path for path, output in outputs.items() if output != golden]
+            for path in mismatched:
+                print(f"  ✗ [{path}] 与金标准不一致\n{_diff(golden, outputs[path])}")
+            failures += len(mismatched)
+            if not mismatched:
+                print("  ✓ 与金标准一致")
+        else:
+            print(f"  （无金标准 {golden_path}，使用 --write-golden 生成）")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay captured upstream streams through the bridge and OpenAI transform")
+    parser.add_argument("captures", nargs="+", help="WARP_CAPTURE_DIR 中的 .jsonl 录制文件")
+    parser.add_argument("--speed", type=float, default=0, help="回放速度倍数（1 为原始节奏，0 为不等待）")
+    parser.add_argument("--path", choices=PATHS + ("all",), default="all")
+    parser.add_argument("--write-golden", action="store_true", help="把输出写为 <capture>.golden.sse")
+    args = parser.parse_args()
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,16 +10,17 @@ import json
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-import httpx
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from ..config.settings import CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, WARP_URL as CONFIG_WARP_URL
-from ..core.auth import get_jwt_token, is_token_expired, refresh_jwt_if_needed, get_valid_jwt
+from ..core.auth import get_jwt_token, is_token_expired, refresh_jwt_if_needed
+from ..core.framing import FRAME_DONE, FRAME_ERROR, FRAME_EVENT, FRAME_MEDIA_TYPE, encode_frame
 from ..core.logging import logger
-from ..core.pool_auth import acquire_pool_or_anonymous_token
-from ..core.protobuf_utils import protobuf_to_dict, dict_to_protobuf_bytes
+from ..core.metrics import BRIDGE_INFLIGHT, METRICS_CONTENT_TYPE, render_metrics
+from ..core.packet_normalizer import normalize_request_packet
+from ..core.protobuf_utils import protobuf_to_dict, encode_request_packet, packet_to_protobuf_bytes
+from ..core.tracing import REQUEST_ID_HEADER, TRACEPARENT_HEADER, Trace, span, start_trace, use_trace
 from ..core.server_message_data import decode_server_message_data, encode_server_message_data
 from ..core.stream_processor import set_websocket_manager
 
@@ -64,7 +65,6 @@ def _decode_smd_inplace(obj: Any) -> Any:
         return [_decode_smd_inplace(x) for x in obj]
     else:
         return obj
-from ..core.schema_sanitizer import sanitize_mcp_input_schema_in_packet
 
 
 class EncodeRequest(BaseModel):
@@ -206,6 +206,18 @@ async def health_check():
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
 
+@app.get("/metrics")
+async def metrics():
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _start_bridge_trace(http_request: Request) -> Trace:
+    """沿用 OpenAI 兼容层传来的 X-Request-ID / traceparent"""
+    return start_trace("warp-bridge", http_request.headers.get(REQUEST_ID_HEADER),
+                       http_request.headers.get(TRACEPARENT_HEADER))
+
+
 @app.post("/api/encode")
 async def encode_json_to_protobuf(request: EncodeRequest):
     try:
@@ -213,11 +225,8 @@ async def encode_json_to_protobuf(request: EncodeRequest):
         actual_data = request.get_data()
         if not actual_data:
             raise HTTPException(400, "数据包不能为空")
-        wrapped = {"json_data": actual_data}
-        wrapped = sanitize_mcp_input_schema_in_packet(wrapped)
-        actual_data = wrapped.get("json_data", actual_data)
-        actual_data = _encode_smd_inplace(actual_data)
-        protobuf_bytes = dict_to_protobuf_bytes(actual_data, request.message_type)
+        actual_data = normalize_request_packet(actual_data)
+        protobuf_bytes = packet_to_protobuf_bytes(actual_data, request.message_type)
         try:
             await manager.log_packet("encode", actual_data, len(protobuf_bytes))
         except Exception as log_error:
@@ -383,11 +392,8 @@ async def send_to_warp_api(
         actual_data = request.get_data()
         if not actual_data:
             raise HTTPException(400, "数据包不能为空")
-        wrapped = {"json_data": actual_data}
-        wrapped = sanitize_mcp_input_schema_in_packet(wrapped)
-        actual_data = wrapped.get("json_data", actual_data)
-        actual_data = _encode_smd_inplace(actual_data)
-        protobuf_bytes = dict_to_protobuf_bytes(actual_data, request.message_type)
+        actual_data = normalize_request_packet(actual_data)
+        protobuf_bytes = packet_to_protobuf_bytes(actual_data, request.message_type)
         logger.info(f"✅ JSON编码为protobuf成功: {len(protobuf_bytes)} 字节")
         from ..warp.api_client import send_protobuf_to_warp_api
         response_text, conversation_id, task_id = await send_protobuf_to_warp_api(protobuf_bytes, show_all_events=show_all_events)
@@ -410,18 +416,19 @@ async def send_to_warp_api(
 
 @app.post("/api/warp/send_stream")
 async def send_to_warp_api_parsed(
-    request: EncodeRequest
+    request: EncodeRequest,
+    http_request: Request
 ):
+    trace = _start_bridge_trace(http_request)
     try:
         logger.info(f"收到Warp API解析发送请求，消息类型: {request.message_type}")
         actual_data = request.get_data()
         if not actual_data:
             raise HTTPException(400, "数据包不能为空")
-        wrapped = {"json_data": actual_data}
-        wrapped = sanitize_mcp_input_schema_in_packet(wrapped)
-        actual_data = wrapped.get("json_data", actual_data)
-        actual_data = _encode_smd_inplace(actual_data)
-        protobuf_bytes = dict_to_protobuf_bytes(actual_data, request.message_type)
+        with span("sanitize"):
+            actual_data = normalize_request_packet(actual_data)
+        with span("encode"):
+            protobuf_bytes = packet_to_protobuf_bytes(actual_data, request.message_type)
         logger.info(f"✅ JSON编码为protobuf成功: {len(protobuf_bytes)} 字节")
         from ..warp.api_client import send_protobuf_to_warp_api_parsed
         response_text, conversation_id, task_id, parsed_events = await send_protobuf_to_warp_api_parsed(protobuf_bytes)
@@ -437,8 +444,10 @@ async def send_to_warp_api_parsed(
                 event_type_counts[event_type] = event_type_counts.get(event_type, 0) + 1
             result["events_summary"] = event_type_counts
         logger.info(f"✅ Warp API解析调用成功，响应长度: {len(response_text)} 字符，事件数量: {len(parsed_events)}")
+        trace.finish("bridge.send_stream", events=len(parsed_events))
         return result
     except Exception as e:
+        trace.finish("bridge.send_stream", error=type(e).__name__)
         import traceback
         error_details = {"error": str(e), "error_type": type(e).__name__, "traceback": traceback.format_exc(), "request_info": {"message_type": request.message_type, "json_size": len(str(actual_data)) if 'actual_data' in locals() else 0, "has_tools": "mcp_context" in (actual_data or {}), "has_history": "task_context" in (actual_data or {})}}
         logger.error(f"❌ Warp API解析调用失败: {e}")
@@ -451,348 +460,96 @@ async def send_to_warp_api_parsed(
 
 
 @app.post("/api/warp/send_stream_sse")
-async def send_to_warp_api_stream_sse(request: EncodeRequest):
+async def send_to_warp_api_stream_sse(request: EncodeRequest, http_request: Request):
     from fastapi.responses import StreamingResponse
-    import os as _os
-    import re as _re
-    import asyncio
-    # 导入代理管理器
-    from ..core.proxy_manager import AsyncProxyManager
+    from ..warp.api_client import WarpStreamError, stream_warp_events
 
+    trace = _start_bridge_trace(http_request)
     try:
         actual_data = request.get_data()
         if not actual_data:
             raise HTTPException(400, "数据包不能为空")
-        wrapped = {"json_data": actual_data}
-        wrapped = sanitize_mcp_input_schema_in_packet(wrapped)
-        actual_data = wrapped.get("json_data", actual_data)
-        actual_data = _encode_smd_inplace(actual_data)
-        protobuf_bytes = dict_to_protobuf_bytes(actual_data, request.message_type)
+        protobuf_bytes = encode_request_packet(actual_data, request.message_type)
 
         async def _agen():
-            # 创建代理管理器实例
-            proxy_manager = AsyncProxyManager()
-            max_proxy_retries = 7  # 增加到 7 次代理重试
-            max_attempts = 5
-
-            warp_url = CONFIG_WARP_URL
-
-            def _parse_payload_bytes(data_str: str):
-                s = _re.sub(r"\\s+", "", data_str or "")
-                if not s:
-                    return None
-                if _re.fullmatch(r"[0-9a-fA-F]+", s or ""):
-                    try:
-                        return bytes.fromhex(s)
-                    except Exception:
-                        pass
-                pad = "=" * ((4 - (len(s) % 4)) % 4)
+            use_trace(trace)
+            with BRIDGE_INFLIGHT.labels(endpoint="sse").track_inprogress():
                 try:
-                    import base64 as _b64
-                    return _b64.urlsafe_b64decode(s + pad)
-                except Exception:
-                    try:
-                        return _b64.b64decode(s + pad)
-                    except Exception:
-                        return None
-
-            verify_opt = False  # 使用代理时关闭SSL验证
-            insecure_env = _os.getenv("WARP_INSECURE_TLS", "").lower()
-            if insecure_env in ("1", "true", "yes"):
-                verify_opt = False
-                logger.warning("TLS verification disabled via WARP_INSECURE_TLS for Warp API stream endpoint")
-
-            # 最多尝试四次：第一次失败且为配额429时申请匿名token并重试
-            jwt = None
-            successful = False
-            last_error = None
-
-            for attempt in range(max_attempts):
-                if attempt > 0:
-                    logger.info(f"开始第 {attempt + 1}/{max_attempts} 轮总体重试...")
-                    # 指数退避：2秒、4秒、8秒
-                    await asyncio.sleep(2.0 ** attempt)
-
-                for proxy_attempt in range(max_proxy_retries):
-                    try:
-                        # 获取新的代理
-                        proxy_str = await proxy_manager.get_proxy()
-                        proxy_config = None
-
-                        if proxy_str:
-                            proxy_config = proxy_manager.format_proxy_for_httpx(proxy_str)
-
-                        # 创建带代理的客户端配置
-                        client_config = {
-                            "http2": True,
-                            "timeout": httpx.Timeout(
-                                timeout=600.0,
-                                connect=15.0,  # 连接超时15秒
-                                read=120.0,  # 读取超时120秒
-                                write=15.0,  # 写入超时15秒
-                                pool=15.0  # 连接池超时15秒
-                            ),
-                            "verify": verify_opt,
-                            "trust_env": False,  # 禁用环境代理，完全使用代码控制
-                            "limits": httpx.Limits(
-                                max_keepalive_connections=10,
-                                max_connections=20,
-                                keepalive_expiry=60
-                            )
-                        }
-
-                        # 如果有代理配置，添加代理参数
-                        if proxy_config:
-                            client_config["proxy"] = proxy_config
-
-                        async with httpx.AsyncClient(**client_config) as client:
-                            if attempt == 0 or jwt is None:
-                                jwt = await get_valid_jwt()
-
-                            headers = {
-                                "accept": "text/event-stream",
-                                "content-type": "application/x-protobuf",
-                                "x-warp-client-version": CLIENT_VERSION,
-                                "x-warp-os-category": OS_CATEGORY,
-                                "x-warp-os-name": OS_NAME,
-                                "x-warp-os-version": OS_VERSION,
-                                "authorization": f"Bearer {jwt}",
-                                "content-length": str(len(protobuf_bytes)),
-                            }
-
-                            async with client.stream("POST", warp_url, headers=headers,
-                                                     content=protobuf_bytes) as response:
-                                if response.status_code != 200:
-                                    error_text = await response.aread()
-                                    error_content = error_text.decode("utf-8") if error_text else ""
-
-                                    # 检查是否是账号被封禁 (403)
-                                    if response.status_code == 403 and (
-                                            ("Your account has been blocked" in error_content) or
-                                            ("blocked from using AI features" in error_content)
-                                    ):
-                                        logger.error(
-                                            f"❌ 账号已被封禁 (HTTP 403, attempt {attempt + 1})。立即删除并获取新账号..."
-                                        )
-
-                                        # 标记当前账号为blocked（如果有pool service）
-                                        if jwt:
-                                            try:
-                                                # 通知账号池服务该账号已被封
-                                                async with httpx.AsyncClient(timeout=5.0) as notify_client:
-                                                    await notify_client.post(
-                                                        "http://localhost:8019/api/accounts/mark_blocked",
-                                                        json={"jwt_token": jwt[:50]}  # 只传部分token作为标识
-                                                    )
-                                            except Exception as e:
-                                                logger.warning(f"无法通知账号池服务: {e}")
-
-                                        # 强制获取新账号，不再使用当前账号
-                                        try:
-                                            new_jwt = await acquire_pool_or_anonymous_token(force_new=True)
-                                            if new_jwt:
-                                                jwt = new_jwt
-                                                logger.info("✅ 获取新账号token成功（账号被封后）")
-                                                # 跳出proxy循环，进入下一个attempt
-                                                break
-                                        except Exception as e:
-                                            logger.error(f"获取新账号失败: {e}")
-
-                                        # 如果无法获取新账号或已是最后一次尝试，返回错误
-                                        if attempt >= max_attempts - 1:
-                                            yield f"data: {{\"error\": \"Account blocked and unable to get new account\"}}\\n\\n"
-                                            yield "data: [DONE]\\n\\n"
-                                            return
-                                        else:
-                                            break  # 跳出proxy循环，用新账号重试
-
-                                    # 429 且包含配额信息时，申请匿名token后重试
-                                    elif response.status_code == 429 and (
-                                            ("No remaining quota" in error_content) or
-                                            ("No AI requests remaining" in error_content)
-                                    ):
-                                        logger.warning(
-                                            f"Warp API 返回 429 (额度用尽, SSE 代理, attempt {attempt + 1})。尝试强制获取新账号token...")
-                                        try:
-                                            # force_new=True 强制获取新账号
-                                            new_jwt = await acquire_pool_or_anonymous_token(force_new=True)
-                                            if new_jwt:
-                                                jwt = new_jwt
-                                                logger.info("✅ 获取新账号token成功，将在下一轮重试")
-                                                # 跳出proxy循环，进入下一个attempt
-                                                break
-                                        except Exception as e:
-                                            logger.error(f"获取新token失败: {e}")
-
-                                    # 其他HTTP错误，记录并继续尝试
-                                    logger.error(
-                                        f"Warp API HTTP error {response.status_code} (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {error_content[:300]}")
-                                    last_error = f"HTTP {response.status_code}: {error_content[:100]}"
-
-                                    if proxy_attempt < max_proxy_retries - 1:
-                                        continue  # 继续下一个proxy_attempt
-
-                                    # 当前attempt的所有代理都失败，准备下一轮
-                                    if attempt < max_attempts - 1:
-                                        logger.info(f"第 {attempt + 1} 轮所有代理失败，准备下一轮...")
-                                        break  # 跳出proxy循环
-
-                                    # 真正失败了，返回错误
-                                    yield f"data: {{\"error\": \"HTTP {response.status_code} after {max_attempts} attempts\"}}\n\n"
-                                    yield "data: [DONE]\n\n"
-                                    return
-
-                                # 请求成功，处理SSE流
-                                try:
-                                    logger.info(f"✅ Warp API SSE连接已建立: {warp_url}")
-                                    logger.info(f"📦 请求字节数: {len(protobuf_bytes)}")
-                                    logger.info(f"🔄 使用代理: {proxy_config if proxy_config else '直连'}")
-                                    logger.info(
-                                        f"🔢 尝试次数: attempt={attempt + 1}/{max_attempts}, proxy={proxy_attempt + 1}/{max_proxy_retries}")
-                                except Exception:
-                                    pass
-
-                                current_data = ""
-                                event_no = 0
-                                has_events = False
-
-                                async for line in response.aiter_lines():
-                                    if line.startswith("data:"):
-                                        payload = line[5:].strip()
-                                        if not payload:
-                                            continue
-                                        if payload == "[DONE]":
-                                            successful = True
-                                            break
-                                        current_data += payload
-                                        continue
-
-                                    if (line.strip() == "") and current_data:
-                                        raw_bytes = _parse_payload_bytes(current_data)
-                                        current_data = ""
-                                        if raw_bytes is None:
-                                            continue
-
-                                        try:
-                                            event_data = protobuf_to_dict(raw_bytes,
-                                                                          "warp.multi_agent.v1.ResponseEvent")
-                                            has_events = True
-                                        except Exception:
-                                            continue
-
-                                        def _get(d: Dict[str, Any], *names: str) -> Any:
-                                            for n in names:
-                                                if isinstance(d, dict) and n in d:
-                                                    return d[n]
-                                            return None
-
-                                        event_type = "UNKNOWN_EVENT"
-                                        if isinstance(event_data, dict):
-                                            if "init" in event_data:
-                                                event_type = "INITIALIZATION"
-                                            else:
-                                                client_actions = _get(event_data, "client_actions", "clientActions")
-                                                if isinstance(client_actions, dict):
-                                                    actions = _get(client_actions, "actions", "Actions") or []
-                                                    event_type = f"CLIENT_ACTIONS({len(actions)})" if actions else "CLIENT_ACTIONS_EMPTY"
-                                                elif "finished" in event_data:
-                                                    event_type = "FINISHED"
-
-                                        event_no += 1
-                                        try:
-                                            logger.info(f"🔄 SSE Event #{event_no}: {event_type} ---- {event_data}")
-                                        except Exception:
-                                            pass
-
-                                        out = {"event_number": event_no, "event_type": event_type,
-                                               "parsed_data": event_data}
-                                        try:
-                                            chunk = json.dumps(out, ensure_ascii=False)
-                                        except Exception:
-                                            logger.error(f"无法将事件数据转换为JSON: {out}")
-                                            continue
-
-                                        yield f"data: {chunk}\n\n"
-
-                                # 检查是否成功接收到事件
-                                if has_events or successful:
-                                    try:
-                                        logger.info("=" * 60)
-                                        logger.info("📊 SSE STREAM SUMMARY (代理)")
-                                        logger.info("=" * 60)
-                                        logger.info(f"📈 Total Events Forwarded: {event_no}")
-                                        logger.info(f"🔄 使用代理: {proxy_config if proxy_config else '直连'}")
-                                        logger.info(
-                                            f"✅ 成功完成 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries})")
-                                        logger.info("=" * 60)
-                                    except Exception:
-                                        pass
-
-                                    yield "data: [DONE]\n\n"
-                                    return  # 成功完成，直接返回
-                                else:
-                                    # 没有收到任何事件，视为失败
-                                    logger.warning(
-                                        f"未收到任何事件，视为失败 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries})")
-                                    last_error = "No events received"
-                                    if proxy_attempt < max_proxy_retries - 1:
-                                        continue
-
-                    except (httpx.ConnectError, httpx.ProxyError, httpx.RemoteProtocolError) as ssl_error:
-                        last_error = f"SSL/Proxy error: {str(ssl_error)}"
-                        logger.warning(
-                            f"SSE端点 SSL/代理错误 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {ssl_error}"
-                        )
-                        if proxy_attempt < max_proxy_retries - 1:
-                            continue  # 继续下一个proxy_attempt
-
-                        # 当前attempt的所有代理都失败
-                        if attempt < max_attempts - 1:
-                            logger.info(f"第 {attempt + 1} 轮所有代理因SSL/代理错误失败，尝试获取新token...")
-                            try:
-                                new_jwt = await acquire_pool_or_anonymous_token()
-                                if new_jwt:
-                                    jwt = new_jwt
-                                    logger.info("获取新token成功，将在下一轮重试")
-                            except Exception as token_error:
-                                logger.error(f"获取新token失败: {token_error}")
-                            break  # 跳出proxy循环，进入下一个attempt
-
-                    except httpx.ReadTimeout as timeout_error:
-                        last_error = f"Timeout: {str(timeout_error)}"
-                        logger.warning(
-                            f"SSE端点超时 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {last_error}"
-                        )
-                        if proxy_attempt < max_proxy_retries - 1:
+                    async for event in stream_warp_events(protobuf_bytes):
+                        try:
+                            chunk = json.dumps(event, ensure_ascii=False)
+                        except Exception:
+                            logger.error(f"无法将事件数据转换为JSON: {event}")
                             continue
+                        yield f"data: {chunk}\n\n"
+                except WarpStreamError as e:
+                    yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+                finally:
+                    trace.finish("bridge.send_stream_sse")
+                yield "data: [DONE]\n\n"
 
-                    except httpx.WriteTimeout as write_timeout:
-                        last_error = f"Write timeout: {str(write_timeout)}"
-                        logger.warning(
-                            f"SSE端点写入超时 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {last_error}"
-                        )
-                        if proxy_attempt < max_proxy_retries - 1:
-                            continue
+        return StreamingResponse(_agen(), media_type="text/event-stream",
+                                 headers={
+                                     "Cache-Control": "no-cache",
+                                     "Connection": "keep-alive",
+                                     "X-Accel-Buffering": "no",  # 禁用nginx缓冲
+                                     REQUEST_ID_HEADER: trace.request_id,
+                                 })
 
-                    except Exception as e:
-                        last_error = f"Unknown error: {str(e)}"
-                        logger.error(
-                            f"SSE端点未知错误 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {e}",
-                            exc_info=True)
-                        if proxy_attempt < max_proxy_retries - 1:
-                            continue
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        error_details = {"error": str(e), "error_type": type(e).__name__, "traceback": traceback.format_exc()}
+        logger.error(f"Warp SSE转发端点错误: {e}")
+        raise HTTPException(500, detail=error_details)
 
-            # 所有尝试都失败了
-            logger.error(f"SSE端点在 {max_attempts} 轮尝试（每轮 {max_proxy_retries} 个代理）后完全失败")
-            yield f"data: {{\"error\": \"All {max_attempts} attempts failed. Last error: {last_error}\"}}\n\n"
-            yield "data: [DONE]\n\n"
-            return
 
-        return StreamingResponse(_agen(), media_type="text/event-stream",
+@app.post("/api/warp/send_stream_frames")
+async def send_to_warp_api_stream_frames(http_request: Request):
+    """
+    与 send_stream_sse 相同，但以长度前缀的原始 protobuf 帧转发上游事件（见 core/framing.py）。
+
+    请求体可以是 EncodeRequest JSON，也可以是 content-type 为 application/x-protobuf 的 Request 字节。
+    """
+    from fastapi.responses import StreamingResponse
+    from ..warp.api_client import WarpStreamError, stream_warp_event_bytes
+
+    trace = _start_bridge_trace(http_request)
+    try:
+        if http_request.headers.get("content-type", "").startswith(FRAME_MEDIA_TYPE):
+            protobuf_bytes = await http_request.body()
+            if not protobuf_bytes:
+                raise HTTPException(400, "数据包不能为空")
+        else:
+            try:
+                request = EncodeRequest(**(await http_request.json()))
+            except Exception as e:
+                raise HTTPException(422, f"请求体无效: {e}")
+            actual_data = request.get_data()
+            if not actual_data:
+                raise HTTPException(400, "数据包不能为空")
+            protobuf_bytes = encode_request_packet(actual_data, request.message_type)
+
+        async def _agen():
+            use_trace(trace)
+            with BRIDGE_INFLIGHT.labels(endpoint="frames").track_inprogress():
+                try:
+                    async for raw_bytes in stream_warp_event_bytes(protobuf_bytes):
+                        yield encode_frame(FRAME_EVENT, raw_bytes)
+                except WarpStreamError as e:
+                    yield encode_frame(FRAME_ERROR, str(e).encode("utf-8"))
+                    return
+                finally:
+                    trace.finish("bridge.send_stream_frames")
+                yield encode_frame(FRAME_DONE)
+
+        return StreamingResponse(_agen(), media_type=FRAME_MEDIA_TYPE,
                                  headers={
                                      "Cache-Control": "no-cache",
                                      "Connection": "keep-alive",
-                                     "X-Accel-Buffering": "no"  # 禁用nginx缓冲
+                                     "X-Accel-Buffering": "no",  # 禁用nginx缓冲
+                                     REQUEST_ID_HEADER: trace.request_id,
                                  })
 
     except HTTPException:
@@ -800,7 +557,7 @@ async def send_to_warp_api_stream_sse(request: EncodeRequest):
     except Exception as e:
         import traceback
         error_details = {"error": str(e), "error_type": type(e).__name__, "traceback": traceback.format_exc()}
-        logger.error(f"Warp SSE转发端点错误: {e}")
+        logger.error(f"Warp帧转发端点错误: {e}")
         raise HTTPException(500, detail=error_details)
 
 
@@ -16,14 +16,33 @@ load_dotenv()
 SCRIPT_DIR = pathlib.Path(__file__).resolve().parent.parent.parent
 PROTO_DIR = SCRIPT_DIR / "proto"
 LOGS_DIR = SCRIPT_DIR / "logs"
+# 编译后的 FileDescriptorSet 缓存目录（按 .proto 内容哈希命名）
+PROTO_CACHE_DIR = pathlib.Path(os.getenv("WARP_PROTO_CACHE_DIR") or SCRIPT_DIR / ".proto_cache")
 
 # API configuration
-WARP_URL = "https://app.warp.dev/ai/multi-agent"
+# 可指向本地模拟服务（test/mock_warp_server.py）做离线压测
+WARP_URL = os.getenv("WARP_URL", "https://app.warp.dev/ai/multi-agent")
 
 # Environment variables with defaults
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8002"))
 WARP_JWT = os.getenv("WARP_JWT")
+# 每次取 JWT 时 .env 中的值是否覆盖进程环境变量（设为 0 时以进程环境变量为准，如压测时注入的假 token）
+DOTENV_OVERRIDE = os.getenv("WARP_DOTENV_OVERRIDE", "1").strip().lower() not in ("0", "false", "no")
+
+# Logging configuration
+LOG_LEVEL = os.getenv("WARP_LOG_LEVEL", "INFO").strip().upper()
+# 单条日志中大对象（事件字典、响应体）的最大字符数
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("WARP_LOG_PAYLOAD_MAX", "2000"))
+
+# Tracing configuration
+# span 导出方式：""（关闭，仅传递请求 ID）、"jsonl"（写入本地文件）或 "otlp"（OTLP/HTTP JSON 收集器）
+TRACE_EXPORT = os.getenv("WARP_TRACE_EXPORT", "").strip().lower()
+TRACE_FILE = pathlib.Path(os.getenv("WARP_TRACE_FILE") or LOGS_DIR / "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("WARP_TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+
+# 上游原始流录制目录（为空表示关闭）：每个请求写入请求 protobuf 字节与带到达时间的原始 SSE 字节块
+CAPTURE_DIR = os.getenv("WARP_CAPTURE_DIR", "").strip() or None
 
 # Client headers configuration
 CLIENT_VERSION = "v0.2025.08.06.08.12.stable_02"
@@ -31,6 +50,13 @@ OS_CATEGORY = "Windows"
 OS_NAME = "Windows"
 OS_VERSION = "11 (26100)"
 
+# Upstream (Warp API) connection pool configuration
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("WARP_UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("WARP_UPSTREAM_MAX_KEEPALIVE", "10"))
+UPSTREAM_MAX_STREAMS_PER_CONNECTION = int(os.getenv("WARP_UPSTREAM_MAX_STREAMS", "100"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("WARP_UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_IDLE_EXPIRY = float(os.getenv("WARP_UPSTREAM_IDLE_EXPIRY", "300"))
+
 # Protobuf field names for text detection
 TEXT_FIELD_NAMES = ("text", "prompt", "query", "content", "message", "input")
 PATH_HINT_BONUS = ("conversation", "query", "input", "user", "request", "delta")
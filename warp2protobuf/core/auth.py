@@ -15,7 +15,7 @@ import httpx
 import asyncio
 from dotenv import load_dotenv, set_key
 
-from ..config.settings import REFRESH_TOKEN_B64, REFRESH_URL, CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION
+from ..config.settings import REFRESH_TOKEN_B64, REFRESH_URL, CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, DOTENV_OVERRIDE
 from .logging import logger, log
 from .proxy_manager import AsyncProxyManager  # 新增: 导入代理管理器
 
@@ -196,7 +196,7 @@ async def check_and_refresh_token() -> bool:
 
 async def get_valid_jwt() -> str:
     from dotenv import load_dotenv as _load
-    _load(override=True)
+    _load(override=DOTENV_OVERRIDE)
     jwt = os.getenv("WARP_JWT")
     if not jwt:
         logger.info("No JWT token found, attempting to refresh...")
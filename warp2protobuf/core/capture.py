@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游原始流录制（WARP_CAPTURE_DIR）
+
+开启后每个成功建立的上游流写入一个 .jsonl 录制文件：
+    {"type": "request", "url": ..., "request_id": ..., "started": <unix 秒>, "request": <base64 请求 protobuf>}
+    {"type": "chunk", "t": <相对收到响应头的秒数>, "data": <base64 原始 SSE 字节块>}
+    ...
+    {"type": "end", "t": ..., "chunks": n, "bytes": n, "error": null}
+字节块在内存中累积，流结束（或调用方 close()）时一次写入，不在事件循环中逐块做文件 I/O。
+用 test/replay_capture.py 回放。
+"""
+import base64
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from ..config.settings import CAPTURE_DIR
+from .logging import logger
+from .tracing import current_request_id
+
+
+class StreamCapture:
+    """单个上游流的录制"""
+
+    __slots__ = ("path", "_header", "_chunks", "_started", "_closed")
+
+    def __init__(self, path: str, request_bytes: bytes, url: str):
+        self.path = path
+        self._started = time.perf_counter()
+        self._header = {
+            "type": "request",
+            "url": url,
+            "request_id": current_request_id(),
+            "started": time.time(),
+            "request": base64.b64encode(request_bytes).decode("ascii"),
+        }
+        self._chunks: List[Dict[str, Any]] = []
+        self._closed = False
+
+    async def tee(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """原样转发字节块并记录到达时间"""
+        try:
+            async for chunk in chunks:
+                self._chunks.append({"t": time.perf_counter() - self._started, "data": chunk})
+                yield chunk
+        except BaseException as e:
+            self.close(error=f"{type(e).__name__}: {e}")
+            raise
+        self.close()
+
+    def close(self, error: Optional[str] = None) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        total = sum(len(c["data"]) for c in self._chunks)
+        lines = [json.dumps(self._header)]
+        lines.extend(json.dumps({"type": "chunk", "t": round(c["t"], 6),
+                                 "data": base64.b64encode(c["data"]).decode("ascii")}) for c in self._chunks)
+        lines.append(json.dumps({"type": "end", "t": round(time.perf_counter() - self._started, 6),
+                                 "chunks": len(self._chunks), "bytes": total, "error": error}))
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            logger.info(f"📼 上游流已录制: {self.path} ({len(self._chunks)} 块, {total} 字节)")
+        except OSError as e:
+            logger.warning(f"写入录制文件失败 {self.path}: {e}")
+
+
+def open_capture(request_bytes: bytes, url: str) -> Optional[StreamCapture]:
+    """WARP_CAPTURE_DIR 未设置时返回 None"""
+    if not CAPTURE_DIR:
+        return None
+    try:
+        os.makedirs(CAPTURE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"无法创建录制目录 {CAPTURE_DIR}: {e}")
+        return None
+    request_id = current_request_id()
+    parts = [time.strftime("%Y%m%d_%H%M%S"), os.urandom(3).hex()]
+    if request_id != "-":
+        parts.insert(1, "".join(c for c in request_id if c.isalnum() or c in "-_")[:64])
+    return StreamCapture(os.path.join(CAPTURE_DIR, "_".join(parts) + ".jsonl"), request_bytes, url)
+
+
+def load_capture(path: str) -> Dict[str, Any]:
+    """读取录制文件：{"request": bytes, "chunks": [(t, bytes), ...], "url": ..., "end": {...}}"""
+    result: Dict[str, Any] = {"chunks": [], "end": None}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            kind = item.get("type")
+            if kind == "request":
+                result.update(url=item.get("url"), request_id=item.get("request_id"), started=item.get("started"),
+                              request=base64.b64decode(item.get("request") or ""))
+            elif kind == "chunk":
+                result["chunks"].append((float(item["t"]), base64.b64decode(item["data"])))
+            elif kind == "end":
+                result["end"] = item
+    return result
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ResponseEvent 快速解析
+
+把上游 ResponseEvent 直接解析为类型化消息，只提取流式转换需要的内容（文本增量、工具调用、
+初始化 ID、结束原因），不构建 MessageToDict 的完整字典。完整字典仅在调试/监控需要时通过
+ResponseEventRecord.to_dict() 按需生成。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.protobuf.json_format import MessageToDict
+
+from .protobuf import ensure_proto_runtime, msg_cls
+
+RESPONSE_EVENT_TYPE = "warp.multi_agent.v1.ResponseEvent"
+
+# 事件类型（ResponseEvent.type oneof）
+EVENT_INIT = "init"
+EVENT_CLIENT_ACTIONS = "client_actions"
+EVENT_FINISHED = "finished"
+EVENT_UNKNOWN = "unknown"
+
+# parts 中的条目类型
+PART_TEXT = 0  # (PART_TEXT, text)
+PART_TOOL_CALL = 1  # (PART_TOOL_CALL, (tool_call_id 或 None, name, args_dict))
+
+# 只对这些 action 提取内容；事务控制动作直接跳过
+_TEXT_ACTIONS = ("update_task_message", "append_to_message_content")
+
+
+class ResponseEventRecord:
+    """单个 ResponseEvent 的精简表示，parts 按事件内出现顺序保存文本增量与工具调用"""
+
+    __slots__ = ("kind", "parts", "conversation_id", "request_id", "task_id",
+                 "finish_reason", "error", "_raw", "_dict")
+
+    def __init__(self, kind: str = EVENT_UNKNOWN):
+        self.kind = kind
+        self.parts: List[Tuple[int, Any]] = []
+        self.conversation_id: Optional[str] = None
+        self.request_id: Optional[str] = None
+        self.task_id: Optional[str] = None
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[str] = None
+        self._raw: Optional[bytes] = None
+        self._dict: Optional[Dict[str, Any]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.kind == EVENT_FINISHED
+
+    @property
+    def text(self) -> str:
+        """事件内所有文本增量拼接后的结果"""
+        return "".join(p[1] for p in self.parts if p[0] == PART_TEXT)
+
+    @property
+    def tool_calls(self) -> List[Tuple[Optional[str], str, Dict[str, Any]]]:
+        return [p[1] for p in self.parts if p[0] == PART_TOOL_CALL]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """与 protobuf_to_dict 相同的完整字典（按需构建并缓存）"""
+        if self._dict is None:
+            if self._raw is None:
+                return {}
+            from .protobuf_utils import protobuf_to_dict
+            self._dict = protobuf_to_dict(self._raw, RESPONSE_EVENT_TYPE)
+        return self._dict
+
+    def __repr__(self) -> str:
+        return (f"ResponseEventRecord(kind={self.kind!r}, parts={self.parts!r}, "
+                f"finish_reason={self.finish_reason!r}, error={self.error!r})")
+
+
+def _message_parts_typed(record: ResponseEventRecord, message: Any, allow_tool_call: bool) -> None:
+    if allow_tool_call and message.WhichOneof("message") == "tool_call":
+        tool_call = message.tool_call
+        if tool_call.WhichOneof("tool") == "call_mcp_tool" and tool_call.call_mcp_tool.name:
+            call_mcp = tool_call.call_mcp_tool
+            args = MessageToDict(call_mcp.args) if call_mcp.HasField("args") else {}
+            record.parts.append((PART_TOOL_CALL, (tool_call.tool_call_id or None, call_mcp.name, args)))
+            return
+    text = message.agent_output.text
+    if text:
+        record.parts.append((PART_TEXT, text))
+
+
+def parse_event_record(payload: bytes) -> ResponseEventRecord:
+    """解析 ResponseEvent 字节为 ResponseEventRecord；解析失败时抛出底层异常"""
+    ensure_proto_runtime()
+    event = msg_cls(RESPONSE_EVENT_TYPE)()
+    event.ParseFromString(payload)
+
+    record = ResponseEventRecord(event.WhichOneof("type") or EVENT_UNKNOWN)
+    record._raw = payload
+
+    if record.kind == EVENT_CLIENT_ACTIONS:
+        for action in event.client_actions.actions:
+            name = action.WhichOneof("action")
+            if name in _TEXT_ACTIONS:
+                message = getattr(action, name).message
+                text = message.agent_output.text
+                if text:
+                    record.parts.append((PART_TEXT, text))
+            elif name == "add_messages_to_task":
+                # 只向已有任务追加消息的响应也带回 task_id（与 create_task 一样用于更新会话的基线任务）
+                record.task_id = action.add_messages_to_task.task_id or record.task_id
+                for message in action.add_messages_to_task.messages:
+                    _message_parts_typed(record, message, allow_tool_call=True)
+            elif name == "create_task":
+                record.task_id = action.create_task.task.id or record.task_id
+    elif record.kind == EVENT_INIT:
+        record.conversation_id = event.init.conversation_id or None
+        record.request_id = event.init.request_id or None
+    elif record.kind == EVENT_FINISHED:
+        finished = event.finished
+        record.finish_reason = finished.WhichOneof("reason")
+        if record.finish_reason == "internal_error":
+            record.error = finished.internal_error.message or "Unknown error"
+    return record
+
+
+def _get(d: Dict[str, Any], *names: str) -> Any:
+    for name in names:
+        if name in d:
+            return d[name]
+    return None
+
+
+def record_from_dict(event_data: Dict[str, Any]) -> ResponseEventRecord:
+    """由 protobuf_to_dict 风格的字典（snake_case 或 camelCase）构建 ResponseEventRecord"""
+    if "init" in event_data:
+        kind = EVENT_INIT
+    elif "finished" in event_data:
+        kind = EVENT_FINISHED
+    elif _get(event_data, "client_actions", "clientActions") is not None:
+        kind = EVENT_CLIENT_ACTIONS
+    else:
+        kind = EVENT_UNKNOWN
+    record = ResponseEventRecord(kind)
+    record._dict = event_data
+
+    client_actions = _get(event_data, "client_actions", "clientActions")
+    if isinstance(client_actions, dict):
+        for action in _get(client_actions, "actions", "Actions") or []:
+            if "rollback_transaction" in action or "begin_transaction" in action:
+                continue
+            for msg_data in (_get(action, "update_task_message", "updateTaskMessage"),
+                             _get(action, "append_to_message_content", "appendToMessageContent")):
+                if isinstance(msg_data, dict):
+                    message = msg_data.get("message", {})
+                    agent_output = _get(message, "agent_output", "agentOutput") or {}
+                    text = agent_output.get("text", "")
+                    if text:
+                        record.parts.append((PART_TEXT, text))
+
+            messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
+            if isinstance(messages_data, dict):
+                record.task_id = _get(messages_data, "task_id", "taskId") or record.task_id
+                for message in messages_data.get("messages", []):
+                    tool_call = _get(message, "tool_call", "toolCall") or {}
+                    call_mcp = _get(tool_call, "call_mcp_tool", "callMcpTool") or {}
+                    if isinstance(call_mcp, dict) and call_mcp.get("name"):
+                        args = call_mcp.get("args", {}) or {}
+                        call_id = _get(tool_call, "tool_call_id", "toolCallId") or None
+                        record.parts.append((PART_TOOL_CALL, (call_id, call_mcp.get("name"), args)))
+                    else:
+                        agent_output = _get(message, "agent_output", "agentOutput") or {}
+                        text = agent_output.get("text", "")
+                        if text:
+                            record.parts.append((PART_TEXT, text))
+
+            create_task = _get(action, "create_task", "createTask")
+            if isinstance(create_task, dict):
+                task = create_task.get("task") or {}
+                record.task_id = task.get("id") or record.task_id
+
+    init = event_data.get("init")
+    if isinstance(init, dict):
+        record.conversation_id = _get(init, "conversation_id", "conversationId") or None
+        record.request_id = _get(init, "request_id", "requestId") or None
+
+    finished = event_data.get("finished")
+    if isinstance(finished, dict):
+        for reason in ("other", "done", "max_token_limit", "quota_limit", "context_window_exceeded",
+                       "llm_unavailable", "internal_error"):
+            if reason in finished:
+                record.finish_reason = reason
+                break
+        if "internal_error" in finished:
+            record.error = (finished.get("internal_error") or {}).get("message", "Unknown error")
+    return record
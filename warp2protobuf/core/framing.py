@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+长度前缀二进制帧
+
+bridge 与 OpenAI 兼容层之间的事件流格式：每帧 = 1 字节类型 + 4 字节大端长度 + 负载。
+事件帧的负载为上游 ResponseEvent 的原始 protobuf 字节，不做任何 JSON 转换。
+"""
+import struct
+from typing import List, Tuple
+
+FRAME_MEDIA_TYPE = "application/x-protobuf"
+
+FRAME_EVENT = 0  # 负载: warp.multi_agent.v1.ResponseEvent 字节
+FRAME_ERROR = 1  # 负载: UTF-8 错误信息
+FRAME_DONE = 2  # 负载为空，表示流正常结束
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+_HEADER = struct.Struct(">BI")
+HEADER_SIZE = _HEADER.size
+
+
+def encode_frame(kind: int, payload: bytes = b"") -> bytes:
+    """编码单个帧"""
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+class FrameDecoder:
+    """增量帧解码器：feed 任意切分的字节块，返回其中已完整的帧"""
+
+    __slots__ = ("_buf",)
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        buf = self._buf
+        buf += data
+        frames: List[Tuple[int, bytes]] = []
+        pos = 0
+        n = len(buf)
+        while n - pos >= HEADER_SIZE:
+            kind, length = _HEADER.unpack_from(buf, pos)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"frame too large: {length} bytes")
+            start = pos + HEADER_SIZE
+            end = start + length
+            if end > n:
+                break
+            frames.append((kind, bytes(buf[start:end])))
+            pos = end
+        if pos:
+            del buf[:pos]
+        return frames
+
+    @property
+    def pending(self) -> int:
+        """尚未组成完整帧的缓冲字节数"""
+        return len(self._buf)
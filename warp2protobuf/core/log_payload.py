@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志中大对象的延迟、有界格式化
+
+warp2protobuf 与 protobuf2openai 两个 logger 共用；本模块没有副作用（不创建处理器或日志目录）。
+"""
+import reprlib
+from typing import Any, Optional
+
+from ..config.settings import LOG_PAYLOAD_MAX_CHARS
+
+# 有界的 repr：深层/超长的对象只渲染前若干项
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 6
+_payload_repr.maxdict = 16
+_payload_repr.maxlist = 16
+_payload_repr.maxstring = 400
+_payload_repr.maxother = 400
+
+
+class LazyPayload:
+    """延迟格式化的大对象：只有日志记录真正输出时才渲染，且长度受 WARP_LOG_PAYLOAD_MAX 限制"""
+
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj: Any, limit: Optional[int] = None):
+        self.obj = obj
+        self.limit = LOG_PAYLOAD_MAX_CHARS if limit is None else limit
+
+    def __str__(self) -> str:
+        obj = self.obj
+        if isinstance(obj, (bytes, bytearray)):
+            obj = bytes(obj[:self.limit]).decode("utf-8", "replace")
+        text = obj if isinstance(obj, str) else _payload_repr.repr(obj)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(+{len(text) - self.limit} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+def payload(obj: Any, limit: Optional[int] = None) -> LazyPayload:
+    """用作日志参数：logger.debug("event: %s", payload(event_data))"""
+    return LazyPayload(obj, limit)
@@ -4,14 +4,22 @@
 Logging system for Warp API server
 
 Provides comprehensive logging with file rotation and console output.
+Records are handed to a QueueListener thread, so file and console writes
+never block the event loop.
 """
+import atexit
 import logging
-import os
+import queue
 import shutil
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
-from ..config.settings import LOGS_DIR
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
 
+from ..config.settings import LOGS_DIR, LOG_LEVEL
+from .log_payload import LazyPayload, payload  # noqa: F401  (供 logger 使用方一并导入)
+from .tracing import RequestIdFilter
+
+_listener: Optional[QueueListener] = None
 
 def backup_existing_log():
     """Backup existing log file with timestamp"""
@@ -29,43 +37,78 @@ def backup_existing_log():
             print(f"Warning: Could not backup log file: {e}")
 
 
-def setup_logging():
-    """Configure comprehensive logging system"""
-    LOGS_DIR.mkdir(exist_ok=True)
-
-    backup_existing_log()
-    
-    logger = logging.getLogger('warp_api')
-    logger.setLevel(logging.DEBUG)
-    
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    
+def _build_handlers(log_file_name: str) -> List[logging.Handler]:
     file_handler = RotatingFileHandler(
-        LOGS_DIR / 'warp_api.log',
+        LOGS_DIR / log_file_name,
         maxBytes=10*1024*1024,
         backupCount=5,
         encoding='utf-8'
     )
     file_handler.setLevel(logging.DEBUG)
-    
+
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    
+
     formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(funcName)s:%(lineno)d - %(message)s'
     )
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
+    return [file_handler, console_handler]
+
+
+def _stop_listener() -> None:
+    """停止后台写日志线程（会先写完队列中的记录）并关闭其处理器"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    try:
+        listener.stop()
+    except Exception:
+        pass
+    for handler in listener.handlers:
+        try:
+            handler.close()
+        except Exception:
+            pass
+
+
+def _install_handlers(target_logger: logging.Logger, handlers: List[logging.Handler]) -> None:
+    """清除旧处理器，改为 QueueHandler -> QueueListener(handlers)"""
+    global _listener
+    for handler in target_logger.handlers[:]:
+        try:
+            target_logger.removeHandler(handler)
+            handler.close()
+        except Exception:
+            pass
+    _stop_listener()
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    target_logger.addHandler(queue_handler)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_logging():
+    """Configure comprehensive logging system"""
+    LOGS_DIR.mkdir(exist_ok=True)
+
+    backup_existing_log()
     
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger = logging.getLogger('warp_api')
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _install_handlers(logger, _build_handlers('warp_api.log'))
     
     return logger
 
 
 # Initialize logger
 logger = setup_logging()
+atexit.register(_stop_listener)
 
 
 def log(*a): 
@@ -82,40 +125,10 @@ def set_log_file(log_file_name: str) -> None:
 
     global logger
     target_logger = logging.getLogger('warp_api')
-
-    for handler in target_logger.handlers[:]:
-        try:
-            target_logger.removeHandler(handler)
-            try:
-                handler.close()
-            except Exception:
-                pass
-        except Exception:
-            pass
-
-    file_handler = RotatingFileHandler(
-        LOGS_DIR / log_file_name,
-        maxBytes=10*1024*1024,
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    target_logger.addHandler(file_handler)
-    target_logger.addHandler(console_handler)
-
+    _install_handlers(target_logger, _build_handlers(log_file_name))
     logger = target_logger
 
     try:
         logger.info(f"Logging redirected to: {LOGS_DIR / log_file_name}")
     except Exception:
-        pass 
\ No newline at end of file
+        pass
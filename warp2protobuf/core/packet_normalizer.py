@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求数据包的单遍规范化
+
+把编码前的各项处理合并为一次遍历：
+- 与 schema_sanitizer._deep_clean 相同的清理：字符串去除首尾空白，删除空值（None、空串、空列表、空对象）
+- server_message_data 对象编码为 Base64URL 字符串（与 _encode_smd_inplace 相同）
+- mcp_context.tools[*] 的 input_schema 清洗（与 sanitize_mcp_input_schema_in_packet 相同）
+
+写时复制：没有变化的子树原样复用，只有发生变化的 dict / list 才会新建（浅拷贝），
+不修改传入的数据包。结果与 sanitize_mcp_input_schema_in_packet + _encode_smd_inplace 等价。
+"""
+from itertools import islice
+from typing import Any, Dict, List
+
+from .schema_sanitizer import _deep_clean, _is_empty_value, sanitize_mcp_tool
+from .server_message_data import encode_server_message_data
+
+_SMD_KEYS = ("server_message_data", "serverMessageData")
+_DROP = object()
+
+
+def _encode_smd(value: Dict[str, Any]) -> Any:
+    try:
+        return encode_server_message_data(uuid=value.get("uuid"), seconds=value.get("seconds"),
+                                          nanos=value.get("nanos"))
+    except Exception:
+        return value
+
+
+def _normalize(value: Any) -> Any:
+    """返回规范化后的值；清理后为空时返回 _DROP"""
+    t = type(value)
+    if t is str:
+        value = value.strip()  # 无需去除时返回同一对象
+        return value if value else _DROP
+    if t is dict:
+        value = _normalize_dict(value)
+    elif t is list:
+        value = _normalize_list(value)
+    elif value is None:
+        return _DROP
+    elif isinstance(value, (str, dict, list)):  # 子类走通用路径
+        value = _deep_clean(value)
+    return _DROP if _is_empty_value(value) else value
+
+
+def _normalize_dict(d: Dict[str, Any]) -> Dict[str, Any]:
+    out = None  # 第一次出现变化时才复制此前的键
+    for i, (k, v) in enumerate(d.items()):
+        nv = _normalize(v)
+        if nv is not _DROP and k in _SMD_KEYS and type(nv) is dict:
+            nv = _encode_smd(nv)
+        if out is None:
+            if nv is v:
+                continue
+            out = dict(islice(d.items(), i))
+        if nv is not _DROP:
+            out[k] = nv
+    return d if out is None else out
+
+
+def _normalize_list(items: List[Any]) -> List[Any]:
+    out = None
+    for i, v in enumerate(items):
+        nv = _normalize(v)
+        if out is None:
+            if nv is v:
+                continue
+            out = items[:i]
+        if nv is not _DROP:
+            out.append(nv)
+    return items if out is None else out
+
+
+def normalize_request_packet(packet: Dict[str, Any]) -> Dict[str, Any]:
+    """返回规范化后的数据包（可能与传入对象共享未变化的子树）"""
+    packet = _normalize_dict(packet)
+    mcp_ctx = packet.get("mcp_context")
+    if isinstance(mcp_ctx, dict) and isinstance(mcp_ctx.get("tools"), list):
+        tools = [sanitize_mcp_tool(t) if isinstance(t, dict) else t for t in mcp_ctx["tools"]]
+        packet = dict(packet)
+        packet["mcp_context"] = {**mcp_ctx, "tools": tools}
+    return packet
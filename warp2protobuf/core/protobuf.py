@@ -5,22 +5,26 @@ Protobuf runtime for Warp API
 
 Handles protobuf compilation, message creation, and request building.
 """
+import hashlib
+import os
 import pathlib
 import tempfile
 import uuid
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from google.protobuf import descriptor_pool, descriptor_pb2
 from google.protobuf.descriptor import FieldDescriptor as FD
 from google.protobuf.message_factory import GetMessageClass
 
 from .logging import logger, log
-from ..config.settings import PROTO_DIR, CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, TEXT_FIELD_NAMES, \
+from ..config.settings import PROTO_DIR, PROTO_CACHE_DIR, CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, TEXT_FIELD_NAMES, \
     PATH_HINT_BONUS
 
 # Global protobuf state
 _pool: Optional[descriptor_pool.DescriptorPool] = None
 ALL_MSGS: List[str] = []
+# full_name -> message class
+_msg_classes: Dict[str, Any] = {}
 
 
 def _find_proto_files(root: pathlib.Path) -> List[str]:
@@ -101,22 +105,71 @@ def _load_pool_from_descset(descset: bytes):
         for m in fd.message_type:
             walk(m, pkg)
     _pool, ALL_MSGS = pool, names
+    _msg_classes.clear()
     log(f"proto loaded: {len(ALL_MSGS)} message type(s)")
 
 
+def _proto_digest(proto_files: List[str], root: pathlib.Path) -> str:
+    """所选 .proto 列表 + 目录下所有 .proto 内容（含被 import 的文件）的哈希"""
+    h = hashlib.sha256()
+    for f in proto_files:
+        h.update(f"select:{pathlib.Path(f).name}\n".encode("utf-8"))
+    for path in sorted(root.rglob("*.proto")):
+        h.update(f"file:{path.relative_to(root).as_posix()}\n".encode("utf-8"))
+        h.update(path.read_bytes())
+    return h.hexdigest()[:32]
+
+
+def _read_cached_descset(cache_file: pathlib.Path) -> Optional[bytes]:
+    try:
+        return cache_file.read_bytes()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"读取描述符缓存失败 {cache_file}: {e}")
+        return None
+
+
+def _write_cached_descset(cache_file: pathlib.Path, descset: bytes) -> None:
+    """原子写入缓存（多个 worker 同时启动时不会读到半个文件）"""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".descset_", dir=str(cache_file.parent))
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(descset)
+        os.replace(tmp, cache_file)
+    except Exception as e:
+        logger.warning(f"写入描述符缓存失败 {cache_file}: {e}")
+
+
 def ensure_proto_runtime():
     if _pool is not None: 
         return
     files = _find_proto_files(PROTO_DIR)
     if not files:
         raise RuntimeError(f"No .proto found under {PROTO_DIR}")
+
+    cache_file = PROTO_CACHE_DIR / f"descset-{_proto_digest(files, PROTO_DIR)}.pb"
+    desc = _read_cached_descset(cache_file)
+    if desc is not None:
+        try:
+            _load_pool_from_descset(desc)
+            logger.debug(f"Loaded descriptor set from cache: {cache_file}")
+            return
+        except Exception as e:
+            logger.warning(f"描述符缓存无效，重新编译: {e}")
+
     desc = _build_descset(files, [str(PROTO_DIR)])
     _load_pool_from_descset(desc)
+    _write_cached_descset(cache_file, desc)
 
 
 def msg_cls(full: str):
-    desc = _pool.FindMessageTypeByName(full)  # type: ignore
-    return GetMessageClass(desc)
+    cls = _msg_classes.get(full)
+    if cls is None:
+        desc = _pool.FindMessageTypeByName(full)  # type: ignore
+        cls = _msg_classes[full] = GetMessageClass(desc)
+    return cls
 
 
 def _list_text_paths(desc, max_depth=6):
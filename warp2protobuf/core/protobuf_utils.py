@@ -8,10 +8,13 @@ Shared functions for protobuf encoding/decoding across the application.
 from typing import Any, Dict
 from fastapi import HTTPException
 from .logging import logger
+from .metrics import ENCODE_SECONDS
+from .tracing import span
 from .protobuf import ensure_proto_runtime, msg_cls
 from google.protobuf.json_format import MessageToDict
 from google.protobuf import struct_pb2
 from google.protobuf.descriptor import FieldDescriptor as _FD
+from .packet_normalizer import normalize_request_packet
 from .server_message_data import decode_server_message_data, encode_server_message_data
 
 
@@ -43,24 +46,33 @@ def protobuf_to_dict(protobuf_bytes: bytes, message_type: str) -> Dict:
 
 def dict_to_protobuf_bytes(data_dict: Dict, message_type: str = "warp.multi_agent.v1.Request") -> bytes:
     """字典转protobuf字节的包装函数"""
+    # 在转换阶段自动处理 server_message_data（对象 -> Base64URL 字符串）
+    return packet_to_protobuf_bytes(_encode_smd_inplace(data_dict), message_type)
+
+
+def packet_to_protobuf_bytes(packet: Dict, message_type: str = "warp.multi_agent.v1.Request") -> bytes:
+    """已经过 normalize_request_packet 的数据包直接填充并序列化（不再重复处理 server_message_data）"""
     ensure_proto_runtime()
-    
+
     try:
-        MessageClass = msg_cls(message_type)
-        message = MessageClass()
-        
-        # 在转换阶段自动处理 server_message_data（对象 -> Base64URL 字符串）
-        safe_dict = _encode_smd_inplace(data_dict)
-        
-        _populate_protobuf_from_dict(message, safe_dict, path="$")
-        
+        message = msg_cls(message_type)()
+        _populate_protobuf_from_dict(message, packet, path="$")
         return message.SerializeToString()
-    
+
     except Exception as e:
         logger.error(f"Protobuf编码失败: {e}")
         raise HTTPException(500, f"Protobuf编码失败: {e}")
 
 
+def encode_request_packet(data_dict: Dict, message_type: str = "warp.multi_agent.v1.Request") -> bytes:
+    """单遍规范化（清理、server_message_data、MCP 工具 schema）后将请求数据包编码为 protobuf 字节"""
+    with ENCODE_SECONDS.labels(path="dict").time():
+        with span("sanitize"):
+            packet = normalize_request_packet(data_dict)
+        with span("encode", path="dict"):
+            return packet_to_protobuf_bytes(packet, message_type)
+
+
 
 
 def _fill_google_value_dynamic(value_msg: Any, py_value: Any) -> None:
@@ -135,138 +147,207 @@ def _python_to_struct_value(py_value: Any) -> struct_pb2.Value:
 
 
 
-def _populate_protobuf_from_dict(proto_msg, data_dict: Dict, path: str = "$"):
-    for key, value in data_dict.items():
-        current_path = f"{path}.{key}"
-        if not hasattr(proto_msg, key):
-            logger.warning(f"忽略未知字段: {current_path}")
-            continue
-            
-        field = getattr(proto_msg, key)
-        fd = None
-        descriptor = getattr(proto_msg, "DESCRIPTOR", None)
-        if descriptor is not None:
-            fd = descriptor.fields_by_name.get(key)
-        
-        try:
-            if (
-                fd is not None
-                and fd.type == _FD.TYPE_MESSAGE
-                and fd.message_type is not None
-                and fd.message_type.full_name == "google.protobuf.Struct"
-                and isinstance(value, dict)
-            ):
-                _fill_google_struct_dynamic(field, value)
-                continue
-        except Exception as e:
-            logger.warning(f"处理 Struct 字段 {current_path} 失败: {e}")
+# 字段分派类型（每个消息描述符编译一次，见 _get_encode_plan）
+_KIND_SCALAR = 0
+_KIND_ENUM = 1
+_KIND_MESSAGE = 2
+_KIND_STRUCT = 3
+_KIND_MAP = 4
+_KIND_REPEATED_SCALAR = 5
+_KIND_REPEATED_ENUM = 6
+_KIND_REPEATED_MESSAGE = 7
+
+# map 值类型
+_MAP_SCALAR = 0
+_MAP_VALUE = 1
+_MAP_MESSAGE = 2
+
+_PRESENCE_KEYS = ("in_progress", "resume_conversation")
+
+# full_name -> {field_name: (kind, aux)}
+_encode_plans: Dict[str, Dict[str, tuple]] = {}
+
+
+def _get_encode_plan(descriptor: Any) -> Dict[str, tuple]:
+    """按消息描述符编译字段分派表（字段类型、枚举名称表、map 值类型），结果按 full_name 缓存"""
+    plan = _encode_plans.get(descriptor.full_name)
+    if plan is not None:
+        return plan
+
+    plan = {}
+    for fd in descriptor.fields:
+        repeated = fd.is_repeated if hasattr(fd, "is_repeated") else fd.label == _FD.LABEL_REPEATED
+        if fd.type == _FD.TYPE_MESSAGE and fd.message_type is not None:
+            mt = fd.message_type
+            if mt.GetOptions().map_entry:
+                value_desc = mt.fields_by_name.get("value")
+                if value_desc is not None and value_desc.type == _FD.TYPE_MESSAGE and value_desc.message_type is not None:
+                    map_kind = _MAP_VALUE if value_desc.message_type.full_name == "google.protobuf.Value" else _MAP_MESSAGE
+                else:
+                    map_kind = _MAP_SCALAR
+                plan[fd.name] = (_KIND_MAP, map_kind)
+            elif repeated:
+                plan[fd.name] = (_KIND_REPEATED_MESSAGE, None)
+            elif mt.full_name == "google.protobuf.Struct":
+                plan[fd.name] = (_KIND_STRUCT, None)
+            else:
+                plan[fd.name] = (_KIND_MESSAGE, None)
+        elif fd.type == _FD.TYPE_ENUM:
+            values_by_name = fd.enum_type.values_by_name if fd.enum_type is not None else {}
+            plan[fd.name] = (_KIND_REPEATED_ENUM if repeated else _KIND_ENUM, values_by_name)
+        else:
+            plan[fd.name] = (_KIND_REPEATED_SCALAR if repeated else _KIND_SCALAR, None)
 
-        if isinstance(field, struct_pb2.Struct) and isinstance(value, dict):
+    _encode_plans[descriptor.full_name] = plan
+    return plan
+
+
+def _resolve_enum_list(values: list, values_by_name: Any, path: str, key: str) -> list:
+    resolved_values = []
+    for item in values:
+        if isinstance(item, str):
+            ev = values_by_name.get(item)
+            if ev is not None:
+                resolved_values.append(ev.number)
+            else:
+                try:
+                    resolved_values.append(int(item))
+                except Exception:
+                    logger.warning(f"无法解析枚举值 '{item}' 为 {path}.{key}，已忽略")
+        else:
             try:
-                field.update(value)
-            except Exception as e:
-                logger.warning(f"填充Struct失败: {current_path}: {e}")
+                resolved_values.append(int(item))
+            except Exception:
+                logger.warning(f"无法转换枚举值 {item} 为整数: {path}.{key}")
+    return resolved_values
+
+
+def _set_message_field_fallback(proto_msg: Any, key: str, value: Any, path: str) -> None:
+    """消息字段收到标量值时沿用原有的直接赋值行为（失败仅记录警告）"""
+    try:
+        setattr(proto_msg, key, value)
+    except Exception as e:
+        logger.warning(f"设置字段 {path}.{key} 失败: {e}")
+
+
+def _populate_protobuf_from_dict(proto_msg, data_dict: Dict, path: str = "$"):
+    plan = _get_encode_plan(proto_msg.DESCRIPTOR)
+    for key, value in data_dict.items():
+        entry = plan.get(key)
+        if entry is None:
+            logger.warning(f"忽略未知字段: {path}.{key}")
             continue
+        kind, aux = entry
 
         try:
-            if (
-                fd is not None
-                and fd.type == _FD.TYPE_MESSAGE
-                and fd.message_type is not None
-                and fd.message_type.GetOptions().map_entry
-                and isinstance(value, dict)
-            ):
-                value_desc = fd.message_type.fields_by_name.get("value")
+            if kind == _KIND_SCALAR:
+                if key in _PRESENCE_KEYS and not isinstance(value, (dict, list)):
+                    getattr(proto_msg, key).SetInParent()
+                elif isinstance(value, (dict, list)):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                else:
+                    setattr(proto_msg, key, value)
+
+            elif kind == _KIND_ENUM:
+                if isinstance(value, (dict, list)):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                    continue
+                # 处理标量 enum：允许传入字符串名称或数字
+                if isinstance(value, str):
+                    ev = aux.get(value)
+                    if ev is not None:
+                        setattr(proto_msg, key, ev.number)
+                        continue
+                    try:
+                        setattr(proto_msg, key, int(value))
+                        continue
+                    except Exception:
+                        pass
+                # 其余情况直接赋值，若类型不匹配由底层抛错
+                setattr(proto_msg, key, value)
+
+            elif kind == _KIND_STRUCT:
+                if isinstance(value, dict):
+                    _fill_google_struct_dynamic(getattr(proto_msg, key), value)
+                elif key in _PRESENCE_KEYS and not isinstance(value, list):
+                    getattr(proto_msg, key).SetInParent()
+                elif isinstance(value, list):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                else:
+                    _set_message_field_fallback(proto_msg, key, value, path)
+
+            elif kind == _KIND_MESSAGE:
+                if isinstance(value, dict):
+                    try:
+                        _populate_protobuf_from_dict(getattr(proto_msg, key), value, path=f"{path}.{key}")
+                    except Exception as e:
+                        logger.error(f"填充子消息失败: {path}.{key}: {e}")
+                        raise
+                elif key in _PRESENCE_KEYS and not isinstance(value, list):
+                    getattr(proto_msg, key).SetInParent()
+                elif isinstance(value, list):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                else:
+                    _set_message_field_fallback(proto_msg, key, value, path)
+
+            elif kind == _KIND_MAP:
+                if not isinstance(value, dict):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                    continue
+                field = getattr(proto_msg, key)
                 for mk, mv in value.items():
                     try:
-                        if value_desc is not None and value_desc.type == _FD.TYPE_MESSAGE:
-                            if value_desc.message_type is not None and value_desc.message_type.full_name == "google.protobuf.Value":
-                                _fill_google_value_dynamic(field[mk], mv)
+                        if aux == _MAP_VALUE:
+                            _fill_google_value_dynamic(field[mk], mv)
+                        elif aux == _MAP_MESSAGE:
+                            sub_msg = field[mk]  # 与旧实现一致：先创建条目再校验类型
+                            if isinstance(mv, dict):
+                                _populate_protobuf_from_dict(sub_msg, mv, path=f"{path}.{key}.{mk}")
                             else:
-                                sub_msg = field[mk]
-                                if isinstance(mv, dict):
-                                    _populate_protobuf_from_dict(sub_msg, mv, path=f"{current_path}.{mk}")
-                                else:
-                                    try:
-                                        logger.warning(f"map值类型不匹配，期望message: {current_path}.{mk}")
-                                    except Exception:
-                                        pass
+                                logger.warning(f"map值类型不匹配，期望message: {path}.{key}.{mk}")
                         else:
                             field[mk] = mv
                     except Exception as me:
-                        logger.warning(f"设置 map 字段 {current_path}.{mk} 失败: {me}")
-                continue
-        except Exception as e:
-            logger.warning(f"处理 map 字段 {current_path} 失败: {e}")
-        
-        if isinstance(value, dict):
-            try:
-                _populate_protobuf_from_dict(field, value, path=current_path)
-            except Exception as e:
-                logger.error(f"填充子消息失败: {current_path}: {e}")
-                raise
-        elif isinstance(value, list):
-            # 处理 repeated enum：允许传入字符串名称或数字
-            try:
-                if fd is not None and fd.type == _FD.TYPE_ENUM:
-                    enum_desc = getattr(fd, "enum_type", None)
-                    resolved_values = []
-                    for item in value:
-                        if isinstance(item, str):
-                            ev = enum_desc.values_by_name.get(item) if enum_desc is not None else None
-                            if ev is not None:
-                                resolved_values.append(ev.number)
-                            else:
-                                try:
-                                    resolved_values.append(int(item))
-                                except Exception:
-                                    logger.warning(f"无法解析枚举值 '{item}' 为 {current_path}，已忽略")
-                        else:
-                            try:
-                                resolved_values.append(int(item))
-                            except Exception:
-                                logger.warning(f"无法转换枚举值 {item} 为整数: {current_path}")
-                    field.extend(resolved_values)
+                        logger.warning(f"设置 map 字段 {path}.{key}.{mk} 失败: {me}")
+
+            elif kind == _KIND_REPEATED_ENUM:
+                if not isinstance(value, list):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                    continue
+                # 处理 repeated enum：允许传入字符串名称或数字
+                getattr(proto_msg, key).extend(_resolve_enum_list(value, aux, path, key))
+
+            elif kind == _KIND_REPEATED_MESSAGE:
+                if not isinstance(value, list):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
+                    continue
+                field = getattr(proto_msg, key)
+                if value and isinstance(value[0], dict):
+                    try:
+                        for idx, item in enumerate(value):
+                            _populate_protobuf_from_dict(field.add(), item, path=f"{path}.{key}[{idx}]")
+                    except Exception as e:
+                        logger.warning(f"填充复合数组失败 {path}.{key}: {e}")
+                else:
+                    try:
+                        field.extend(value)
+                    except Exception as e:
+                        logger.warning(f"设置数组字段 {path}.{key} 失败: {e}")
+
+            else:  # _KIND_REPEATED_SCALAR
+                if not isinstance(value, list):
+                    logger.warning(f"字段类型不匹配，已忽略: {path}.{key}")
                     continue
-            except Exception as e:
-                logger.warning(f"处理 repeated enum 字段 {current_path} 失败: {e}")
-            if value and isinstance(value[0], dict):
-                try:
-                    for idx, item in enumerate(value):
-                        new_item = field.add()  # type: ignore[attr-defined]
-                        _populate_protobuf_from_dict(new_item, item, path=f"{current_path}[{idx}]")
-                except Exception as e:
-                    logger.warning(f"填充复合数组失败 {current_path}: {e}")
-            else:
-                try:
-                    field.extend(value)
-                except Exception as e:
-                    logger.warning(f"设置数组字段 {current_path} 失败: {e}")
-        else:
-            if key in ["in_progress", "resume_conversation"]:
-                field.SetInParent()
-            else:
                 try:
-                    # 处理标量 enum：允许传入字符串名称或数字
-                    if fd is not None and fd.type == _FD.TYPE_ENUM:
-                        enum_desc = getattr(fd, "enum_type", None)
-                        if isinstance(value, str):
-                            ev = enum_desc.values_by_name.get(value) if enum_desc is not None else None
-                            if ev is not None:
-                                setattr(proto_msg, key, ev.number)
-                                continue
-                            try:
-                                setattr(proto_msg, key, int(value))
-                                continue
-                            except Exception:
-                                pass
-                        # 其余情况直接赋值，若类型不匹配由底层抛错
-                    setattr(proto_msg, key, value)
+                    getattr(proto_msg, key).extend(value)
                 except Exception as e:
-                    logger.warning(f"设置字段 {current_path} 失败: {e}")
+                    logger.warning(f"设置数组字段 {path}.{key} 失败: {e}")
 
+        except Exception as e:
+            if kind == _KIND_MESSAGE:
+                raise
+            logger.warning(f"设置字段 {path}.{key} 失败: {e}")
 
-# ===== server_message_data 递归处理 =====
 
 def _encode_smd_inplace(obj: Any) -> Any:
     if isinstance(obj, dict):
@@ -133,6 +133,17 @@ def _sanitize_json_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
     return s
 
 
+def sanitize_mcp_tool(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Sanitize one mcp_context.tools[*] entry (returns a new dict)."""
+    tool_copy = dict(tool)
+    input_schema = tool_copy.get("input_schema") or tool_copy.get("inputSchema")
+    if isinstance(input_schema, dict):
+        tool_copy["input_schema"] = _sanitize_json_schema(input_schema)
+        if "inputSchema" in tool_copy:
+            tool_copy["inputSchema"] = tool_copy["input_schema"]
+    return _deep_clean(tool_copy)
+
+
 def sanitize_mcp_input_schema_in_packet(body: Dict[str, Any]) -> Dict[str, Any]:
     """Validate and sanitize mcp_context.tools[*].input_schema in the given packet.
 
@@ -157,19 +168,7 @@ def sanitize_mcp_input_schema_in_packet(body: Dict[str, Any]) -> Dict[str, Any]:
             tools = mcp_ctx.get("tools")
             if not isinstance(tools, list):
                 continue
-            fixed_tools: List[Any] = []
-            for tool in tools:
-                if not isinstance(tool, dict):
-                    fixed_tools.append(tool)
-                    continue
-                tool_copy = dict(tool)
-                input_schema = tool_copy.get("input_schema") or tool_copy.get("inputSchema")
-                if isinstance(input_schema, dict):
-                    tool_copy["input_schema"] = _sanitize_json_schema(input_schema)
-                    if "inputSchema" in tool_copy:
-                        tool_copy["inputSchema"] = tool_copy["input_schema"]
-                fixed_tools.append(_deep_clean(tool_copy))
-            mcp_ctx["tools"] = fixed_tools
+            mcp_ctx["tools"] = [sanitize_mcp_tool(tool) if isinstance(tool, dict) else tool for tool in tools]
         return body
     except Exception:
         return body 
\ No newline at end of file
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量 SSE 解码器
+
+所有 SSE 读取方（上游 Warp 事件流、bridge 的 JSON 事件流）共用：直接处理 aiter_bytes() 的字节块，
+整块按行切分并只做 bytes 级判断，不为每行解码/分配 str；多行 data 在事件结束时一次拼接。
+上游负载（hex 或 base64url）的编码在每个流的第一个事件上检测一次。
+"""
+import binascii
+from typing import AsyncIterator, List, Optional
+
+DONE_MARKER = b"[DONE]"
+
+_DATA_PREFIX = b"data:"
+_HEX_CHARS = frozenset(b"0123456789abcdefABCDEF")
+# base64url -> 标准 base64，使两种字母表都能用 a2b_base64 解码
+_URLSAFE_TO_STD = bytes.maketrans(b"-_", b"+/")
+_PADDING = (b"", b"===", b"==", b"=")
+
+
+class SSEDecoder:
+    """feed 任意切分的字节块，返回其中已完整事件的 data 负载（多行 data 已拼接、已去除首尾空白）"""
+
+    __slots__ = ("_buf", "_data", "done")
+
+    def __init__(self):
+        self._buf = bytearray()  # 上一块末尾不完整的行，原地追加，不随块数增长反复拷贝
+        self._data: List[bytes] = []
+        self.done = False  # 收到 data: [DONE] 后为 True，之后的数据全部忽略
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        events: List[bytes] = []
+        if self.done:
+            return events
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        buf = self._buf
+        # 只在新块里找换行：没有换行时直接追加，一行跨越很多块也是线性开销
+        if chunk.rfind(b"\n") < 0:
+            buf += chunk
+            return events
+
+        # 整块按行切分（C 层完成），最后一段是不完整的行，留在缓冲区
+        lines = chunk.split(b"\n")
+        rest = lines.pop()
+        if buf:
+            buf += lines[0]
+            lines[0] = bytes(buf)
+            buf.clear()
+        buf += rest
+
+        data = self._data
+        # 每行只做 bytes 级的 strip/前缀判断
+        for line in lines:
+            line = line.strip()
+            if not line:
+                # 空行：一个事件结束
+                if data:
+                    events.append(data[0] if len(data) == 1 else b"".join(data))
+                    data.clear()
+                continue
+            if line.startswith(_DATA_PREFIX):
+                payload = line[len(_DATA_PREFIX):].lstrip()
+                if not payload:
+                    continue
+                if payload == DONE_MARKER:
+                    self.done = True
+                    buf.clear()
+                    data.clear()
+                    break
+                data.append(payload)
+            # 其余字段（event:/id:/retry:/注释）忽略
+        return events
+
+    @property
+    def pending(self) -> int:
+        """尚未组成完整事件的缓冲字节数"""
+        return len(self._buf) + sum(len(p) for p in self._data)
+
+
+class PayloadDecoder:
+    """将上游 SSE data 负载（hex 或 base64/base64url）解码为原始 protobuf 字节，hex 与 base64 按流检测一次"""
+
+    __slots__ = ("_hex", "_scratch")
+
+    def __init__(self):
+        self._hex: Optional[bool] = None
+        self._scratch = bytearray()  # 补齐 base64 填充用的缓冲区，整个流复用
+
+    def decode(self, payload: bytes) -> Optional[bytes]:
+        if not payload:
+            return None
+        if self._hex is None:
+            self._hex = len(payload) % 2 == 0 and all(c in _HEX_CHARS for c in payload)
+        if self._hex:
+            try:
+                return bytes.fromhex(payload.decode("ascii"))
+            except ValueError:
+                # 检测错误：后续按 base64 处理
+                self._hex = False
+        return _decode_base64(payload, self._scratch)
+
+
+def _decode_base64(payload: bytes, scratch: Optional[bytearray] = None) -> Optional[bytes]:
+    """
+    标准 base64 / base64url 均可：字母表逐个负载判断（a2b_base64 会静默丢弃 -/_，不能按流只判断一次），
+    含 -/_ 时转换一次；缺少填充时在 scratch 中补齐，不再为每个事件拼接新的 bytes
+    """
+    if b"-" in payload or b"_" in payload:
+        payload = payload.translate(_URLSAFE_TO_STD)
+    pad = -len(payload) % 4
+    if pad:
+        if scratch is None:
+            scratch = bytearray()
+        scratch[:] = payload
+        scratch += _PADDING[pad]
+        payload = scratch
+    try:
+        return binascii.a2b_base64(payload)
+    except (binascii.Error, ValueError):
+        return None
+
+
+async def iter_sse_data(byte_chunks: AsyncIterator[bytes], decoder: Optional[SSEDecoder] = None) -> AsyncIterator[bytes]:
+    """逐个产出 SSE 事件的 data 负载，遇到 [DONE] 结束"""
+    decoder = decoder or SSEDecoder()
+    async for chunk in byte_chunks:
+        for payload in decoder.feed(chunk):
+            yield payload
+        if decoder.done:
+            return
+    # 末行没有换行符时补一个，使结尾的 data: [DONE] 也能被识别
+    for payload in decoder.feed(b"\n"):
+        yield payload
+
+
+async def iter_sse_event_bytes(byte_chunks: AsyncIterator[bytes], decoder: Optional[SSEDecoder] = None) -> AsyncIterator[bytes]:
+    """逐个产出上游事件的原始 protobuf 字节（无法解码的负载直接跳过）"""
+    payloads = PayloadDecoder()
+    async for payload in iter_sse_data(byte_chunks, decoder):
+        raw = payloads.decode(payload)
+        if raw is not None:
+            yield raw
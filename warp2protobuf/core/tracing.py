@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求级追踪
+
+OpenAI 兼容层为每个请求生成（或沿用客户端传入的）X-Request-ID，经 X-Request-ID / traceparent
+请求头传给 bridge；两侧都把当前 Trace 放在 contextvar 中，各阶段（校验、重排、构建、清洗、编码、
+上游连接、首个/最后一个事件）记录 span。
+
+WARP_TRACE_EXPORT=jsonl 时 span 逐行写入 WARP_TRACE_FILE，=otlp 时以 OTLP/HTTP JSON 批量发送到
+WARP_TRACE_OTLP_ENDPOINT；导出在后台线程完成。未开启导出时不创建 span，只传递请求 ID（日志中可见）。
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+from ..config.settings import TRACE_EXPORT, TRACE_FILE, TRACE_OTLP_ENDPOINT
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACEPARENT_HEADER = "traceparent"
+
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_HEX32_RE = re.compile(r"^[0-9a-f]{32}$")
+# perf_counter -> Unix 纳秒时间戳
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("warp_trace", default=None)
+_NULL_SPAN = nullcontext()
+
+
+def _span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _to_unix_ns(perf: float) -> int:
+    return _EPOCH_OFFSET_NS + int(perf * 1e9)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "service", "start", "end", "attrs")
+
+    def __init__(self, trace: "Trace", name: str, start: float, attrs: Dict[str, Any]):
+        self.trace_id = trace.trace_id
+        self.span_id = _span_id()
+        self.parent_id: Optional[str] = trace.root_span_id
+        self.name = name
+        self.service = trace.service
+        self.start = start
+        self.end = start
+        self.attrs = attrs
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.service,
+            "name": self.name,
+            "start_ns": _to_unix_ns(self.start),
+            "end_ns": _to_unix_ns(self.end),
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """单个请求在本服务内的追踪上下文；root span 在 finish() 时导出"""
+
+    __slots__ = ("request_id", "trace_id", "service", "root_span_id", "parent_id", "started", "_finished")
+
+    def __init__(self, request_id: str, service: str, traceparent: Optional[str] = None):
+        self.request_id = request_id
+        self.service = service
+        self.parent_id: Optional[str] = None
+        match = _TRACEPARENT_RE.match(traceparent or "")
+        if match:
+            self.trace_id, self.parent_id = match.group(1), match.group(2)
+        elif _HEX32_RE.match(request_id):
+            self.trace_id = request_id
+        else:
+            self.trace_id = hashlib.md5(request_id.encode("utf-8")).hexdigest()
+        self.root_span_id = _span_id()
+        self.started = time.perf_counter()
+        self._finished = False
+
+    def headers(self) -> Dict[str, str]:
+        """转发给下一跳的请求头"""
+        return {REQUEST_ID_HEADER: self.request_id,
+                TRACEPARENT_HEADER: f"00-{self.trace_id}-{self.root_span_id}-01"}
+
+    def span(self, name: str, **attrs: Any):
+        if _exporter is None:
+            return _NULL_SPAN
+        return self._span(name, attrs)
+
+    @contextmanager
+    def _span(self, name: str, attrs: Dict[str, Any]) -> Iterator[Span]:
+        span = Span(self, name, time.perf_counter(), attrs)
+        try:
+            yield span
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _exporter.submit(span)
+
+    def record(self, name: str, start: float, end: Optional[float] = None, **attrs: Any) -> None:
+        """记录已结束的阶段（start/end 为 time.perf_counter() 值）"""
+        if _exporter is None:
+            return
+        span = Span(self, name, start, attrs)
+        span.end = time.perf_counter() if end is None else end
+        _exporter.submit(span)
+
+    def finish(self, name: str, **attrs: Any) -> None:
+        """导出 root span（只生效一次）"""
+        if self._finished:
+            return
+        self._finished = True
+        if _exporter is None:
+            return
+        root = Span(self, name, self.started, attrs)
+        root.span_id = self.root_span_id
+        root.parent_id = self.parent_id  # 来自上一跳的 traceparent；没有时为根 span
+        root.end = time.perf_counter()
+        _exporter.submit(root)
+
+
+def new_request_id() -> str:
+    return os.urandom(16).hex()
+
+
+def start_trace(service: str, request_id: Optional[str] = None, traceparent: Optional[str] = None) -> Trace:
+    """创建 Trace 并设为当前上下文；request_id 为空时生成新的"""
+    trace = Trace((request_id or "").strip()[:128] or new_request_id(), service, traceparent)
+    _current.set(trace)
+    return trace
+
+
+def use_trace(trace: Optional[Trace]) -> None:
+    """在流式生成器等独立任务中重新绑定 Trace"""
+    _current.set(trace)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def current_request_id() -> str:
+    trace = _current.get()
+    return trace.request_id if trace is not None else "-"
+
+
+def span(name: str, **attrs: Any):
+    """当前 Trace 下的阶段 span；没有 Trace 或未开启导出时为空操作"""
+    trace = _current.get()
+    if trace is None or _exporter is None:
+        return _NULL_SPAN
+    return trace._span(name, attrs)
+
+
+def trace_headers() -> Dict[str, str]:
+    trace = _current.get()
+    return trace.headers() if trace is not None else {}
+
+
+class RequestIdFilter(logging.Filter):
+    """为日志记录附加 request_id 字段（在调用方线程中执行，contextvar 可见）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id()
+        return True
+
+
+# ---- 导出 ----
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans: List[Span]) -> bytes:
+    by_service: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(_to_unix_ns(s.start)),
+            "endTimeUnixNano": str(_to_unix_ns(s.end)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        by_service.setdefault(s.service, []).append(otlp_span)
+    return json.dumps({"resourceSpans": [
+        {"resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+         "scopeSpans": [{"scope": {"name": "warp2api"}, "spans": otlp_spans}]}
+        for service, otlp_spans in by_service.items()
+    ]}).encode("utf-8")
+
+
+class _SpanExporter:
+    """后台线程批量导出 span；队列满时丢弃而不阻塞事件循环"""
+
+    def __init__(self, mode: str, max_queue: int = 10000, batch_size: int = 256, interval: float = 1.0):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        try:
+            self._queue.put(None, timeout=1.0)
+        except queue.Full:
+            return
+        self._thread.join(timeout=5.0)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Span] = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._export(batch)
+                except Exception as e:
+                    logging.getLogger("warp_api").warning("span 导出失败（%d 个）: %s", len(batch), e)
+
+    def _export(self, batch: List[Span]) -> None:
+        if self.mode == "otlp":
+            req = urllib.request.Request(TRACE_OTLP_ENDPOINT, data=_otlp_payload(batch),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+            with urllib.request.urlopen(req, timeout=5.0) as resp:
+                resp.read()
+            return
+        TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in batch)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+_exporter: Optional[_SpanExporter] = None
+if TRACE_EXPORT in ("jsonl", "otlp"):
+    _exporter = _SpanExporter(TRACE_EXPORT)
+    atexit.register(_exporter.stop)
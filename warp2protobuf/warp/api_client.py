@@ -6,21 +6,39 @@ Warp API客户端模块
 处理与Warp API的通信，包括protobuf数据发送和SSE响应解析。
 """
 import asyncio
+import logging
 import os
-from typing import Any, Dict, LiteralString
+import time
+from typing import Any, AsyncIterator, Dict, LiteralString
 
 import httpx
 
-from ..config.settings import WARP_URL as CONFIG_WARP_URL
-from ..core.logging import logger
-from ..core.pool_auth import acquire_pool_session_with_info, release_pool_session
+from ..config.settings import CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, WARP_URL as CONFIG_WARP_URL
+from ..core.auth import get_valid_jwt
+from ..core.capture import open_capture
+from ..core.event_record import ResponseEventRecord, parse_event_record
+from ..core.logging import logger, payload
+from ..core.metrics import (EVENT_DECODE_SECONDS, UPSTREAM_CONNECT_SECONDS, UPSTREAM_EVENT_GAP_SECONDS,
+                            UPSTREAM_REQUEST_BYTES, UPSTREAM_RESPONSE_BYTES, UPSTREAM_RETRIES, UPSTREAM_TTFB_SECONDS)
+from ..core.pool_auth import acquire_pool_or_anonymous_token, acquire_pool_session_with_info, release_pool_session
 from ..core.protobuf_utils import protobuf_to_dict
+from ..core.sse_decoder import SSEDecoder, iter_sse_event_bytes
+from ..core.tracing import current_trace
+from .upstream import upstream_stream
 
 # 可配置的重试参数
 MAX_QUOTA_RETRIES = 5
 RETRY_DELAY_SECONDS = 0.2
 
 
+def _response_chunks(response: httpx.Response, protobuf_bytes: bytes, url: str):
+    """响应字节块；开启 WARP_CAPTURE_DIR 时同时录制（调用方需在 finally 中 capture.close()，上游出错、取消或重试时也不会留下未写完的录制）"""
+    capture = open_capture(protobuf_bytes, url)
+    if capture is None:
+        return response.aiter_bytes(), None
+    return capture.tee(response.aiter_bytes()), capture
+
+
 def _get(d: Dict[str, Any], *names: str) -> Any:
     """Return the first matching key value (camelCase/snake_case tolerant)."""
     for name in names:
@@ -177,237 +195,199 @@ async def send_protobuf_to_warp_api(
                     else:
                         logger.warning("无法获取代理，使用直连")
 
-                    # 创建带代理的客户端
-                    client_config = {
-                        "http2": True,
-                        "timeout": httpx.Timeout(60.0),
-                        "verify": verify_opt,
-                        "trust_env": True
+                    headers = {
+                        "accept": "text/event-stream",
+                        "content-type": "application/x-protobuf",
+                        "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
+                        "x-warp-os-category": "Windows",
+                        "x-warp-os-name": "Windows",
+                        "x-warp-os-version": "11 (26100)",
+                        "authorization": f"Bearer {jwt}",
+                        "content-length": str(len(protobuf_bytes)),
                     }
 
-                    # 如果有代理配置，添加代理参数
-                    if proxy_config:
-                        client_config["proxies"] = proxy_config
-
-                    async with httpx.AsyncClient(**client_config) as client:
-                        headers = {
-                            "accept": "text/event-stream",
-                            "content-type": "application/x-protobuf",
-                            "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
-                            "x-warp-os-category": "Windows",
-                            "x-warp-os-name": "Windows",
-                            "x-warp-os-version": "11 (26100)",
-                            "authorization": f"Bearer {jwt}",
-                            "content-length": str(len(protobuf_bytes)),
-                        }
-
-                        async with client.stream("POST", warp_url, headers=headers, content=protobuf_bytes) as response:
-                            # 如果请求成功，处理响应
-                            if response.status_code == 200:
-                                logger.info(f"✅ 收到HTTP {response.status_code}响应")
-                                logger.info("开始处理SSE事件流...")
-
-                                import re as _re
-                                def _parse_payload_bytes(data_str: str):
-                                    s = _re.sub(r"\\s+", "", data_str or "")
-                                    if not s: return None
-                                    if _re.fullmatch(r"[0-9a-fA-F]+", s or ""):
-                                        try:
-                                            return bytes.fromhex(s)
-                                        except Exception:
-                                            pass
-                                    pad = "=" * ((4 - (len(s) % 4)) % 4)
+                    # 复用进程级共享的 HTTP/2 连接池
+                    async with upstream_stream("POST", warp_url, proxy=proxy_config, verify=verify_opt,
+                                               trust_env=True, timeout=httpx.Timeout(60.0),
+                                               headers=headers, content=protobuf_bytes) as response:
+                        # 如果请求成功，处理响应
+                        if response.status_code == 200:
+                            logger.info(f"✅ 收到HTTP {response.status_code}响应")
+                            logger.info("开始处理SSE事件流...")
+
+                            sse_decoder = SSEDecoder()
+                            chunks, capture = _response_chunks(response, protobuf_bytes, warp_url)
+                            try:
+                                async for raw_bytes in iter_sse_event_bytes(chunks, sse_decoder):
                                     try:
-                                        import base64 as _b64
-                                        return _b64.urlsafe_b64decode(s + pad)
-                                    except Exception:
-                                        try:
-                                            return _b64.b64decode(s + pad)
-                                        except Exception:
-                                            return None
-
-                                current_data = ""
-
-                                async for line in response.aiter_lines():
-                                    if line.startswith("data:"):
-                                        payload = line[5:].strip()
-                                        if not payload: continue
-                                        if payload == "[DONE]":
-                                            logger.info("收到[DONE]标记，结束处理")
-                                            break
-                                        current_data += payload
+                                        event_data = protobuf_to_dict(raw_bytes,
+                                                                      "warp.multi_agent.v1.ResponseEvent")
+                                    except Exception as parse_error:
+                                        logger.debug(f"解析事件失败，跳过: {str(parse_error)[:100]}")
                                         continue
-
-                                    if (line.strip() == "") and current_data:
-                                        raw_bytes = _parse_payload_bytes(current_data)
-                                        current_data = ""
-                                        if raw_bytes is None:
-                                            logger.debug("跳过无法解析的SSE数据块（非hex/base64或不完整）")
-                                            continue
-                                        try:
-                                            event_data = protobuf_to_dict(raw_bytes,
-                                                                          "warp.multi_agent.v1.ResponseEvent")
-                                        except Exception as parse_error:
-                                            logger.debug(f"解析事件失败，跳过: {str(parse_error)[:100]}")
-                                            continue
-                                        event_count += 1
-
-                                        def _get(d: Dict[str, Any], *names: str) -> Any:
-                                            for n in names:
-                                                if isinstance(d, dict) and n in d:
-                                                    return d[n]
-                                            return None
-
-                                        event_type = _get_event_type(event_data)
-                                        if show_all_events:
-                                            all_events.append(
-                                                {"event_number": event_count, "event_type": event_type,
-                                                 "raw_data": event_data})
-                                        logger.info(f"🔄 Event #{event_count}: {event_type}")
-                                        if show_all_events:
-                                            logger.info(f"   📋 Event data: {str(event_data)}")
-
-                                        if "init" in event_data:
-                                            init_data = event_data["init"]
-                                            conversation_id = init_data.get("conversation_id", conversation_id)
-                                            task_id = init_data.get("task_id", task_id)
-                                            logger.info(f"会话初始化: {conversation_id}")
-
-                                        client_actions = _get(event_data, "client_actions", "clientActions")
-                                        if isinstance(client_actions, dict):
-                                            actions = _get(client_actions, "actions", "Actions") or []
-                                            for i, action in enumerate(actions):
-                                                logger.info(f"   🎯 Action #{i + 1}: {list(action.keys())}")
-
-                                                # 处理 update_task_message（新增）
-                                                update_msg_data = _get(action, "update_task_message",
-                                                                       "updateTaskMessage")
-                                                if isinstance(update_msg_data, dict):
-                                                    message = update_msg_data.get("message", {})
+                                    event_count += 1
+
+                                    def _get(d: Dict[str, Any], *names: str) -> Any:
+                                        for n in names:
+                                            if isinstance(d, dict) and n in d:
+                                                return d[n]
+                                        return None
+
+                                    event_type = _get_event_type(event_data)
+                                    if show_all_events:
+                                        all_events.append(
+                                            {"event_number": event_count, "event_type": event_type,
+                                             "raw_data": event_data})
+                                    logger.debug("🔄 Event #%d: %s", event_count, event_type)
+                                    if show_all_events:
+                                        logger.debug("   📋 Event data: %s", payload(event_data))
+
+                                    if "init" in event_data:
+                                        init_data = event_data["init"]
+                                        conversation_id = init_data.get("conversation_id", conversation_id)
+                                        task_id = init_data.get("task_id", task_id)
+                                        logger.info(f"会话初始化: {conversation_id}")
+
+                                    client_actions = _get(event_data, "client_actions", "clientActions")
+                                    if isinstance(client_actions, dict):
+                                        actions = _get(client_actions, "actions", "Actions") or []
+                                        for i, action in enumerate(actions):
+                                            logger.debug("   🎯 Action #%d: %s", i + 1, list(action.keys()))
+
+                                            # 处理 update_task_message（新增）
+                                            update_msg_data = _get(action, "update_task_message",
+                                                                   "updateTaskMessage")
+                                            if isinstance(update_msg_data, dict):
+                                                message = update_msg_data.get("message", {})
+                                                text_content = _extract_text_from_message(message)
+                                                if text_content:
+                                                    complete_response.append(text_content)
+                                                    logger.debug(
+                                                        "   📝 Text from UPDATE_MESSAGE: %s", payload(text_content))
+
+                                            # 处理 append_to_message_content
+                                            append_data = _get(action, "append_to_message_content",
+                                                               "appendToMessageContent")
+                                            if isinstance(append_data, dict):
+                                                message = append_data.get("message", {})
+                                                agent_output = _get(message, "agent_output", "agentOutput") or {}
+                                                text_content = agent_output.get("text", "")
+                                                if text_content:
+                                                    complete_response.append(text_content)
+                                                    logger.debug("   📝 Text Fragment: %s", payload(text_content))
+
+                                            # 处理 add_messages_to_task
+                                            messages_data = _get(action, "add_messages_to_task",
+                                                                 "addMessagesToTask")
+                                            if isinstance(messages_data, dict):
+                                                messages = messages_data.get("messages", [])
+                                                task_id = messages_data.get("task_id",
+                                                                            messages_data.get("taskId", task_id))
+                                                for j, message in enumerate(messages):
+                                                    logger.debug("   📨 Message #%d: %s", j + 1, list(message.keys()))
                                                     text_content = _extract_text_from_message(message)
                                                     if text_content:
                                                         complete_response.append(text_content)
-                                                        logger.info(
-                                                            f"   📝 Text from UPDATE_MESSAGE: {text_content}")
+                                                        logger.debug(
+                                                            "   📝 Complete Message: %s", payload(text_content))
+                            finally:
+                                if capture is not None:
+                                    capture.close()
+                            if sse_decoder.done:
+                                logger.info("收到[DONE]标记，结束处理")
+
+                            full_response = "".join(complete_response)
+                            logger.info("=" * 60)
+                            logger.info("📊 SSE STREAM SUMMARY")
+                            logger.info("=" * 60)
+                            logger.info(f"📈 Total Events Processed: {event_count}")
+                            logger.info(f"🆔 Conversation ID: {conversation_id}")
+                            logger.info(f"🆔 Task ID: {task_id}")
+                            logger.info(f"📝 Response Length: {len(full_response)} characters")
+                            logger.info("=" * 60)
+
+                            # 成功完成，释放会话并返回结果
+                            await release_pool_session(current_session.get("session_id"))
+                            current_session = None
 
-                                                # 处理 append_to_message_content
-                                                append_data = _get(action, "append_to_message_content",
-                                                                   "appendToMessageContent")
-                                                if isinstance(append_data, dict):
-                                                    message = append_data.get("message", {})
-                                                    agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                    text_content = agent_output.get("text", "")
-                                                    if text_content:
-                                                        complete_response.append(text_content)
-                                                        logger.info(f"   📝 Text Fragment: {text_content}")
+                            if full_response:
+                                logger.info(f"✅ Stream processing completed successfully")
+                                return full_response, conversation_id, task_id
+                            else:
+                                logger.warning("⚠️ No text content received in response")
+                                return "Warning: No response content received", conversation_id, task_id
+
+                        # --- 处理错误响应 ---
+                        error_text = await response.aread()
+                        error_content = error_text.decode('utf-8') if error_text else "No error content"
+
+                        # 检查是否是账号被封禁错误 (403)
+                        is_blocked_error = (
+                                response.status_code == 403 and (
+                                ("Your account has been blocked" in error_content) or
+                                ("blocked from using AI features" in error_content)
+                        )
+                        )
+
+                        if is_blocked_error:
+                            logger.error(f"❌ 账号 {account_email} 已被封禁 (HTTP 403)")
+                            # 释放并标记为blocked
+                            if current_session:
+                                # 通知pool service标记账号
+                                try:
+                                    async with httpx.AsyncClient(timeout=5.0) as notify_client:
+                                        await notify_client.post(
+                                            "http://localhost:8019/api/accounts/mark_blocked",
+                                            json={"email": account_email}
+                                        )
+                                except:
+                                    pass
 
-                                                # 处理 add_messages_to_task
-                                                messages_data = _get(action, "add_messages_to_task",
-                                                                     "addMessagesToTask")
-                                                if isinstance(messages_data, dict):
-                                                    messages = messages_data.get("messages", [])
-                                                    task_id = messages_data.get("task_id",
-                                                                                messages_data.get("taskId", task_id))
-                                                    for j, message in enumerate(messages):
-                                                        logger.info(f"   📨 Message #{j + 1}: {list(message.keys())}")
-                                                        text_content = _extract_text_from_message(message)
-                                                        if text_content:
-                                                            complete_response.append(text_content)
-                                                            logger.info(
-                                                                f"   📝 Complete Message: {text_content}")
-
-                                full_response = "".join(complete_response)
-                                logger.info("=" * 60)
-                                logger.info("📊 SSE STREAM SUMMARY")
-                                logger.info("=" * 60)
-                                logger.info(f"📈 Total Events Processed: {event_count}")
-                                logger.info(f"🆔 Conversation ID: {conversation_id}")
-                                logger.info(f"🆔 Task ID: {task_id}")
-                                logger.info(f"📝 Response Length: {len(full_response)} characters")
-                                logger.info("=" * 60)
-
-                                # 成功完成，释放会话并返回结果
                                 await release_pool_session(current_session.get("session_id"))
                                 current_session = None
 
-                                if full_response:
-                                    logger.info(f"✅ Stream processing completed successfully")
-                                    return full_response, conversation_id, task_id
-                                else:
-                                    logger.warning("⚠️ No text content received in response")
-                                    return "Warning: No response content received", conversation_id, task_id
-
-                            # --- 处理错误响应 ---
-                            error_text = await response.aread()
-                            error_content = error_text.decode('utf-8') if error_text else "No error content"
-
-                            # 检查是否是账号被封禁错误 (403)
-                            is_blocked_error = (
-                                    response.status_code == 403 and (
-                                    ("Your account has been blocked" in error_content) or
-                                    ("blocked from using AI features" in error_content)
-                            )
-                            )
-
-                            if is_blocked_error:
-                                logger.error(f"❌ 账号 {account_email} 已被封禁 (HTTP 403)")
-                                # 释放并标记为blocked
-                                if current_session:
-                                    # 通知pool service标记账号
-                                    try:
-                                        async with httpx.AsyncClient(timeout=5.0) as notify_client:
-                                            await notify_client.post(
-                                                "http://localhost:8019/api/accounts/mark_blocked",
-                                                json={"email": account_email}
-                                            )
-                                    except:
-                                        pass
-
-                                    await release_pool_session(current_session.get("session_id"))
-                                    current_session = None
-
-                                # 如果还有重试次数，获取新账号
-                                if attempt < (MAX_QUOTA_RETRIES - 1):
-                                    logger.warning(
-                                        f"账号被封，将获取新账号重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
-                                    await asyncio.sleep(RETRY_DELAY_SECONDS)
-                                    break  # 跳出代理循环，进入下一个attempt获取新账号
-                                else:
-                                    return f"❌ Account blocked after {MAX_QUOTA_RETRIES} attempts", None, None
-
-                            # 检查是否是配额用尽错误
-                            is_quota_error = ("No remaining quota" in error_content) or (
-                                    "No AI requests remaining" in error_content)
-
-                            if response.status_code == 429 and is_quota_error:
-                                if attempt < (MAX_QUOTA_RETRIES - 1):
-                                    logger.warning(
-                                        f"Warp API 返回 429 (配额用尽)。将在 {RETRY_DELAY_SECONDS} 秒后强制获取新账号并重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
-                                    await asyncio.sleep(RETRY_DELAY_SECONDS)
-                                    # 跳出代理循环，进入下一个attempt获取新账号
-                                    break
-                                else:
-                                    # 所有账号都用尽了
-                                    await release_pool_session(current_session.get("session_id"))
-                                    current_session = None
-                                    return f"❌ API Error (HTTP {response.status_code}) after {MAX_QUOTA_RETRIES} attempts: {error_content}", None, None
+                            # 如果还有重试次数，获取新账号
+                            if attempt < (MAX_QUOTA_RETRIES - 1):
+                                logger.warning(
+                                    f"账号被封，将获取新账号重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
+                                await asyncio.sleep(RETRY_DELAY_SECONDS)
+                                break  # 跳出代理循环，进入下一个attempt获取新账号
+                            else:
+                                return f"❌ Account blocked after {MAX_QUOTA_RETRIES} attempts", None, None
+
+                        # 检查是否是配额用尽错误
+                        is_quota_error = ("No remaining quota" in error_content) or (
+                                "No AI requests remaining" in error_content)
+
+                        if response.status_code == 429 and is_quota_error:
+                            if attempt < (MAX_QUOTA_RETRIES - 1):
+                                logger.warning(
+                                    f"Warp API 返回 429 (配额用尽)。将在 {RETRY_DELAY_SECONDS} 秒后强制获取新账号并重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
+                                await asyncio.sleep(RETRY_DELAY_SECONDS)
+                                # 跳出代理循环，进入下一个attempt获取新账号
+                                break
+                            else:
+                                # 所有账号都用尽了
+                                await release_pool_session(current_session.get("session_id"))
+                                current_session = None
+                                return f"❌ API Error (HTTP {response.status_code}) after {MAX_QUOTA_RETRIES} attempts: {error_content}", None, None
 
-                            # 其他HTTP错误，尝试换代理
-                            logger.error(
-                                f"HTTP错误 {response.status_code}，尝试换代理 (proxy attempt {proxy_attempt + 1}/{max_proxy_retries})")
-                            if proxy_attempt < max_proxy_retries - 1:
-                                await asyncio.sleep(0.5)
-                                continue  # 继续下一个proxy_attempt
+                        # 其他HTTP错误，尝试换代理
+                        logger.error(
+                            f"HTTP错误 {response.status_code}，尝试换代理 (proxy attempt {proxy_attempt + 1}/{max_proxy_retries})")
+                        if proxy_attempt < max_proxy_retries - 1:
+                            await asyncio.sleep(0.5)
+                            continue  # 继续下一个proxy_attempt
 
-                            # 所有代理都失败，如果还有账号重试次数，换账号
-                            if attempt < (MAX_QUOTA_RETRIES - 1):
-                                logger.warning(f"当前账号的所有代理都失败，将换新账号重试")
-                                break  # 跳出代理循环
+                        # 所有代理都失败，如果还有账号重试次数，换账号
+                        if attempt < (MAX_QUOTA_RETRIES - 1):
+                            logger.warning(f"当前账号的所有代理都失败，将换新账号重试")
+                            break  # 跳出代理循环
 
-                            # 真正失败了
-                            await release_pool_session(current_session.get("session_id"))
-                            current_session = None
-                            return f"❌ API Error (HTTP {response.status_code}): {error_content}", None, None
+                        # 真正失败了
+                        await release_pool_session(current_session.get("session_id"))
+                        current_session = None
+                        return f"❌ API Error (HTTP {response.status_code}): {error_content}", None, None
 
                 except (httpx.ConnectError, httpx.ProxyError, httpx.RemoteProtocolError) as ssl_error:
                     logger.warning(f"SSL/代理错误 (proxy attempt {proxy_attempt + 1}/{max_proxy_retries}): {ssl_error}")
@@ -507,234 +487,196 @@ async def send_protobuf_to_warp_api_parsed(protobuf_bytes: bytes) -> None | tupl
                     else:
                         logger.warning("无法获取代理，使用直连(解析模式)")
 
-                    # 创建带代理的客户端
-                    client_config = {
-                        "http2": True,
-                        "timeout": httpx.Timeout(60.0),
-                        "verify": verify_opt,
-                        "trust_env": True
+                    headers = {
+                        "accept": "text/event-stream",
+                        "content-type": "application/x-protobuf",
+                        "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
+                        "x-warp-os-category": "Windows",
+                        "x-warp-os-name": "Windows",
+                        "x-warp-os-version": "11 (26100)",
+                        "authorization": f"Bearer {jwt}",
+                        "content-length": str(len(protobuf_bytes)),
                     }
 
-                    # 如果有代理配置，添加代理参数
-                    if proxy_config:
-                        client_config["proxy"] = proxy_config
-
-                    async with httpx.AsyncClient(**client_config) as client:
-                        headers = {
-                            "accept": "text/event-stream",
-                            "content-type": "application/x-protobuf",
-                            "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
-                            "x-warp-os-category": "Windows",
-                            "x-warp-os-name": "Windows",
-                            "x-warp-os-version": "11 (26100)",
-                            "authorization": f"Bearer {jwt}",
-                            "content-length": str(len(protobuf_bytes)),
-                        }
-
-                        async with client.stream("POST", warp_url, headers=headers, content=protobuf_bytes) as response:
-                            # 如果请求成功，在这里处理响应
-                            if response.status_code == 200:
-                                logger.info(f"✅ 收到HTTP {response.status_code}响应 (解析模式)")
-                                logger.info("开始处理SSE事件流...")
-
-                                # 处理响应流
-                                import re as _re2
-                                def _parse_payload_bytes2(data_str: str):
-                                    s = _re2.sub(r"\\s+", "", data_str or "")
-                                    if not s: return None
-                                    if _re2.fullmatch(r"[0-9a-fA-F]+", s or ""):
-                                        try:
-                                            return bytes.fromhex(s)
-                                        except Exception:
-                                            pass
-                                    pad = "=" * ((4 - (len(s) % 4)) % 4)
+                    # 复用进程级共享的 HTTP/2 连接池
+                    async with upstream_stream("POST", warp_url, proxy=proxy_config, verify=verify_opt,
+                                               trust_env=True, timeout=httpx.Timeout(60.0),
+                                               headers=headers, content=protobuf_bytes) as response:
+                        # 如果请求成功，在这里处理响应
+                        if response.status_code == 200:
+                            logger.info(f"✅ 收到HTTP {response.status_code}响应 (解析模式)")
+                            logger.info("开始处理SSE事件流...")
+
+                            # 处理响应流
+                            sse_decoder = SSEDecoder()
+                            chunks, capture = _response_chunks(response, protobuf_bytes, warp_url)
+                            try:
+                                async for raw_bytes in iter_sse_event_bytes(chunks, sse_decoder):
                                     try:
-                                        import base64 as _b642
-                                        return _b642.urlsafe_b64decode(s + pad)
-                                    except Exception:
-                                        try:
-                                            return _b642.b64decode(s + pad)
-                                        except Exception:
+                                        event_data = protobuf_to_dict(raw_bytes,
+                                                                      "warp.multi_agent.v1.ResponseEvent")
+                                        event_count += 1
+                                        event_type = _get_event_type(event_data)
+                                        parsed_event = {"event_number": event_count, "event_type": event_type,
+                                                        "parsed_data": event_data}
+                                        parsed_events.append(parsed_event)
+                                        logger.debug("🔄 Event #%d: %s", event_count, event_type)
+                                        logger.debug("   📋 Event data: %s", payload(event_data))
+
+                                        def _get(d: Dict[str, Any], *names: str) -> Any:
+                                            for n in names:
+                                                if isinstance(d, dict) and n in d:
+                                                    return d[n]
                                             return None
 
-                                current_data = ""
+                                        if "init" in event_data:
+                                            init_data = event_data["init"]
+                                            conversation_id = init_data.get("conversation_id", conversation_id)
+                                            task_id = init_data.get("task_id", task_id)
+                                            logger.info(f"会话初始化: {conversation_id}")
+
+                                        client_actions = _get(event_data, "client_actions", "clientActions")
+                                        if isinstance(client_actions, dict):
+                                            actions = _get(client_actions, "actions", "Actions") or []
+                                            for i, action in enumerate(actions):
+                                                logger.debug("   🎯 Action #%d: %s", i + 1, list(action.keys()))
 
-                                async for line in response.aiter_lines():
-                                    if line.startswith("data:"):
-                                        payload = line[5:].strip()
-                                        if not payload: continue
-                                        if payload == "[DONE]":
-                                            logger.info("收到[DONE]标记，结束处理")
-                                            break
-                                        current_data += payload
-                                        continue
+                                                # 处理 update_task_message（新增）
+                                                update_msg_data = _get(action, "update_task_message",
+                                                                       "updateTaskMessage")
+                                                if isinstance(update_msg_data, dict):
+                                                    message = update_msg_data.get("message", {})
+                                                    text_content = _extract_text_from_message(message)
+                                                    if text_content:
+                                                        complete_response.append(text_content)
+                                                        logger.debug(
+                                                            "   📝 Text from UPDATE_MESSAGE: %s", payload(text_content))
+
+                                                # 处理 append_to_message_content
+                                                append_data = _get(action, "append_to_message_content",
+                                                                   "appendToMessageContent")
+                                                if isinstance(append_data, dict):
+                                                    message = append_data.get("message", {})
+                                                    agent_output = _get(message, "agent_output",
+                                                                        "agentOutput") or {}
+                                                    text_content = agent_output.get("text", "")
+                                                    if text_content:
+                                                        complete_response.append(text_content)
+                                                        logger.debug("   📝 Text Fragment: %s", payload(text_content))
 
-                                    if (line.strip() == "") and current_data:
-                                        raw_bytes = _parse_payload_bytes2(current_data)
-                                        current_data = ""
-                                        if raw_bytes is None:
-                                            logger.debug("跳过无法解析的SSE数据块（非hex/base64或不完整）")
-                                            continue
-                                        try:
-                                            event_data = protobuf_to_dict(raw_bytes,
-                                                                          "warp.multi_agent.v1.ResponseEvent")
-                                            event_count += 1
-                                            event_type = _get_event_type(event_data)
-                                            parsed_event = {"event_number": event_count, "event_type": event_type,
-                                                            "parsed_data": event_data}
-                                            parsed_events.append(parsed_event)
-                                            logger.info(f"🔄 Event #{event_count}: {event_type}")
-                                            logger.debug(f"   📋 Event data: {str(event_data)}")
-
-                                            def _get(d: Dict[str, Any], *names: str) -> Any:
-                                                for n in names:
-                                                    if isinstance(d, dict) and n in d:
-                                                        return d[n]
-                                                return None
-
-                                            if "init" in event_data:
-                                                init_data = event_data["init"]
-                                                conversation_id = init_data.get("conversation_id", conversation_id)
-                                                task_id = init_data.get("task_id", task_id)
-                                                logger.info(f"会话初始化: {conversation_id}")
-
-                                            client_actions = _get(event_data, "client_actions", "clientActions")
-                                            if isinstance(client_actions, dict):
-                                                actions = _get(client_actions, "actions", "Actions") or []
-                                                for i, action in enumerate(actions):
-                                                    logger.info(f"   🎯 Action #{i + 1}: {list(action.keys())}")
-
-                                                    # 处理 update_task_message（新增）
-                                                    update_msg_data = _get(action, "update_task_message",
-                                                                           "updateTaskMessage")
-                                                    if isinstance(update_msg_data, dict):
-                                                        message = update_msg_data.get("message", {})
+                                                # 处理 add_messages_to_task
+                                                messages_data = _get(action, "add_messages_to_task",
+                                                                     "addMessagesToTask")
+                                                if isinstance(messages_data, dict):
+                                                    messages = messages_data.get("messages", [])
+                                                    task_id = messages_data.get("task_id",
+                                                                                messages_data.get("taskId",
+                                                                                                  task_id))
+                                                    for j, message in enumerate(messages):
+                                                        logger.debug(
+                                                            "   📨 Message #%d: %s", j + 1, list(message.keys()))
                                                         text_content = _extract_text_from_message(message)
                                                         if text_content:
                                                             complete_response.append(text_content)
-                                                            logger.info(
-                                                                f"   📝 Text from UPDATE_MESSAGE: {text_content}")
-
-                                                    # 处理 append_to_message_content
-                                                    append_data = _get(action, "append_to_message_content",
-                                                                       "appendToMessageContent")
-                                                    if isinstance(append_data, dict):
-                                                        message = append_data.get("message", {})
-                                                        agent_output = _get(message, "agent_output",
-                                                                            "agentOutput") or {}
-                                                        text_content = agent_output.get("text", "")
-                                                        if text_content:
-                                                            complete_response.append(text_content)
-                                                            logger.info(f"   📝 Text Fragment: {text_content}")
-
-                                                    # 处理 add_messages_to_task
-                                                    messages_data = _get(action, "add_messages_to_task",
-                                                                         "addMessagesToTask")
-                                                    if isinstance(messages_data, dict):
-                                                        messages = messages_data.get("messages", [])
-                                                        task_id = messages_data.get("task_id",
-                                                                                    messages_data.get("taskId",
-                                                                                                      task_id))
-                                                        for j, message in enumerate(messages):
-                                                            logger.info(
-                                                                f"   📨 Message #{j + 1}: {list(message.keys())}")
-                                                            text_content = _extract_text_from_message(message)
-                                                            if text_content:
-                                                                complete_response.append(text_content)
-                                                                logger.info(
-                                                                    f"   📝 Complete Message: {text_content}")
-                                        except Exception as parse_err:
-                                            logger.debug(f"解析事件失败，跳过: {str(parse_err)}")
-                                            continue
-
-                                # 成功处理完响应，生成结果并返回
-                                full_response = "".join(complete_response)
-                                logger.info("=" * 60)
-                                logger.info("📊 SSE STREAM SUMMARY (解析模式)")
-                                logger.info("=" * 60)
-                                logger.info(f"📈 Total Events Processed: {event_count}")
-                                logger.info(f"🆔 Conversation ID: {conversation_id}")
-                                logger.info(f"🆔 Task ID: {task_id}")
-                                logger.info(f"📝 Response Length: {len(full_response)} characters")
-                                logger.info(f"🎯 Parsed Events Count: {len(parsed_events)}")
-                                logger.info("=" * 60)
-
-                                # 成功完成，释放会话并返回结果
-                                await release_pool_session(current_session.get("session_id"))
-                                current_session = None
-
-                                logger.info(f"✅ Stream processing completed successfully (解析模式)")
-                                return full_response, conversation_id, task_id, parsed_events
+                                                            logger.debug(
+                                                                "   📝 Complete Message: %s", payload(text_content))
+                                    except Exception as parse_err:
+                                        logger.debug(f"解析事件失败，跳过: {str(parse_err)}")
+                                        continue
+                            finally:
+                                if capture is not None:
+                                    capture.close()
+                            if sse_decoder.done:
+                                logger.info("收到[DONE]标记，结束处理")
+
+                            # 成功处理完响应，生成结果并返回
+                            full_response = "".join(complete_response)
+                            logger.info("=" * 60)
+                            logger.info("📊 SSE STREAM SUMMARY (解析模式)")
+                            logger.info("=" * 60)
+                            logger.info(f"📈 Total Events Processed: {event_count}")
+                            logger.info(f"🆔 Conversation ID: {conversation_id}")
+                            logger.info(f"🆔 Task ID: {task_id}")
+                            logger.info(f"📝 Response Length: {len(full_response)} characters")
+                            logger.info(f"🎯 Parsed Events Count: {len(parsed_events)}")
+                            logger.info("=" * 60)
+
+                            # 成功完成，释放会话并返回结果
+                            await release_pool_session(current_session.get("session_id"))
+                            current_session = None
 
-                            # 错误处理（429等）
-                            error_text = await response.aread()
-                            error_content = error_text.decode('utf-8') if error_text else "No error content"
+                            logger.info(f"✅ Stream processing completed successfully (解析模式)")
+                            return full_response, conversation_id, task_id, parsed_events
+
+                        # 错误处理（429等）
+                        error_text = await response.aread()
+                        error_content = error_text.decode('utf-8') if error_text else "No error content"
+
+                        # 检查是否是账号被封禁错误 (403)
+                        is_blocked_error = (
+                                response.status_code == 403 and (
+                                ("Your account has been blocked" in error_content) or
+                                ("blocked from using AI features" in error_content)
+                        )
+                        )
+
+                        if is_blocked_error:
+                            logger.error(f"❌ 账号 {account_email} 已被封禁 (HTTP 403, 解析模式)")
+                            # 释放并标记为blocked
+                            if current_session:
+                                # 通知pool service标记账号
+                                try:
+                                    async with httpx.AsyncClient(timeout=5.0) as notify_client:
+                                        await notify_client.post(
+                                            "http://localhost:8019/api/accounts/mark_blocked",
+                                            json={"email": account_email}
+                                        )
+                                except:
+                                    pass
 
-                            # 检查是否是账号被封禁错误 (403)
-                            is_blocked_error = (
-                                    response.status_code == 403 and (
-                                    ("Your account has been blocked" in error_content) or
-                                    ("blocked from using AI features" in error_content)
-                            )
-                            )
+                                await release_pool_session(current_session.get("session_id"))
+                                current_session = None
 
-                            if is_blocked_error:
-                                logger.error(f"❌ 账号 {account_email} 已被封禁 (HTTP 403, 解析模式)")
-                                # 释放并标记为blocked
-                                if current_session:
-                                    # 通知pool service标记账号
-                                    try:
-                                        async with httpx.AsyncClient(timeout=5.0) as notify_client:
-                                            await notify_client.post(
-                                                "http://localhost:8019/api/accounts/mark_blocked",
-                                                json={"email": account_email}
-                                            )
-                                    except:
-                                        pass
-
-                                    await release_pool_session(current_session.get("session_id"))
-                                    current_session = None
-
-                                # 如果还有重试次数，获取新账号
-                                if attempt < (MAX_QUOTA_RETRIES - 1):
-                                    logger.warning(
-                                        f"账号被封(解析模式)，将获取新账号重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
-                                    await asyncio.sleep(RETRY_DELAY_SECONDS)
-                                    break  # 跳出代理循环，进入下一个attempt获取新账号
-                                else:
-                                    return f"❌ Account blocked after {MAX_QUOTA_RETRIES} attempts", None, None, []
-
-                            is_quota_error = ("No remaining quota" in error_content) or (
-                                    "No AI requests remaining" in error_content)
-
-                            if response.status_code == 429 and is_quota_error:
-                                if attempt < (MAX_QUOTA_RETRIES - 1):
-                                    logger.warning(
-                                        f"Warp API 返回 429 (配额用尽/解析模式)。将在 {RETRY_DELAY_SECONDS} 秒后强制获取新账号并重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
-                                    await asyncio.sleep(RETRY_DELAY_SECONDS)
-                                    # 跳出代理循环，进入下一个attempt获取新账号
-                                    break
-                                else:
-                                    # 所有账号都用尽了
-                                    await release_pool_session(current_session.get("session_id"))
-                                    current_session = None
-                                    return f"❌ API Error (HTTP {response.status_code}) after {MAX_QUOTA_RETRIES} attempts: {error_content}", None, None, []
+                            # 如果还有重试次数，获取新账号
+                            if attempt < (MAX_QUOTA_RETRIES - 1):
+                                logger.warning(
+                                    f"账号被封(解析模式)，将获取新账号重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
+                                await asyncio.sleep(RETRY_DELAY_SECONDS)
+                                break  # 跳出代理循环，进入下一个attempt获取新账号
+                            else:
+                                return f"❌ Account blocked after {MAX_QUOTA_RETRIES} attempts", None, None, []
 
-                            # 其他HTTP错误，尝试换代理
-                            logger.error(
-                                f"HTTP错误 {response.status_code}(解析模式)，尝试换代理 (proxy attempt {proxy_attempt + 1}/{max_proxy_retries})")
-                            if proxy_attempt < max_proxy_retries - 1:
-                                await asyncio.sleep(0.5)
-                                continue
+                        is_quota_error = ("No remaining quota" in error_content) or (
+                                "No AI requests remaining" in error_content)
 
+                        if response.status_code == 429 and is_quota_error:
                             if attempt < (MAX_QUOTA_RETRIES - 1):
-                                logger.warning(f"当前账号的所有代理都失败(解析模式)，将换新账号重试")
+                                logger.warning(
+                                    f"Warp API 返回 429 (配额用尽/解析模式)。将在 {RETRY_DELAY_SECONDS} 秒后强制获取新账号并重试 (第 {attempt + 2}/{MAX_QUOTA_RETRIES} 次)...")
+                                await asyncio.sleep(RETRY_DELAY_SECONDS)
+                                # 跳出代理循环，进入下一个attempt获取新账号
                                 break
+                            else:
+                                # 所有账号都用尽了
+                                await release_pool_session(current_session.get("session_id"))
+                                current_session = None
+                                return f"❌ API Error (HTTP {response.status_code}) after {MAX_QUOTA_RETRIES} attempts: {error_content}", None, None, []
 
-                            # 真正失败了
-                            await release_pool_session(current_session.get("session_id"))
-                            current_session = None
-                            return f"❌ API Error (HTTP {response.status_code}): {error_content}", None, None, []
+                        # 其他HTTP错误，尝试换代理
+                        logger.error(
+                            f"HTTP错误 {response.status_code}(解析模式)，尝试换代理 (proxy attempt {proxy_attempt + 1}/{max_proxy_retries})")
+                        if proxy_attempt < max_proxy_retries - 1:
+                            await asyncio.sleep(0.5)
+                            continue
+
+                        if attempt < (MAX_QUOTA_RETRIES - 1):
+                            logger.warning(f"当前账号的所有代理都失败(解析模式)，将换新账号重试")
+                            break
+
+                        # 真正失败了
+                        await release_pool_session(current_session.get("session_id"))
+                        current_session = None
+                        return f"❌ API Error (HTTP {response.status_code}): {error_content}", None, None, []
 
                 except (httpx.ConnectError, httpx.ProxyError, httpx.RemoteProtocolError) as ssl_error:
                     logger.warning(
@@ -787,3 +729,310 @@ async def send_protobuf_to_warp_api_parsed(protobuf_bytes: bytes) -> None | tupl
         # 确保会话被释放
         if current_session:
             await release_pool_session(current_session.get("session_id"))
+
+
+class WarpStreamError(Exception):
+    """流式请求在全部重试后仍然失败"""
+
+
+async def stream_warp_event_bytes(protobuf_bytes: bytes) -> AsyncIterator[bytes]:
+    """
+    向 Warp API 发送请求并逐个产出 ResponseEvent 的原始 protobuf 字节。
+
+    包含代理轮换、账号封禁/额度用尽换号以及指数退避重试；全部失败时抛出 WarpStreamError。
+    """
+    from ..core.proxy_manager import AsyncProxyManager
+
+    proxy_manager = AsyncProxyManager()
+    max_proxy_retries = 7  # 增加到 7 次代理重试
+    max_attempts = 5
+
+    warp_url = CONFIG_WARP_URL
+
+    verify_opt = False  # 使用代理时关闭SSL验证
+    insecure_env = os.getenv("WARP_INSECURE_TLS", "").lower()
+    if insecure_env in ("1", "true", "yes"):
+        verify_opt = False
+        logger.warning("TLS verification disabled via WARP_INSECURE_TLS for Warp API stream endpoint")
+
+    jwt = None
+    last_error = None
+    trace = current_trace()
+    UPSTREAM_REQUEST_BYTES.observe(len(protobuf_bytes))
+
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            logger.info(f"开始第 {attempt + 1}/{max_attempts} 轮总体重试...")
+            # 指数退避：2秒、4秒、8秒
+            await asyncio.sleep(2.0 ** attempt)
+
+        for proxy_attempt in range(max_proxy_retries):
+            try:
+                # 获取新的代理
+                proxy_str = await proxy_manager.get_proxy()
+                proxy_config = None
+
+                if proxy_str:
+                    proxy_config = proxy_manager.format_proxy_for_httpx(proxy_str)
+
+                # 单次请求的超时配置（连接复用进程级共享的 HTTP/2 连接池）
+                request_timeout = httpx.Timeout(
+                    timeout=600.0,
+                    connect=15.0,  # 连接超时15秒
+                    read=120.0,  # 读取超时120秒
+                    write=15.0,  # 写入超时15秒
+                    pool=15.0  # 连接池超时15秒
+                )
+
+                if attempt == 0 or jwt is None:
+                    jwt = await get_valid_jwt()
+
+                headers = {
+                    "accept": "text/event-stream",
+                    "content-type": "application/x-protobuf",
+                    "x-warp-client-version": CLIENT_VERSION,
+                    "x-warp-os-category": OS_CATEGORY,
+                    "x-warp-os-name": OS_NAME,
+                    "x-warp-os-version": OS_VERSION,
+                    "authorization": f"Bearer {jwt}",
+                    "content-length": str(len(protobuf_bytes)),
+                }
+
+                # trust_env=False: 禁用环境代理，完全使用代码控制
+                t_send = time.perf_counter()
+                async with upstream_stream("POST", warp_url, proxy=proxy_config, verify=verify_opt,
+                                           trust_env=False, timeout=request_timeout,
+                                           headers=headers, content=protobuf_bytes) as response:
+                    UPSTREAM_CONNECT_SECONDS.observe(time.perf_counter() - t_send)
+                    if trace is not None:
+                        trace.record("upstream.connect", t_send, status=response.status_code,
+                                     attempt=attempt + 1, proxy_attempt=proxy_attempt + 1)
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        error_content = error_text.decode("utf-8") if error_text else ""
+
+                        # 检查是否是账号被封禁 (403)
+                        if response.status_code == 403 and (
+                                ("Your account has been blocked" in error_content) or
+                                ("blocked from using AI features" in error_content)
+                        ):
+                            logger.error(
+                                f"❌ 账号已被封禁 (HTTP 403, attempt {attempt + 1})。立即删除并获取新账号..."
+                            )
+                            UPSTREAM_RETRIES.labels(cause="blocked_403").inc()
+
+                            # 标记当前账号为blocked（如果有pool service）
+                            if jwt:
+                                try:
+                                    # 通知账号池服务该账号已被封
+                                    async with httpx.AsyncClient(timeout=5.0) as notify_client:
+                                        await notify_client.post(
+                                            "http://localhost:8019/api/accounts/mark_blocked",
+                                            json={"jwt_token": jwt[:50]}  # 只传部分token作为标识
+                                        )
+                                except Exception as e:
+                                    logger.warning(f"无法通知账号池服务: {e}")
+
+                            # 强制获取新账号，不再使用当前账号
+                            try:
+                                new_jwt = await acquire_pool_or_anonymous_token(force_new=True)
+                                if new_jwt:
+                                    jwt = new_jwt
+                                    logger.info("✅ 获取新账号token成功（账号被封后）")
+                                    # 跳出proxy循环，进入下一个attempt
+                                    break
+                            except Exception as e:
+                                logger.error(f"获取新账号失败: {e}")
+
+                            # 如果无法获取新账号或已是最后一次尝试，返回错误
+                            if attempt >= max_attempts - 1:
+                                raise WarpStreamError("Account blocked and unable to get new account")
+                            break  # 跳出proxy循环，用新账号重试
+
+                        # 429 且包含配额信息时，申请匿名token后重试
+                        elif response.status_code == 429 and (
+                                ("No remaining quota" in error_content) or
+                                ("No AI requests remaining" in error_content)
+                        ):
+                            logger.warning(
+                                f"Warp API 返回 429 (额度用尽, SSE 代理, attempt {attempt + 1})。尝试强制获取新账号token...")
+                            UPSTREAM_RETRIES.labels(cause="quota_429").inc()
+                            try:
+                                # force_new=True 强制获取新账号
+                                new_jwt = await acquire_pool_or_anonymous_token(force_new=True)
+                                if new_jwt:
+                                    jwt = new_jwt
+                                    logger.info("✅ 获取新账号token成功，将在下一轮重试")
+                                    # 跳出proxy循环，进入下一个attempt
+                                    break
+                            except Exception as e:
+                                logger.error(f"获取新token失败: {e}")
+
+                        # 其他HTTP错误，记录并继续尝试
+                        logger.error(
+                            f"Warp API HTTP error {response.status_code} (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {error_content[:300]}")
+                        last_error = f"HTTP {response.status_code}: {error_content[:100]}"
+                        UPSTREAM_RETRIES.labels(cause="http_error").inc()
+
+                        if proxy_attempt < max_proxy_retries - 1:
+                            continue  # 继续下一个proxy_attempt
+
+                        # 当前attempt的所有代理都失败，准备下一轮
+                        if attempt < max_attempts - 1:
+                            logger.info(f"第 {attempt + 1} 轮所有代理失败，准备下一轮...")
+                            break  # 跳出proxy循环
+
+                        # 真正失败了，返回错误
+                        raise WarpStreamError(f"HTTP {response.status_code} after {max_attempts} attempts")
+
+                    # 请求成功，处理SSE流
+                    logger.info(f"✅ Warp API SSE连接已建立: {warp_url}")
+                    logger.info(f"📦 请求字节数: {len(protobuf_bytes)}")
+                    logger.info(f"🔄 使用代理: {proxy_config if proxy_config else '直连'}")
+                    logger.info(
+                        f"🔢 尝试次数: attempt={attempt + 1}/{max_attempts}, proxy={proxy_attempt + 1}/{max_proxy_retries}")
+
+                    event_no = 0
+                    response_bytes = 0
+                    last_event_at = 0.0
+                    sse_decoder = SSEDecoder()
+                    chunks, capture = _response_chunks(response, protobuf_bytes, warp_url)
+                    try:
+                        async for raw_bytes in iter_sse_event_bytes(chunks, sse_decoder):
+                            now = time.perf_counter()
+                            if event_no:
+                                UPSTREAM_EVENT_GAP_SECONDS.observe(now - last_event_at)
+                            else:
+                                UPSTREAM_TTFB_SECONDS.observe(now - t_send)
+                                if trace is not None:
+                                    trace.record("upstream.first_event", t_send, now)
+                            last_event_at = now
+                            event_no += 1
+                            response_bytes += len(raw_bytes)
+                            yield raw_bytes
+                        successful = sse_decoder.done
+                    finally:
+                        if capture is not None:
+                            capture.close()
+
+                    # 检查是否成功接收到事件
+                    if event_no or successful:
+                        UPSTREAM_RESPONSE_BYTES.observe(response_bytes)
+                        if trace is not None and event_no:
+                            trace.record("upstream.last_event", t_send, last_event_at,
+                                         events=event_no, bytes=response_bytes)
+                        logger.info("=" * 60)
+                        logger.info("📊 SSE STREAM SUMMARY (代理)")
+                        logger.info("=" * 60)
+                        logger.info(f"📈 Total Events Forwarded: {event_no}")
+                        logger.info(f"🔄 使用代理: {proxy_config if proxy_config else '直连'}")
+                        logger.info(
+                            f"✅ 成功完成 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries})")
+                        logger.info("=" * 60)
+                        return  # 成功完成，直接返回
+
+                    # 没有收到任何事件，视为失败
+                    logger.warning(
+                        f"未收到任何事件，视为失败 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries})")
+                    last_error = "No events received"
+                    UPSTREAM_RETRIES.labels(cause="empty_stream").inc()
+                    if proxy_attempt < max_proxy_retries - 1:
+                        continue
+
+            except WarpStreamError:
+                raise
+
+            except (httpx.ConnectError, httpx.ProxyError, httpx.RemoteProtocolError) as ssl_error:
+                last_error = f"SSL/Proxy error: {str(ssl_error)}"
+                UPSTREAM_RETRIES.labels(cause="connect_error").inc()
+                logger.warning(
+                    f"SSE端点 SSL/代理错误 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {ssl_error}"
+                )
+                if proxy_attempt < max_proxy_retries - 1:
+                    continue  # 继续下一个proxy_attempt
+
+                # 当前attempt的所有代理都失败
+                if attempt < max_attempts - 1:
+                    logger.info(f"第 {attempt + 1} 轮所有代理因SSL/代理错误失败，尝试获取新token...")
+                    try:
+                        new_jwt = await acquire_pool_or_anonymous_token()
+                        if new_jwt:
+                            jwt = new_jwt
+                            logger.info("获取新token成功，将在下一轮重试")
+                    except Exception as token_error:
+                        logger.error(f"获取新token失败: {token_error}")
+                    break  # 跳出proxy循环，进入下一个attempt
+
+            except httpx.ReadTimeout as timeout_error:
+                last_error = f"Timeout: {str(timeout_error)}"
+                UPSTREAM_RETRIES.labels(cause="read_timeout").inc()
+                logger.warning(
+                    f"SSE端点超时 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {last_error}"
+                )
+                if proxy_attempt < max_proxy_retries - 1:
+                    continue
+
+            except httpx.WriteTimeout as write_timeout:
+                last_error = f"Write timeout: {str(write_timeout)}"
+                UPSTREAM_RETRIES.labels(cause="write_timeout").inc()
+                logger.warning(
+                    f"SSE端点写入超时 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {last_error}"
+                )
+                if proxy_attempt < max_proxy_retries - 1:
+                    continue
+
+            except Exception as e:
+                last_error = f"Unknown error: {str(e)}"
+                UPSTREAM_RETRIES.labels(cause="other").inc()
+                logger.error(
+                    f"SSE端点未知错误 (attempt {attempt + 1}/{max_attempts}, proxy {proxy_attempt + 1}/{max_proxy_retries}): {e}",
+                    exc_info=True)
+                if proxy_attempt < max_proxy_retries - 1:
+                    continue
+
+    # 所有尝试都失败了
+    logger.error(f"SSE端点在 {max_attempts} 轮尝试（每轮 {max_proxy_retries} 个代理）后完全失败")
+    raise WarpStreamError(f"All {max_attempts} attempts failed. Last error: {last_error}")
+
+
+async def stream_warp_events(protobuf_bytes: bytes) -> AsyncIterator[Dict[str, Any]]:
+    """
+    向 Warp API 发送请求并逐个产出已解析的事件：
+    {"event_number": n, "event_type": str, "parsed_data": dict}
+    """
+    event_no = 0
+    decode_seconds = EVENT_DECODE_SECONDS.labels(decoder="dict")
+    async for raw_bytes in stream_warp_event_bytes(protobuf_bytes):
+        started = time.perf_counter()
+        try:
+            event_data = protobuf_to_dict(raw_bytes, "warp.multi_agent.v1.ResponseEvent")
+        except Exception:
+            continue
+        decode_seconds.observe(time.perf_counter() - started)
+        event_no += 1
+        event_type = _get_event_type(event_data)
+        logger.debug("🔄 SSE Event #%d: %s ---- %s", event_no, event_type, payload(event_data))
+        yield {"event_number": event_no, "event_type": event_type, "parsed_data": event_data}
+
+
+async def stream_warp_event_records(protobuf_bytes: bytes) -> AsyncIterator[ResponseEventRecord]:
+    """
+    与 stream_warp_events 相同，但产出 ResponseEventRecord（类型化快速解析），
+    完整事件字典只在 DEBUG 日志开启时构建
+    """
+    event_no = 0
+    decode_seconds = EVENT_DECODE_SECONDS.labels(decoder="typed")
+    async for raw_bytes in stream_warp_event_bytes(protobuf_bytes):
+        started = time.perf_counter()
+        try:
+            record = parse_event_record(raw_bytes)
+        except Exception as e:
+            logger.debug(f"ResponseEvent 解析失败，已跳过: {e}")
+            continue
+        decode_seconds.observe(time.perf_counter() - started)
+        event_no += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            event_data = record.to_dict()
+            logger.debug("🔄 SSE Event #%d: %s ---- %s", event_no, _get_event_type(event_data),
+                         payload(event_data))
+        yield record
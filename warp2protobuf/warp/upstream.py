@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游 Warp API 连接池
+
+进程级共享的 httpx.AsyncClient 注册表。按 (proxy, verify, trust_env) 复用 HTTP/2 客户端，
+避免每次请求都重新进行 TCP+TLS+ALPN 握手。
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from ..config.settings import (
+    UPSTREAM_IDLE_EXPIRY,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE,
+    UPSTREAM_MAX_STREAMS_PER_CONNECTION,
+)
+from ..core.logging import logger
+
+_ClientKey = Tuple[Optional[str], bool, bool]
+
+
+class _PooledClient:
+    """注册表中的一个客户端及其并发流计数"""
+
+    __slots__ = ("client", "streams", "active", "last_used")
+
+    def __init__(self, client: httpx.AsyncClient, max_streams: int):
+        self.client = client
+        self.streams = asyncio.Semaphore(max_streams)
+        self.active = 0
+        self.last_used = time.monotonic()
+
+
+_clients: Dict[_ClientKey, _PooledClient] = {}
+
+
+def _create_client(proxy: Optional[str], verify: bool, trust_env: bool) -> httpx.AsyncClient:
+    client_config = {
+        "http2": True,
+        "timeout": httpx.Timeout(60.0),
+        "verify": verify,
+        "trust_env": trust_env,
+        "limits": httpx.Limits(
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+    }
+    if proxy:
+        client_config["proxy"] = proxy
+    return httpx.AsyncClient(**client_config)
+
+
+def _get_entry(proxy: Optional[str], verify: bool, trust_env: bool) -> _PooledClient:
+    key = (proxy, verify, trust_env)
+    entry = _clients.get(key)
+    if entry is None or entry.client.is_closed:
+        entry = _PooledClient(
+            _create_client(proxy, verify, trust_env),
+            max(1, UPSTREAM_MAX_CONNECTIONS * UPSTREAM_MAX_STREAMS_PER_CONNECTION),
+        )
+        _clients[key] = entry
+        logger.info(f"创建上游连接池客户端: proxy={proxy or '直连'}, verify={verify}, trust_env={trust_env}")
+    return entry
+
+
+def get_upstream_client(proxy: Optional[str] = None, verify: bool = False, trust_env: bool = True) -> httpx.AsyncClient:
+    """获取（或创建）共享的上游 HTTP/2 客户端"""
+    entry = _get_entry(proxy, verify, trust_env)
+    entry.last_used = time.monotonic()
+    return entry.client
+
+
+async def _reap_idle_clients() -> None:
+    """关闭超过 UPSTREAM_IDLE_EXPIRY 未使用且没有进行中请求的客户端"""
+    if UPSTREAM_IDLE_EXPIRY <= 0:
+        return
+    now = time.monotonic()
+    expired = [k for k, e in _clients.items() if e.active == 0 and now - e.last_used > UPSTREAM_IDLE_EXPIRY]
+    for key in expired:
+        entry = _clients.pop(key)
+        try:
+            await entry.client.aclose()
+            logger.info(f"关闭空闲上游客户端: proxy={key[0] or '直连'}")
+        except Exception as e:
+            logger.warning(f"关闭空闲上游客户端失败: {e}")
+
+
+@asynccontextmanager
+async def upstream_stream(
+    method: str,
+    url: str,
+    *,
+    proxy: Optional[str] = None,
+    verify: bool = False,
+    trust_env: bool = True,
+    **kwargs,
+) -> AsyncIterator[httpx.Response]:
+    """通过共享客户端发起流式请求，受每客户端最大并发流数限制"""
+    await _reap_idle_clients()
+    entry = _get_entry(proxy, verify, trust_env)
+    async with entry.streams:
+        entry.active += 1
+        try:
+            async with entry.client.stream(method, url, **kwargs) as response:
+                yield response
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+
+
+async def close_upstream_clients() -> None:
+    """关闭全部上游客户端（用于应用关闭阶段）"""
+    entries = list(_clients.values())
+    _clients.clear()
+    for entry in entries:
+        try:
+            await entry.client.aclose()
+        except Exception as e:
+            logger.warning(f"关闭上游客户端失败: {e}")
+    if entries:
+        logger.info(f"已关闭 {len(entries)} 个上游连接池客户端")